@@ -5,5 +5,6 @@ from ._oss_connector import (
     new_oss_connector,
 )
 from .oss_model_connector import OssModelConnector
+from ._oss_metrics import stats_to_prometheus
 
-__all__ = ["DataObject", "DataObjectInfo", "Connector", "new_oss_connector", "OssModelConnector"]
+__all__ = ["DataObject", "DataObjectInfo", "Connector", "new_oss_connector", "OssModelConnector", "stats_to_prometheus"]
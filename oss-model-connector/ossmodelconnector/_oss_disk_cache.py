@@ -0,0 +1,177 @@
+from typing import Any, Callable, Iterable, List, Optional, Set, Tuple
+import hashlib
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+# bytes copied at once into the cache files
+DISK_CACHE_BLOCK_SIZE = 8 << 20
+
+# bytes at the end of cached files compared with the objects in OSS
+DISK_CACHE_VERIFY_SIZE = 4 << 10
+
+_TMP_SUFFIX = ".tmp"
+
+
+class DiskCache:
+    """
+    Persistent cache of objects on local disk, reused across process restarts.
+
+    Each object is a file named from its key and size, so that an object changed in OSS (with a new size) is not
+    served from a stale file, and files are validated with a list of the objects. As listings carry no version,
+    'verify' also compares the end of a file with the object, which catches most objects overwritten in place
+    with the same size (e.g. checkpoints of the same model) but not all changes. Files are written to a temporary
+    name and renamed once complete. Files are evicted least recently used first, when their total size exceeds
+    'max_size', except those linked into a directory ('link').
+
+    Args:
+        cache_dir(str): Directory of the cache files, e.g. on a local NVMe disk.
+        max_size(int): Total size in bytes of the cache files, 0 for no limit.
+        metrics: Metrics of the connector.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int, metrics: Any):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._metrics = metrics
+        self._stop = threading.Event()
+        self._thread = None
+        # files linked by symbolic links, which do not count in the number of links of the files
+        self._pinned: Set[str] = set()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _key_hash(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def path(self, key: str, size: int) -> str:
+        return os.path.join(self.cache_dir, "%s-%d" % (self._key_hash(key), size))
+
+    def lookup(self, key: str, size: int) -> Optional[str]:
+        """Returns the path of the cached object, or None if the object of this size is not cached."""
+        path = self.path(key, size)
+        try:
+            # the modification time orders the eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def verify(self, path: str, size: int, read_object: Callable[[int, int], bytes]) -> bool:
+        """Returns whether the end of the cached file matches the object, read by 'read_object' (offset, size).
+        A file which does not match is removed, unless it is linked by a symbolic link."""
+        n = min(size, DISK_CACHE_VERIFY_SIZE)
+        if n == 0:
+            return True
+        with open(path, "rb") as f:
+            f.seek(size - n)
+            cached = f.read(n)
+        if cached == read_object(size - n, n):
+            return True
+        log.info("disk cache file %s differs from the object", path)
+        self._metrics.inc("disk_cache_stale")
+        if path not in self._pinned:
+            os.remove(path)
+        return False
+
+    def link(self, path: str, link: str):
+        """Links the cached file 'path' as 'link'. Hard links keep the file from eviction while the link exists,
+        symbolic links (across file systems) for the life of the cache."""
+        try:
+            os.link(path, link)
+        except OSError:
+            os.symlink(path, link)
+            self._pinned.add(path)
+
+    def store(self, key: str, size: int, open_object: Callable[[], Any]):
+        """Copies the object into the cache, and removes the files of other sizes of the same key."""
+        path = self.path(key, size)
+        tmp_path = "%s.%d%s" % (path, os.getpid(), _TMP_SUFFIX)
+        buffer = memoryview(bytearray(min(DISK_CACHE_BLOCK_SIZE, max(size, 1))))
+        written = 0
+        try:
+            object = open_object()
+            try:
+                with open(tmp_path, "wb") as f:
+                    while written < size and not self._stop.is_set():
+                        n = object.readinto(buffer[:min(len(buffer), size - written)])
+                        if n <= 0:
+                            break
+                        f.write(buffer[:n])
+                        written += n
+            finally:
+                object.close()
+            if written != size:
+                raise IOError("read %d of %d bytes" % (written, size))
+            os.rename(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._metrics.inc("disk_cache_stored_bytes", size)
+        prefix = self._key_hash(key) + "-"
+        for name in os.listdir(self.cache_dir):
+            other = os.path.join(self.cache_dir, name)
+            if name.startswith(prefix) and not name.endswith(_TMP_SUFFIX) and other != path and other not in self._pinned:
+                os.remove(other)
+
+    def evict(self, keep: Set[str] = frozenset()):
+        """Removes the least recently used files until their total size is within 'max_size', except 'keep' and
+        linked files."""
+        if self.max_size <= 0:
+            return
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(_TMP_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, st.st_nlink, path))
+        total = sum(size for _, size, _, _ in files)
+        for _, size, nlink, path in sorted(files):
+            if total <= self.max_size:
+                break
+            if path in keep or path in self._pinned or nlink > 1:
+                # in use by a prepared directory
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._metrics.inc("disk_cache_evicted_bytes", size)
+
+    def _fill(self, objects: List[Tuple[str, int, Callable[[], Any]]], keep: Set[str]):
+        for key, size, open_object in objects:
+            if self._stop.is_set():
+                return
+            if self.lookup(key, size) is not None:
+                continue
+            try:
+                with self._metrics.timed("disk_cache_store"):
+                    self.store(key, size, open_object)
+            except Exception as e:
+                log.warning("failed to store %s in disk cache: %s", key, e)
+                continue
+            self.evict(keep)
+        log.info("disk cache filled with %d objects", len(objects))
+
+    def fill_async(self, objects: Iterable[Tuple[str, int, Callable[[], Any]]]):
+        """Stores the objects (key, size, open_object) in a background thread."""
+        self.stop()
+        objects = list(objects)
+        keep = set(self.path(key, size) for key, size, _ in objects)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._fill, args=(objects, keep), name="oss-disk-cache-fill", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
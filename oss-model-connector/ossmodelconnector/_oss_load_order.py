@@ -0,0 +1,80 @@
+from typing import Dict, List, Tuple, Any
+import json
+import re
+import struct
+
+SAFETENSORS_INDEX = "model.safetensors.index.json"
+
+# the first match is the outermost index, e.g. the block of 'encoder.block.0.layer.1.weight'
+_LAYER_PATTERN = re.compile(r"\.(?:layers|h|blocks|block|layer)\.(\d+)\.")
+
+
+def tensor_sort_key(name: str, position: int) -> Tuple[int, int, int]:
+    """
+    Returns the sort key of a tensor in the order frameworks load a model: embeddings, then layers by index,
+    then the remaining tensors (final norm, lm_head), each group in the order of 'position'.
+
+    Args:
+        name(str): Name of the tensor.
+        position(int): Position of the tensor in the index (or in the safetensors header).
+
+    Returns:
+        Tuple: The sort key.
+    """
+    match = _LAYER_PATTERN.search(name)
+    if match is not None:
+        return (1, int(match.group(1)), position)
+    if "embed" in name or "wte" in name or "wpe" in name:
+        return (0, 0, position)
+    return (2, 0, position)
+
+
+def read_safetensors_header(file: Any) -> Tuple[int, Dict[str, Tuple[int, int]]]:
+    """
+    Reads the header of a safetensors file from the start of 'file'.
+
+    Args:
+        file: Stream of the safetensors file.
+
+    Returns:
+        Tuple: Size of the header (including its 8 bytes length), and the byte range (start, end) in the file of each tensor.
+    """
+    header_size = struct.unpack("<Q", file.read(8))[0]
+    header = json.loads(file.read(header_size))
+    data_start = 8 + header_size
+    ranges = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        start, end = info["data_offsets"]
+        ranges[name] = (data_start + start, data_start + end)
+    return data_start, ranges
+
+
+def plan_load_order(weight_map: Dict[str, str], headers: Dict[str, Tuple[int, Dict[str, Tuple[int, int]]]]) -> List[Tuple[str, int, int]]:
+    """
+    Plans the byte ranges of a safetensors model in consumption order.
+
+    Args:
+        weight_map(Dict): File of each tensor, in the order of the index ('weight_map' of model.safetensors.index.json).
+        headers(Dict): Header size and tensor ranges of each file, see 'read_safetensors_header'.
+
+    Returns:
+        List: (file, start, end) ranges, headers first, then tensors in the order of 'tensor_sort_key',
+              contiguous ranges of a file merged.
+    """
+    ranges = []
+    for name, (header_size, _) in headers.items():
+        ranges.append((name, 0, header_size))
+    order = sorted(enumerate(weight_map.items()), key=lambda item: tensor_sort_key(item[1][0], item[0]))
+    for _, (tensor, file) in order:
+        tensor_range = headers.get(file, (0, {}))[1].get(tensor)
+        if tensor_range is None:
+            continue
+        start, end = tensor_range
+        last = ranges[-1] if ranges else None
+        if last is not None and last[0] == file and last[2] == start:
+            ranges[-1] = (file, last[1], end)
+        else:
+            ranges.append((file, start, end))
+    return ranges
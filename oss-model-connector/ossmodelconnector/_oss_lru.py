@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from typing import Optional
+import threading
+
+
+class LruCache:
+    """
+    Thread-safe in-memory cache of object data keyed by URI, evicting the least recently used beyond 'max_bytes'.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uri: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(uri)
+            if data is not None:
+                self._items.move_to_end(uri)
+            return data
+
+    def put(self, uri: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(uri, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._items[uri] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def remove(self, uri: str):
+        with self._lock:
+            data = self._items.pop(uri, None)
+            if data is not None:
+                self.nbytes -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+from typing import Dict, Any
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """
+    Thread-safe latency histograms and error counts per op, counters and gauges of a connector.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def observe(self, op: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self._ops.get(op)
+            if stats is None:
+                stats = {"count": 0, "errors": 0, "seconds_sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)}
+                self._ops[op] = stats
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["seconds_sum"] += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + value
+
+    @contextmanager
+    def timed(self, op: str):
+        self.add_gauge("in_flight", 1)
+        start_time = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(op, time.perf_counter() - start_time, error)
+            self.add_gauge("in_flight", -1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ops": {op: dict(stats, buckets=list(stats["buckets"])) for op, stats in self._ops.items()},
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+            }
+
+
+def stats_to_prometheus(stats: Dict[str, Any], prefix: str = "oss_model_connector", labels: Dict[str, str] = None) -> str:
+    """
+    Formats stats returned by 'OssModelConnector.get_stats' in the Prometheus text exposition format.
+
+    Args:
+        stats(Dict): Stats returned by 'get_stats'.
+        prefix(str, optional): Prefix of the metric names. Defaults to "oss_model_connector".
+        labels(Dict, optional): Labels added to all the metrics. Defaults to None.
+
+    Returns:
+        str: The metrics in Prometheus text format.
+    """
+    base = dict(labels or {})
+
+    def format_labels(extra: Dict[str, str]) -> str:
+        items = dict(base, **extra)
+        if not items:
+            return ""
+        return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in sorted(items.items())) + "}"
+
+    lines = []
+    ops = stats.get("ops", {})
+    if ops:
+        name = prefix + "_op_latency_seconds"
+        lines.append("# HELP %s Latency of OSS operations." % name)
+        lines.append("# TYPE %s histogram" % name)
+        for op, op_stats in sorted(ops.items()):
+            for bound, count in zip(LATENCY_BUCKETS, op_stats["buckets"]):
+                lines.append("%s_bucket%s %d" % (name, format_labels({"op": op, "le": repr(bound)}), count))
+            lines.append("%s_bucket%s %d" % (name, format_labels({"op": op, "le": "+Inf"}), op_stats["count"]))
+            lines.append("%s_sum%s %f" % (name, format_labels({"op": op}), op_stats["seconds_sum"]))
+            lines.append("%s_count%s %d" % (name, format_labels({"op": op}), op_stats["count"]))
+        name = prefix + "_op_errors_total"
+        lines.append("# TYPE %s counter" % name)
+        for op, op_stats in sorted(ops.items()):
+            lines.append("%s%s %d" % (name, format_labels({"op": op}), op_stats["errors"]))
+    for counter, value in sorted(stats.get("counters", {}).items()):
+        name = "%s_%s_total" % (prefix, counter)
+        lines.append("# TYPE %s counter" % name)
+        lines.append("%s%s %s" % (name, format_labels({}), value))
+    for gauge, value in sorted(stats.get("gauges", {}).items()):
+        name = "%s_%s" % (prefix, gauge)
+        lines.append("# TYPE %s gauge" % name)
+        lines.append("%s%s %s" % (name, format_labels({}), value))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,48 @@
+from typing import Tuple
+import ctypes
+import ctypes.util
+import mmap
+
+PAGE_SIZE = mmap.PAGESIZE
+
+# advices of madvise(2) on Linux
+ADVICES = {
+    "normal": 0,
+    "random": 1,
+    "sequential": 2,
+    "willneed": 3,
+    "dontneed": 4,
+}
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+_libc.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+
+
+def page_range(address: int, start: int, end: int) -> Tuple[int, int]:
+    """Returns the address and length of the pages covering [start, end) of the mapping at 'address'."""
+    first = (address + start) // PAGE_SIZE * PAGE_SIZE
+    last = (address + end + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+    return first, last - first
+
+
+def madvise(address: int, start: int, end: int, advice: str):
+    """Gives the advice (see 'ADVICES') for the pages of [start, end) of the mapping at 'address'."""
+    if advice not in ADVICES:
+        raise ValueError("unknown advice %r, expected one of %s" % (advice, ", ".join(ADVICES)))
+    first, length = page_range(address, start, end)
+    if length > 0 and _libc.madvise(first, length, ADVICES[advice]) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, "madvise failed")
+
+
+def mincore(address: int, start: int, end: int) -> bytearray:
+    """Returns a byte per page of [start, end) of the mapping at 'address', whose lowest bit is set if resident."""
+    first, length = page_range(address, start, end)
+    vec = bytearray(length // PAGE_SIZE)
+    if length > 0:
+        buffer = (ctypes.c_ubyte * len(vec)).from_buffer(vec)
+        if _libc.mincore(first, length, buffer) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "mincore failed")
+    return vec
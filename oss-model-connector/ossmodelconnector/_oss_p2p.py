@@ -0,0 +1,249 @@
+from typing import Any, Callable, Dict, List, Tuple
+import errno
+import hashlib
+import hmac
+import json
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+
+from ._oss_shared_cache import SharedCache
+
+log = logging.getLogger(__name__)
+
+# length of the body and its HMAC-SHA256 with the token of the group
+_REQUEST_HEADER = struct.Struct("<I32s")
+_RESPONSE_HEADER = struct.Struct("<q")
+# responses which are not a chunk
+_FAILED = -1
+_NOT_SERVED = -2
+
+# bytes of a request body, requests are a few keys
+MAX_REQUEST_SIZE = 16 << 10
+# seconds after which a request is rejected, so that a captured request can not be replayed later
+MAX_REQUEST_AGE = 300.0
+
+
+def _parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def _recv_exactly(sock: socket.socket, buffer: memoryview):
+    received = 0
+    while received < len(buffer):
+        n = sock.recv_into(buffer[received:])
+        if n == 0:
+            raise ConnectionError("connection closed by peer")
+        received += n
+
+
+def _sign(token: bytes, body: bytes) -> bytes:
+    return hmac.new(token, body, hashlib.sha256).digest()
+
+
+class _ChunkHandler(socketserver.BaseRequestHandler):
+    def _read_request(self) -> Dict[str, Any]:
+        group = self.server.group
+        header = bytearray(_REQUEST_HEADER.size)
+        _recv_exactly(self.request, memoryview(header))
+        length, mac = _REQUEST_HEADER.unpack(header)
+        if length > MAX_REQUEST_SIZE:
+            raise ValueError("request of %d bytes" % length)
+        body = bytearray(length)
+        _recv_exactly(self.request, memoryview(body))
+        if not hmac.compare_digest(mac, _sign(group.token, bytes(body))):
+            raise PermissionError("bad request signature")
+        request = json.loads(body)
+        if abs(time.time() - float(request["time"])) > MAX_REQUEST_AGE:
+            raise PermissionError("expired request")
+        return request
+
+    def handle(self):
+        group = self.server.group
+        try:
+            request = self._read_request()
+        except Exception as e:
+            # unauthenticated peers get no response
+            log.warning("rejected request of %s: %s", self.client_address, e)
+            group.metrics.inc("p2p_rejected_requests")
+            return
+        key = request["key"]
+        if not group.serves(key):
+            # not prepared by this node (yet)
+            self.request.sendall(_RESPONSE_HEADER.pack(_NOT_SERVED))
+            return
+        entry = None
+        try:
+            chunk = int(request["chunk"])
+            # the size is the one of the local entry or of the object in OSS, never the one of the request
+            entry = group.cache.get(key)
+            if entry is None:
+                object = group.open_object(key)
+                entry = group.cache.entry(key, object.size(), lambda: group.open_object(key), object)
+            if int(request["size"]) != entry.size:
+                raise ValueError("size %s of %s differs from %d" % (request["size"], key, entry.size))
+            if not 0 <= chunk < entry.chunks:
+                raise ValueError("chunk %d of %s out of range" % (chunk, key))
+            start, end = entry.chunk_range(chunk)
+            # chunks are served by their owner, which fetches them from OSS if needed, filled chunks without locking
+            if not entry.done(chunk):
+                entry.fill(start, end)
+        except Exception as e:
+            log.warning("failed to serve chunk to %s: %s", self.client_address, e)
+            self.request.sendall(_RESPONSE_HEADER.pack(_FAILED))
+            if entry is not None:
+                entry.release()
+            return
+        try:
+            with entry.view() as data:
+                self.request.sendall(_RESPONSE_HEADER.pack(end - start))
+                self.request.sendall(data[start:end])
+        finally:
+            entry.release()
+        group.metrics.inc("p2p_served_bytes", end - start)
+
+
+class _ChunkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def server_bind(self):
+        # the processes of a node (e.g. tensor parallel ranks) listen on its address together, the kernel spreads
+        # the connections over them, and any of them serves the chunks from the shared cache of the node
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class PeerGroup:
+    """
+    Nodes sharing the chunks of their shared caches over TCP, so that a model is fetched from OSS about once per group.
+
+    Each chunk of an object has an owner in the group, assigned from the key of the object and the index of the chunk,
+    so that the chunks of a model are spread over the nodes. A node fetches the chunks it owns from OSS, and the
+    other chunks from their owner, which fetches them from OSS first if needed. If the owner cannot be reached
+    within 'timeout', the chunk is fetched from OSS, and so are the chunks of this owner for the next 'backoff'
+    seconds; after that, a single connection attempt is made before falling back again.
+
+    The chunk server listens on the address of this node only, with SO_REUSEPORT so that every process of the node
+    (sharing its cache) listens on it: connections are spread over them, and the node keeps serving as long as one
+    of them runs. Without SO_REUSEPORT, or if another user holds the address, the process serves nothing and relies
+    on the process holding the address. Requests are signed with HMAC-SHA256 of 'token',
+    those with a bad signature or older than MAX_REQUEST_AGE are dropped, and only objects under the prefixes
+    passed to 'serve' are served, with their size from the local cache or from OSS. A node asked for an object
+    it does not serve yet answers so, and the requester retries within 'timeout'.
+
+    Args:
+        peers(List[str]): Addresses ("host:port") of the nodes of the group, the same list on every node.
+        rank(int): Index of this node in 'peers', its chunk server listens on its address.
+        cache(SharedCache): Shared cache of this node.
+        open_object(Callable): Opens an object in OSS by key, without prefetch.
+        metrics: Metrics of the connector.
+        token(str): Secret shared by the nodes of the group, which authenticates their requests.
+        timeout(float): Seconds to wait for the owner of a chunk, before falling back to OSS.
+        backoff(float): Seconds during which chunks of an owner which failed are fetched from OSS directly.
+    """
+
+    def __init__(self, peers: List[str], rank: int, cache: SharedCache, open_object: Callable[[str], Any],
+                 metrics: Any, token: str, timeout: float = 60.0, backoff: float = 30.0):
+        if not 0 <= rank < len(peers):
+            raise ValueError("rank %d out of range of %d peers" % (rank, len(peers)))
+        if not token:
+            raise ValueError("token must be non-empty")
+        self.peers = peers
+        self.rank = rank
+        self.cache = cache
+        self.open_object = open_object
+        self.metrics = metrics
+        self.token = token.encode() if isinstance(token, str) else bytes(token)
+        self.timeout = timeout
+        self.backoff = backoff
+        self._prefixes = ()
+        # owner -> time until which its chunks are fetched from OSS
+        self._failed_until: Dict[int, float] = {}
+        self._server = None
+        try:
+            self._server = _ChunkServer(_parse_address(peers[rank]), _ChunkHandler)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE:
+                raise
+            log.info("chunk server address %s is used by another process, not serving from this process", peers[rank])
+        if self._server is not None:
+            self._server.group = self
+            self._thread = threading.Thread(target=self._server.serve_forever, name="oss-p2p-server", daemon=True)
+            self._thread.start()
+        cache.fetch_remote = self.fetch
+
+    def serve(self, prefix: str):
+        """Serves the chunks of the objects whose key starts with 'prefix', e.g. a prepared directory."""
+        if not prefix.startswith(self._prefixes):
+            self._prefixes += (prefix,)
+
+    def serves(self, key: str) -> bool:
+        return key.startswith(self._prefixes)
+
+    def owner(self, key: str, chunk: int) -> int:
+        return (zlib.crc32(key.encode()) + chunk) % len(self.peers)
+
+    def _connect(self, owner: int) -> socket.socket:
+        # peers of a rollout start at about the same time, wait for their servers unless they failed already
+        deadline = time.monotonic() + (0.0 if owner in self._failed_until else self.timeout)
+        while True:
+            try:
+                return socket.create_connection(_parse_address(self.peers[owner]), timeout=self.timeout)
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+    def _request(self, owner: int, key: str, size: int, chunk: int, buffer: memoryview) -> bool:
+        # returns False if the owner does not serve the object (yet)
+        with self._connect(owner) as sock:
+            body = json.dumps({"key": key, "size": size, "chunk": chunk, "time": time.time()}).encode()
+            sock.sendall(_REQUEST_HEADER.pack(len(body), _sign(self.token, body)) + body)
+            header = bytearray(_RESPONSE_HEADER.size)
+            _recv_exactly(sock, memoryview(header))
+            length = _RESPONSE_HEADER.unpack(header)[0]
+            if length == _NOT_SERVED:
+                return False
+            if length != len(buffer):
+                raise IOError("peer failed to serve the chunk")
+            _recv_exactly(sock, buffer)
+        return True
+
+    def fetch(self, key: str, size: int, chunk: int, buffer: memoryview) -> bool:
+        """Fetches a chunk from its owner into 'buffer', returns False if this node is the owner or on failure."""
+        owner = self.owner(key, chunk)
+        if owner == self.rank or not self.serves(key):
+            return False
+        if time.monotonic() < self._failed_until.get(owner, 0.0):
+            self.metrics.inc("p2p_fallbacks")
+            return False
+        try:
+            with self.metrics.timed("p2p_fetch"):
+                # the owner may prepare the directory a bit later than this node
+                deadline = time.monotonic() + self.timeout
+                while not self._request(owner, key, size, chunk, buffer):
+                    if time.monotonic() >= deadline:
+                        raise IOError("peer does not serve %s" % key)
+                    time.sleep(0.2)
+        except Exception as e:
+            log.warning("failed to fetch chunk %d of %s from peer %s, fetching from OSS for %.0f s: %s",
+                        chunk, key, self.peers[owner], self.backoff, e)
+            self._failed_until[owner] = time.monotonic() + self.backoff
+            self.metrics.inc("p2p_fallbacks")
+            return False
+        self._failed_until.pop(owner, None)
+        self.metrics.inc("p2p_received_bytes", len(buffer))
+        return True
+
+    def close(self):
+        self.cache.fetch_remote = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,181 @@
+from typing import Any, Callable, Dict, List, Tuple
+import ctypes
+import io
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# files up to this size are written into the prepared directory, larger ones are served from memory by the hooks
+PRELOAD_SMALL_FILE_SIZE = 64 << 20
+
+# bytes touched at once when warming preloaded files
+PRELOAD_CHUNK_SIZE = 8 << 20
+
+
+def map_address(address: int, size: int, owner: Any) -> memoryview:
+    """
+    Returns a view of the 'size' bytes at 'address' which keeps 'owner' alive: the ctypes array under the view is
+    the object of the view and of all its slices (and of tensors built on them), and it holds 'owner'.
+    """
+    array = (ctypes.c_ubyte * size).from_address(address)
+    array._owner = owner
+    return memoryview(array).cast("B")
+
+
+class _Mapping:
+    # a preloaded object, closed once no view of its memory is left rather than when its directory is released
+    def __init__(self, object: Any):
+        self.object = object
+        self.address = object.mmap()
+
+    def __del__(self):
+        self.object.close()
+
+
+class MappedObject(io.RawIOBase):
+    """
+    Read-only stream over the memory of a preloaded object, which can be opened many times without I/O.
+    """
+
+    def __init__(self, view: memoryview, address: int):
+        super().__init__()
+        self._view = view
+        self._address = address
+        self._pos = 0
+
+    def size(self) -> int:
+        return len(self._view)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        n = max(0, min(len(view), len(self._view) - self._pos))
+        view[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        data = bytes(self._view[self._pos:self._pos + max(0, size)])
+        self._pos += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read(-1)
+
+    def mmap(self) -> int:
+        return self._address
+
+
+class PreloadedDirectory:
+    """
+    Files of an OSS directory held in memory, loaded in background, to be prepared later without network I/O.
+
+    A background thread lists the directory, opens its files with prefetch in listing order, as long as their total
+    size is within 'memory_budget', and touches their memory until they are fully loaded. The views of a file (its
+    streams, the storages and tensors mapped from it) hold its memory, which is freed once the directory is released
+    and the last of them is gone.
+
+    Args:
+        uri(str): The URI (oss://{bucket}/{directory}/) of the directory.
+        list_files(Callable): Lists the relative path and size of the files of the directory.
+        open_object(Callable): Opens an object by URI with prefetch.
+        memory_budget(int): Total size in bytes of the files held in memory, 0 for no limit.
+        metrics: Metrics of the connector.
+    """
+
+    def __init__(self, uri: str, list_files: Callable[[], List[Tuple[str, int]]], open_object: Callable[[str], Any],
+                 memory_budget: int, metrics: Any):
+        self.uri = uri
+        self.files: List[Tuple[str, int]] = []
+        self.listed = threading.Event()
+        self.loaded = threading.Event()
+        self._list_files = list_files
+        self._open_object = open_object
+        self._memory_budget = memory_budget
+        self._metrics = metrics
+        self._objects: Dict[str, Tuple[memoryview, int]] = {}
+        self._listing_failed = False
+        self._stop = threading.Event()
+        self.nbytes = 0
+        self._thread = threading.Thread(target=self._load, name="oss-preload", daemon=True)
+        self._thread.start()
+
+    def wait_listed(self) -> bool:
+        """Waits for the listing of the directory, returns whether 'files' lists it (False if the listing failed)."""
+        self.listed.wait()
+        return not self._listing_failed
+
+    def _load(self):
+        try:
+            self.files = self._list_files()
+        except Exception as e:
+            log.warning("failed to list %s for preload: %s", self.uri, e)
+            self._listing_failed = True
+            return
+        finally:
+            self.listed.set()
+        try:
+            # prefetch follows the order of open calls
+            for name, size in self.files:
+                if self._stop.is_set():
+                    return
+                if size <= 0 or (self._memory_budget > 0 and self.nbytes + size > self._memory_budget):
+                    continue
+                mapping = _Mapping(self._open_object(self.uri + name))
+                self._objects[name] = (map_address(mapping.address, size, mapping), mapping.address)
+                self.nbytes += size
+        except Exception as e:
+            # files not opened are read from OSS when prepared
+            log.warning("failed to preload %s: %s", self.uri, e)
+            return
+        self._warm()
+
+    def _warm(self):
+        scratch = memoryview(bytearray(PRELOAD_CHUNK_SIZE))
+        try:
+            with self._metrics.timed("preload"):
+                for name, (view, _) in list(self._objects.items()):
+                    for offset in range(0, len(view), PRELOAD_CHUNK_SIZE):
+                        if self._stop.is_set():
+                            return
+                        n = min(PRELOAD_CHUNK_SIZE, len(view) - offset)
+                        scratch[:n] = view[offset:offset + n]
+                        self._metrics.inc("preloaded_bytes", n)
+            self.loaded.set()
+            log.info("preloaded %s, %d bytes in memory", self.uri, self.nbytes)
+        except Exception as e:
+            log.warning("failed to preload %s: %s", self.uri, e)
+
+    def get(self, name: str) -> MappedObject:
+        """Returns a stream of the file 'name' if it is held in memory, or None."""
+        entry = self._objects.get(name)
+        if entry is None:
+            return None
+        return MappedObject(entry[0], entry[1])
+
+    def release(self):
+        """Stops warming and drops the files of the directory: the memory of a file is freed right away unless
+        storages, tensors or streams still refer to it, then when the last of them is freed."""
+        self._stop.set()
+        self._thread.join()
+        # views are dropped, not released: streams of the files share them
+        self._objects = {}
@@ -0,0 +1,317 @@
+from typing import Any, Callable, Dict, Tuple
+import ctypes
+import fcntl
+import hashlib
+import io
+import mmap
+import os
+import threading
+
+# bytes fetched by each chunk of a shared cache entry
+SHARED_CHUNK_SIZE = 64 << 20
+
+_DONE = 1
+
+
+class SharedCacheEntry:
+    """
+    An object cached in a file shared by the processes of a host, e.g. the tensor parallel workers loading a model.
+
+    The data file is mapped by every process, so the object is in memory once per host. A state file holds a byte
+    per chunk, set once the chunk is written; a process fetches a chunk while holding the lock (lockf) of its state
+    byte, and a thread while holding the lock of the chunk in its process, so each chunk is fetched once, and
+    processes filling the same entry split the chunks between them. Only reads of the OSS object, shared by the
+    threads, are serialized by the process, so that remote fetches of different chunks run concurrently.
+
+    Users of the mapping hold a reference ('acquire', 'release'), the mappings and files are closed once the entry
+    is closed and no reference is held.
+
+    Args:
+        path(str): Path prefix of the data and state files.
+        key(str): Key of the object.
+        size(int): Size of the object.
+        open_object(Callable): Opens the object in OSS, without prefetch.
+        metrics: Metrics of the connector.
+        fetch_remote(Callable, optional): Fetches a chunk (key, size, chunk, buffer) from another source than OSS,
+            returns False to fall back to OSS.
+        object(optional): The object opened already, owned by the entry.
+    """
+
+    def __init__(self, path: str, key: str, size: int, open_object: Callable[[], Any], metrics: Any,
+                 fetch_remote: Callable[[str, int, int, memoryview], bool] = None, object: Any = None):
+        self.key = key
+        self.size = size
+        self._open_object = open_object
+        self._object = object
+        self._object_lock = threading.Lock()
+        self._metrics = metrics
+        self._fetch_remote = fetch_remote
+        self.chunks = (size + SHARED_CHUNK_SIZE - 1) // SHARED_CHUNK_SIZE
+        # locks of the state bytes (lockf) are per process, these serialize the threads of the process
+        self._chunk_locks = [threading.Lock() for _ in range(self.chunks)]
+        self._data_fd = os.open(path + ".data", os.O_RDWR | os.O_CREAT, 0o644)
+        self._state_fd = os.open(path + ".state", os.O_RDWR | os.O_CREAT, 0o644)
+        # extending files is idempotent, concurrent creators agree on the sizes
+        if os.fstat(self._data_fd).st_size < size:
+            os.ftruncate(self._data_fd, size)
+        if os.fstat(self._state_fd).st_size < self.chunks:
+            os.ftruncate(self._state_fd, self.chunks)
+        self._data = mmap.mmap(self._data_fd, size) if size > 0 else None
+        self._state = mmap.mmap(self._state_fd, self.chunks) if self.chunks > 0 else None
+        self._references = 0
+        self._closed = False
+        self._references_lock = threading.Lock()
+
+    def acquire(self) -> "SharedCacheEntry":
+        """Holds a reference to the mapping, which stays valid until 'release'."""
+        with self._references_lock:
+            if self._closed:
+                raise ValueError("shared cache entry of %s is closed" % self.key)
+            self._references += 1
+        return self
+
+    def release(self):
+        """Releases a reference held by 'acquire'."""
+        with self._references_lock:
+            self._references -= 1
+            unmap = self._closed and self._references == 0
+        if unmap:
+            self._unmap()
+
+    def done(self, chunk: int) -> bool:
+        """Returns whether the chunk is filled, by any process of the host."""
+        return self._state[chunk] == _DONE
+
+    def _fetch(self, chunk: int):
+        start, end = self.chunk_range(chunk)
+        view = memoryview(self._data)[start:end]
+        try:
+            # other processes and threads wait on the locks of the chunk, not on the OSS object, while it is fetched
+            # from a peer, whose server may need the OSS object of this process to serve another chunk
+            if self._fetch_remote is not None and self._fetch_remote(self.key, self.size, chunk, view):
+                self._state[chunk] = _DONE
+                return
+            with self._object_lock:
+                if self._object is None:
+                    self._object = self._open_object()
+                with self._metrics.timed("shared_cache_fetch"):
+                    self._object.seek(start, io.SEEK_SET)
+                    filled = 0
+                    while filled < end - start:
+                        n = self._object.readinto(view[filled:])
+                        if n <= 0:
+                            raise IOError("unexpected end of object at %d" % (start + filled))
+                        filled += n
+        finally:
+            view.release()
+        # the mappings are shared, the chunk is visible to the other processes once marked
+        self._state[chunk] = _DONE
+        self._metrics.inc("shared_cache_fetched_bytes", end - start)
+
+    def _fill_chunk(self, chunk: int, wait: bool) -> bool:
+        if self.done(chunk):
+            return True
+        chunk_lock = self._chunk_locks[chunk]
+        if not chunk_lock.acquire(blocking=wait):
+            # fetched by another thread
+            return False
+        try:
+            try:
+                fcntl.lockf(self._state_fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB, 1, chunk, os.SEEK_SET)
+            except OSError:
+                # fetched by another process
+                return False
+            try:
+                if not self.done(chunk):
+                    self._fetch(chunk)
+                elif wait:
+                    self._metrics.inc("shared_cache_waits")
+            finally:
+                fcntl.lockf(self._state_fd, fcntl.LOCK_UN, 1, chunk, os.SEEK_SET)
+        finally:
+            chunk_lock.release()
+        return True
+
+    def fill(self, start: int = 0, end: int = -1):
+        """Fills the chunks of the range [start, end), fetching those not fetched nor locked by another process first."""
+        if end < 0 or end > self.size:
+            end = self.size
+        if start >= end:
+            return
+        chunks = range(start // SHARED_CHUNK_SIZE, (end - 1) // SHARED_CHUNK_SIZE + 1)
+        pending = [chunk for chunk in chunks if not self._fill_chunk(chunk, wait=False)]
+        for chunk in pending:
+            self._fill_chunk(chunk, wait=True)
+
+    def address(self) -> int:
+        """Returns the address of the mapped data, 0 for an empty object."""
+        if self._data is None:
+            return 0
+        return ctypes.addressof(ctypes.c_char.from_buffer(self._data))
+
+    def view(self) -> memoryview:
+        if self._data is None:
+            return memoryview(b"")
+        return memoryview(self._data)
+
+    def chunk_range(self, chunk: int) -> Tuple[int, int]:
+        start = chunk * SHARED_CHUNK_SIZE
+        return start, min(start + SHARED_CHUNK_SIZE, self.size)
+
+    def close(self):
+        """Closes the OSS object, and the mappings and files once no reference is held."""
+        with self._object_lock:
+            if self._object is not None:
+                self._object.close()
+                self._object = None
+        with self._references_lock:
+            unmap = not self._closed and self._references == 0
+            self._closed = True
+        if unmap:
+            self._unmap()
+
+    def _unmap(self):
+        for mapping in (self._data, self._state):
+            if mapping is not None:
+                mapping.close()
+        self._data = None
+        self._state = None
+        os.close(self._data_fd)
+        os.close(self._state_fd)
+
+
+class SharedCacheObject(io.RawIOBase):
+    """
+    Read-only stream of a SharedCacheEntry, the chunks of each read are filled on demand.
+    The stream owns a reference to the entry, released when it is closed.
+    """
+
+    def __init__(self, entry: SharedCacheEntry):
+        super().__init__()
+        self._entry = entry
+        self._pos = 0
+
+    def close(self):
+        if not self.closed:
+            self._entry.release()
+        super().close()
+
+    def size(self) -> int:
+        return self._entry.size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._entry.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        n = max(0, min(len(view), self._entry.size - self._pos))
+        if n == 0:
+            return 0
+        self._entry.fill(self._pos, self._pos + n)
+        with self._entry.view() as data:
+            view[:n] = data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._entry.size - self._pos
+        buffer = bytearray(max(0, min(size, self._entry.size - self._pos)))
+        n = self.readinto(buffer)
+        return bytes(buffer[:n])
+
+    def readall(self) -> bytes:
+        return self.read(-1)
+
+    def fill(self, start: int = 0, end: int = -1):
+        """Fills the range [start, end) of the mapping, see 'SharedCacheEntry.fill'."""
+        self._entry.fill(start, end)
+
+    def mmap(self) -> int:
+        """Returns the address of the mapping, valid until the stream is closed. Pages are not filled: ranges
+        must be filled with 'fill' before they are accessed."""
+        return self._entry.address()
+
+
+class SharedCache:
+    """
+    Host-level cache of objects shared by processes, in files under 'cache_dir', e.g. on /dev/shm.
+
+    Entries are keyed by the key of the object (its OSS URI) and its size. The files stay after the processes exit,
+    so that processes started later reuse them; 'clear' removes them. As OSS listings carry no version, an object
+    overwritten in OSS with the same size is served from the files until they are removed.
+
+    Args:
+        cache_dir(str): Directory of the cache files.
+        metrics: Metrics of the connector.
+        fetch_remote(Callable, optional): Fetches chunks from another source than OSS, see 'SharedCacheEntry'.
+    """
+
+    def __init__(self, cache_dir: str, metrics: Any, fetch_remote: Callable[[str, int, int, memoryview], bool] = None):
+        self.cache_dir = cache_dir
+        self.fetch_remote = fetch_remote
+        self._metrics = metrics
+        self._entries: Dict[str, SharedCacheEntry] = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> SharedCacheEntry:
+        """Returns the entry of this process of the object 'key' with a reference held for the caller, or None."""
+        with self._lock:
+            # the latest entry if the object changed size
+            for entry in reversed(list(self._entries.values())):
+                if entry.key == key:
+                    return entry.acquire()
+        return None
+
+    def entry(self, key: str, size: int, open_object: Callable[[], Any], object: Any = None) -> SharedCacheEntry:
+        """Returns the entry of the object 'key' of 'size' with a reference held for the caller, see
+        'SharedCacheEntry.acquire'. 'object', the object opened already if any, is owned by the entry if it is
+        created, closed otherwise."""
+        name = "%s-%d" % (hashlib.sha1(key.encode()).hexdigest(), size)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = SharedCacheEntry(os.path.join(self.cache_dir, name), key, size, open_object, self._metrics,
+                                         self.fetch_remote, object)
+                self._entries[name] = entry
+                return entry.acquire()
+            entry.acquire()
+        if object is not None:
+            object.close()
+        return entry
+
+    def release(self, prefix: str):
+        """Closes the entries of this process whose key starts with 'prefix', their files stay for other processes.
+        The mappings of an entry stay valid until the streams of the entry are closed."""
+        with self._lock:
+            names = [name for name, entry in self._entries.items() if entry.key.startswith(prefix)]
+            for name in names:
+                self._entries.pop(name).close()
+
+    def close(self):
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        for entry in entries.values():
+            entry.close()
+
+    def clear(self):
+        """Removes the cache files, mappings of the processes stay valid until they are closed."""
+        self.close()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".data") or name.endswith(".state"):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,196 @@
+from typing import Any, Callable, Dict
+import io
+import threading
+
+# bytes fetched by each read-ahead request
+STREAM_CHUNK_SIZE = 8 << 20
+
+
+class MemoryBudget:
+    """
+    Bytes of read-ahead data buffered by the streaming objects of a connector, bounded by 'limit'.
+    Chunks are acquired whole, so 'limit' must hold at least one chunk (STREAM_CHUNK_SIZE).
+    """
+
+    def __init__(self, limit: int):
+        if limit < STREAM_CHUNK_SIZE:
+            raise ValueError("memory budget %d is smaller than the read-ahead chunk size %d" % (limit, STREAM_CHUNK_SIZE))
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int, stop: threading.Event) -> bool:
+        with self._cond:
+            while self.used + size > self.limit and not stop.is_set():
+                self._cond.wait(0.1)
+            if stop.is_set():
+                return False
+            self.used += size
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def release(self, size: int):
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+
+class StreamingObject(io.RawIOBase):
+    """
+    Read-only stream of an OSS object with a bounded read-ahead window.
+
+    A background thread fetches the 'read_ahead' bytes following the read position by chunks, within the
+    memory budget shared by the objects of a connector. Chunks are evicted as soon as the read position
+    passes them, so the memory held is bounded by the window, not by the size of the object. Reads of
+    data not fetched ahead (after a seek, or when the budget is exhausted) go directly to OSS.
+
+    Args:
+        open_object(Callable): Opens the object without prefetch, called twice: for reads and for read-ahead.
+        budget(MemoryBudget): Memory budget of the read-ahead chunks.
+        read_ahead(int): Bytes fetched ahead of the read position.
+        metrics: Metrics of the connector.
+    """
+
+    def __init__(self, open_object: Callable[[], Any], budget: MemoryBudget, read_ahead: int, metrics: Any):
+        super().__init__()
+        self._object = open_object()
+        self._fill_object = open_object()
+        self._size = self._object.size()
+        self._budget = budget
+        self._read_ahead = read_ahead
+        self._metrics = metrics
+        self._pos = 0
+        self._chunks: Dict[int, bytes] = {}
+        self._fill_pos = 0
+        self._filling = -1
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._fill, name="oss-stream-read-ahead", daemon=True)
+        self._thread.start()
+
+    def size(self) -> int:
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        with self._cond:
+            self._pos = max(0, offset)
+            self._evict_before(self._pos)
+            self._cond.notify_all()
+        return self._pos
+
+    def _evict_before(self, pos: int):
+        # called with the lock held; drops the chunks behind 'pos', and restarts the window at 'pos'
+        start = pos - pos % STREAM_CHUNK_SIZE
+        for offset in [offset for offset in self._chunks if offset < start or offset >= start + self._read_ahead]:
+            self._release(self._chunks.pop(offset))
+        if self._fill_pos < start or self._fill_pos > start + self._read_ahead:
+            self._fill_pos = start
+
+    def _release(self, chunk: bytes):
+        self._budget.release(len(chunk))
+        self._metrics.add_gauge("stream_buffered_bytes", -len(chunk))
+        self._metrics.inc("stream_evicted_bytes", len(chunk))
+
+    def _fill(self):
+        while True:
+            with self._cond:
+                while not self._stop.is_set() and (self._fill_pos >= self._size or self._fill_pos in self._chunks
+                                                   or self._fill_pos >= self._pos + self._read_ahead):
+                    if self._fill_pos in self._chunks:
+                        self._fill_pos += STREAM_CHUNK_SIZE
+                        continue
+                    self._cond.wait()
+                if self._stop.is_set():
+                    return
+                offset = self._fill_pos
+                length = min(STREAM_CHUNK_SIZE, self._size - offset)
+            if not self._budget.acquire(length, self._stop):
+                return
+            try:
+                with self._cond:
+                    self._filling = offset
+                with self._metrics.timed("stream_fetch"):
+                    self._fill_object.seek(offset, io.SEEK_SET)
+                    chunk = self._fill_object.read(length)
+            except Exception:
+                self._budget.release(length)
+                with self._cond:
+                    self._filling = -1
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._filling = -1
+                start = self._pos - self._pos % STREAM_CHUNK_SIZE
+                if self._stop.is_set() or offset < start or offset >= start + self._read_ahead:
+                    # the reader moved away while fetching
+                    self._budget.release(length)
+                else:
+                    self._chunks[offset] = chunk
+                    self._metrics.add_gauge("stream_buffered_bytes", len(chunk))
+                    self._fill_pos = offset + STREAM_CHUNK_SIZE
+                self._cond.notify_all()
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        total = 0
+        while total < len(view) and self._pos < self._size:
+            offset = self._pos - self._pos % STREAM_CHUNK_SIZE
+            with self._cond:
+                while self._filling == offset and offset not in self._chunks:
+                    self._cond.wait()
+                chunk = self._chunks.get(offset)
+            if chunk is None:
+                # not fetched ahead, read directly
+                self._object.seek(self._pos, io.SEEK_SET)
+                n = self._object.readinto(view[total:total + min(len(view) - total, offset + STREAM_CHUNK_SIZE - self._pos)])
+                if n <= 0:
+                    break
+                self._metrics.inc("stream_direct_bytes", n)
+            else:
+                n = min(len(view) - total, offset + len(chunk) - self._pos)
+                view[total:total + n] = chunk[self._pos - offset:self._pos - offset + n]
+            total += n
+            with self._cond:
+                self._pos += n
+                self._evict_before(self._pos)
+                self._cond.notify_all()
+        return total
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._size - self._pos
+        buffer = bytearray(max(0, min(size, self._size - self._pos)))
+        n = self.readinto(buffer)
+        return bytes(buffer[:n])
+
+    def readall(self) -> bytes:
+        return self.read(-1)
+
+    def close(self):
+        if self.closed:
+            return
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            for chunk in self._chunks.values():
+                self._release(chunk)
+            self._chunks = {}
+        self._object.close()
+        self._fill_object.close()
+        super().close()
@@ -1,22 +1,143 @@
 from ._oss_connector import new_oss_connector, Connector
+from ._oss_metrics import Metrics
+from ._oss_load_order import SAFETENSORS_INDEX, plan_load_order, read_safetensors_header
+from ._oss_streaming import MemoryBudget, StreamingObject
+from ._oss_shared_cache import SharedCache, SharedCacheObject
+from ._oss_p2p import PeerGroup
+from ._oss_disk_cache import DiskCache
+from ._oss_preload import PreloadedDirectory, PRELOAD_SMALL_FILE_SIZE, map_address
+from ._oss_mmap import PAGE_SIZE, madvise, mincore
+from ._oss_lru import LruCache
 import ctypes
 import torch
 import builtins
+import io
 import pathlib
-from typing import Any
+import threading
+import logging
+import json
+import os
+import resource
+import shutil
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+# bytes read at once by the ordered prefetch
+PREFETCH_CHUNK_SIZE = 8 << 20
 
 
 class UntypedStorageEx:
+    """
+    Storage returned by the from_file hook over the memory of an OSS object, populated lazily by page faults.
+
+    Callers can inspect which pages are populated, request ranges up front so that fetch overlaps deserialization,
+    and give madvise hints, e.g. "dontneed" to drop ranges already copied into tensors (they are fetched again
+    if accessed later). Files without page faults (of the shared cache) are filled by range as they are indexed.
+    """
+
     def __init__(self, file, size):
         self.file = file
-        self.addr = memoryview((ctypes.c_ubyte * size).from_address(self.file.mmap()))
+        self.address = self.file.mmap()
+        self.nbytes = size
+        # views and tensors of the storage keep the file, and so its memory, alive
+        self.addr = map_address(self.address, size, file)
+        # pages of the shared cache are not filled by page faults
+        self._fill = file.fill if isinstance(file, SharedCacheObject) else None
 
     def untyped(self):
         return self
 
     def __getitem__(self, idx):
+        if self._fill is not None:
+            if isinstance(idx, slice):
+                start, end, _ = idx.indices(self.nbytes)
+            else:
+                start = idx if idx >= 0 else idx + self.nbytes
+                end = start + 1
+            if start < end:
+                self._fill(start, end)
         return self.addr[idx]
 
+    def _range(self, start, end):
+        if end < 0 or end > self.nbytes:
+            end = self.nbytes
+        return max(0, start), end
+
+    def page_state(self, start: int = 0, end: int = -1) -> bytearray:
+        """
+        Returns the fill state of the pages of a range.
+
+        Args:
+            start(int, optional): Start of the range. Defaults to 0.
+            end(int, optional): End of the range, -1 for the end of the storage. Defaults to -1.
+
+        Returns:
+            bytearray: A byte per page of the range, 1 if populated, 0 otherwise.
+        """
+        start, end = self._range(start, end)
+        return bytearray(b & 1 for b in mincore(self.address, start, end))
+
+    def filled_ratio(self, start: int = 0, end: int = -1) -> float:
+        """Returns the ratio of the populated pages of a range."""
+        state = self.page_state(start, end)
+        return sum(state) / len(state) if state else 1.0
+
+    def prefetch_range(self, start: int = 0, end: int = -1, wait: bool = False):
+        """
+        Populates the pages of a range, in a background thread unless 'wait'.
+
+        Args:
+            start(int, optional): Start of the range. Defaults to 0.
+            end(int, optional): End of the range, -1 for the end of the storage. Defaults to -1.
+            wait(bool, optional): Populate the range before returning. Defaults to False.
+
+        Returns:
+            threading.Thread: The thread populating the range, or None if 'wait'.
+        """
+        start, end = self._range(start, end)
+
+        def populate():
+            if self._fill is not None:
+                self._fill(start, end)
+                return
+            scratch = ctypes.create_string_buffer(PREFETCH_CHUNK_SIZE)
+            for offset in range(start, end, PREFETCH_CHUNK_SIZE):
+                # touching the pages faults them in
+                ctypes.memmove(scratch, self.address + offset, min(PREFETCH_CHUNK_SIZE, end - offset))
+
+        if wait:
+            populate()
+            return None
+        thread = threading.Thread(target=populate, name="oss-storage-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def advise(self, advice: str, start: int = 0, end: int = -1):
+        """
+        Gives a madvise hint for the pages of a range.
+
+        Args:
+            advice(str): One of "normal", "random", "sequential", "willneed" and "dontneed".
+            start(int, optional): Start of the range. Defaults to 0.
+            end(int, optional): End of the range, -1 for the end of the storage. Defaults to -1.
+
+        Raises:
+            ValueError: If the advice is unknown.
+            OSError: If madvise failed.
+        """
+        start, end = self._range(start, end)
+        if advice == "dontneed":
+            # only whole pages inside the range are dropped, the pages shared with the neighbours are kept
+            start = (self.address + start + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE - self.address
+            end = (self.address + end) // PAGE_SIZE * PAGE_SIZE - self.address
+            if end <= start:
+                return
+        madvise(self.address, start, end, advice)
+
 class OssModelConnector:
     """
     A connector class for interfacing with OSS for model loading,
@@ -29,6 +150,16 @@ class OssModelConnector:
         cred_path: str = "",
         config_path: str = "",
         cred_provider: Any = None,
+        memory_budget: int = 0,
+        read_ahead: int = 64 << 20,
+        shared_cache_dir: str = "",
+        peers: List[str] = None,
+        peer_rank: int = 0,
+        peer_token: str = "",
+        disk_cache_dir: str = "",
+        disk_cache_size: int = 0,
+        fallback_to_local: bool = True,
+        load_cache_size: int = 0,
     ):
         """
         Initializes the connector with endpoint and optional credential information.
@@ -38,14 +169,52 @@ class OssModelConnector:
             cred_path(str, optional): Path to the credential file. Defaults to "".
             config_path(str, optional): Path to the configuration file. Defaults to "".
             cred_provider(Any, optional): Credential provider. Defaults to None.
+            memory_budget(int, optional): Bytes of memory for the read-ahead of opened objects. If set, objects opened
+                in binary mode are streamed with a read-ahead window instead of being prefetched whole into memory, and
+                the ranges already read are evicted. It must hold at least one read-ahead chunk (8 MiB).
+                Defaults to 0 (prefetch whole objects).
+            read_ahead(int, optional): Bytes read ahead of the read position of each object in streaming mode.
+                Defaults to 64 MiB.
+            shared_cache_dir(str, optional): Directory of a cache shared by the processes of the host, e.g.
+                "/dev/shm/ossmodelconnector". If set, objects opened in binary mode are fetched once per host into
+                files of this directory and mapped by every process. Files are keyed by URI and size only, as the
+                native listing returns no ETag or modification time: an object overwritten in OSS with the same size
+                is served from the files until the directory is removed. Defaults to "" (no shared cache).
+            peers(List[str], optional): Addresses ("host:port") of the nodes sharing the chunks of their shared caches,
+                the same list on every node, so that the group fetches about one copy from OSS. Requires
+                'shared_cache_dir' and 'peer_token'. Each node listens on its address in the list, shared by the
+                connectors of its processes, and only serves the objects of the directories it prepared. Defaults to
+                None (no peers).
+            peer_rank(int, optional): Index of this node in 'peers'. Defaults to 0.
+            peer_token(str, optional): Secret shared by the nodes of 'peers', requests between nodes are signed with
+                it (HMAC-SHA256) and the unsigned ones are dropped. Defaults to "".
+            disk_cache_dir(str, optional): Directory of a persistent cache on local disk. If set, the files of the
+                directories of 'prepare_directory' are copied into it in background, and served from it after
+                restarts if unchanged in OSS. The native listing returns only key and size, so files are validated
+                by key, size and their last 4 KiB: an object overwritten with the same size and last bytes is served
+                stale until the directory is removed. Defaults to "" (no disk cache).
+            disk_cache_size(int, optional): Total size in bytes of the disk cache, least recently used files are
+                evicted beyond it. Defaults to 0 (no limit).
+            fallback_to_local(bool, optional): If opening a file of a prepared directory from OSS fails, open the local
+                file instead (logged and counted in 'open_fallbacks'), otherwise raise the error. Defaults to True.
+            load_cache_size(int, optional): Bytes of the in-memory LRU cache of the objects loaded by 'load_many'.
+                A cached object is checked on each load against a listing of its directory, without a request of
+                its own, and loaded again if its size changed in OSS, like files of the disk cache. The native listing and open return no ETag or modification time, so
+                an object overwritten with data of the same size is still served from the cache: clear the cache
+                (or use new object names) when objects are replaced in place. Defaults to 0 (no cache).
 
         Raises:
-            ValueError: If endpoint or credential is not provided.
+            ValueError: If endpoint or credential is not provided, peers are set without shared cache or token, or
+                memory_budget is smaller than a read-ahead chunk.
         """
         if not endpoint:
             raise ValueError("endpoint must be non-empty")
         if cred_provider is None and not cred_path:
             raise ValueError("Either cred_path or cred_provider must be provided")
+        if peers and not shared_cache_dir:
+            raise ValueError("shared_cache_dir must be provided with peers")
+        if peers and not peer_token:
+            raise ValueError("peer_token must be provided with peers")
 
         self._endpoint = endpoint
         if not cred_path:
@@ -57,11 +226,36 @@ class OssModelConnector:
         else:
             self._config_path = config_path
         self._cred_provider = cred_provider
+        self._memory_budget = MemoryBudget(memory_budget) if memory_budget > 0 else None
+        self._read_ahead = read_ahead
+        self._fallback_to_local = fallback_to_local
+        self._load_cache = LruCache(load_cache_size) if load_cache_size > 0 else None
 
         self._real_connector = None
-        self._hook_dir = ''
+        # local directory -> (OSS directory, prepared from preloaded files)
+        self._hook_dirs = {}
+        # prepared file -> its local directory, so that unrelated files cost a set lookup
+        self._hook_files = {}
+        self._hook_prefixes = ()
+        self._preloaded = {}
+        # OSS directory -> number of times it was prepared
+        self._prepare_counts = {}
         self._origin_from_file = torch.UntypedStorage.from_file
         self._origin_open = builtins.open
+        self._origin_io_open = io.open
+        self._origin_path_open = pathlib.Path.open
+        self._path_open = self._make_path_open()
+        self._metrics = Metrics()
+        self._shared_cache = SharedCache(shared_cache_dir, self._metrics) if shared_cache_dir else None
+        self._disk_cache = DiskCache(disk_cache_dir, disk_cache_size, self._metrics) if disk_cache_dir else None
+        self._peer_group = None
+        if peers:
+            self._peer_group = PeerGroup(peers, peer_rank, self._shared_cache,
+                                         lambda key: self._connector.open(self._shared_uri(key), False, False, True),
+                                         self._metrics, peer_token)
+        self._prefetch_stop = threading.Event()
+        self._prefetch_thread = None
+        self._prefetch_objects = []
 
     def __del__(self):
         self.close()
@@ -80,14 +274,28 @@ class OssModelConnector:
         Close the connector and release resources.
         """
         try:
-            if self._hook_dir:
-                self._hook_dir = ''
+            if self._hook_dirs:
+                self._hook_dirs = {}
+                self._hook_files = {}
+                self._hook_prefixes = ()
+
+            self._stop_ordered_prefetch()
+
+            for preloaded in self._preloaded.values():
+                preloaded.release()
+            self._preloaded = {}
+
+            if self._disk_cache is not None:
+                self._disk_cache.stop()
+
+            if self._peer_group is not None:
+                self._peer_group.close()
+                self._peer_group = None
 
-            if builtins.open == self._connector_open:
-                builtins.open = self._origin_open
+            if self._shared_cache is not None:
+                self._shared_cache.close()
 
-            if torch.UntypedStorage.from_file == self._from_file_helper:
-                torch.UntypedStorage.from_file = self._origin_from_file
+            self._uninstall_hooks()
 
             if self._real_connector is not None:
                 del self._real_connector
@@ -106,48 +314,379 @@ class OssModelConnector:
         Returns:
             Stream-like object of the opened OSS object.
         """
-        return self._connector.open(uri, True, True, binary)
+        return self._open(uri, binary)
+
+    def _open(self, uri, binary, encoding=None, errors=None, newline=None):
+        uri = self._resolve(uri)
+        file = self._open_preloaded(uri)
+        if file is not None:
+            self._metrics.inc("preload_hits")
+            if not binary:
+                return io.TextIOWrapper(io.BufferedReader(file), encoding, errors, newline)
+            return file
+        if self._shared_cache is not None and binary:
+            with self._metrics.timed("open"):
+                file = self._open_shared(uri)
+            self._metrics.inc("bytes_opened", file.size())
+            return file
+        if self._memory_budget is not None and binary:
+            with self._metrics.timed("open"):
+                file = StreamingObject(lambda: self._connector.open(uri, False, False, True), self._memory_budget,
+                                       self._read_ahead, self._metrics)
+            self._metrics.inc("bytes_opened", file.size())
+            return file
+        with self._metrics.timed("open"):
+            file = self._connector.open(uri, True, True, binary)
+        self._metrics.inc("bytes_opened", max(file.size(), 0))
+        return file
+
+    def _open_shared(self, uri):
+        key = self._shared_key(uri)
+        object = self._connector.open(uri, False, False, True)
+        # the object is closed if the entry was opened already
+        entry = self._shared_cache.entry(key, object.size(), lambda: self._connector.open(uri, False, False, True), object)
+        return SharedCacheObject(entry)
+
+    def _shared_key(self, uri):
+        # files of prepared directories are shared by their OSS URI, not by their local path which another model may
+        # reuse, and objects of a directory prepared again are shared under a new generation
+        dir = self._hook_files.get(uri)
+        if dir is not None:
+            uri = self._hook_dirs[dir][0] + uri[len(dir):]
+        for directory, count in self._prepare_counts.items():
+            if count > 1 and uri.startswith(directory):
+                return "%d@%s" % (count - 1, uri)
+        return uri
+
+    @staticmethod
+    def _shared_uri(key):
+        generation, sep, uri = key.partition('@')
+        return uri if sep and generation.isdigit() else key
+
+    def _match(self, file):
+        # returns the prepared file opened as 'file', or None
+        if type(file) is not str:
+            if not self._hook_files or isinstance(file, int):
+                return None
+            file = os.fspath(file)
+            if not isinstance(file, str):
+                return None
+        if file in self._hook_files:
+            return file
+        if not self._hook_files:
+            return None
+        if file.startswith(self._hook_prefixes) or not file.startswith('/'):
+            path = os.path.abspath(file)
+            if path in self._hook_files:
+                return path
+            if path.startswith(self._hook_prefixes):
+                # e.g. files written by the framework into the directory
+                self._metrics.inc("hook_misses")
+        return None
+
+    def _resolve(self, path):
+        # files of directories prepared from preloaded files are opened by their URI
+        dir = self._hook_files.get(path)
+        if dir is not None and self._hook_dirs[dir][1]:
+            return self._hook_dirs[dir][0] + path[len(dir):]
+        return path
+
+    def _open_preloaded(self, uri):
+        for directory, preloaded in self._preloaded.items():
+            if uri.startswith(directory):
+                return preloaded.get(uri[len(directory):])
+        return None
 
-    def _from_file_helper(self, filename, shared, nbytes):
-        if self._hook_dir and filename.startswith(self._hook_dir):
-            file = self._connector.open(filename, True, True)
+    def _from_file_helper(self, filename, shared=False, nbytes=0):
+        path = self._match(filename)
+        if path is not None:
+            self._metrics.inc("hook_hits")
+            filename = self._resolve(path)
+            file = self._open_preloaded(filename)
+            if file is not None:
+                self._metrics.inc("preload_hits")
+                return UntypedStorageEx(file, nbytes)
+            with self._metrics.timed("open"):
+                if self._shared_cache is not None:
+                    file = self._open_shared(filename)
+                else:
+                    file = self._connector.open(filename, True, True)
+            self._metrics.inc("bytes_opened", max(file.size(), 0))
             return UntypedStorageEx(file, nbytes)
         else:
             return self._origin_from_file(filename, shared, nbytes)
 
     def _connector_open(self, file, mode='r', buffering=-1, encoding=None, errors=None, newline=None, closefd=True, opener=None):
-        if isinstance(file, pathlib.Path):
-            file = str(file)
-        if self._hook_dir and file.startswith(self._hook_dir):
-            binary = False
-            if 'b' in mode:
-                binary = True
-            try:
-                return self.open(file, binary)
-            except:
-                return self._origin_open(file, mode, buffering, encoding, errors, newline, closefd, opener)
-        else:
+        path = self._match(file)
+        # files are only read from OSS
+        if path is None or 'w' in mode or 'a' in mode or 'x' in mode or '+' in mode:
+            return self._origin_open(file, mode, buffering, encoding, errors, newline, closefd, opener)
+        self._metrics.inc("hook_hits")
+        try:
+            return self._open(path, 'b' in mode, encoding, errors, newline)
+        except Exception as e:
+            self._metrics.inc("open_fallbacks")
+            if not self._fallback_to_local:
+                raise
+            log.warning("failed to open %s from OSS, falling back to the local file: %s", path, e)
             return self._origin_open(file, mode, buffering, encoding, errors, newline, closefd, opener)
 
-    def prepare_directory(self, uri: str, dir: str, libc_hook: bool = False):
+    def _make_path_open(self):
+        def path_open(path, mode='r', buffering=-1, encoding=None, errors=None, newline=None):
+            return self._connector_open(path, mode, buffering, encoding, errors, newline)
+        return path_open
+
+    def _install_hooks(self):
+        builtins.open = self._connector_open
+        io.open = self._connector_open
+        pathlib.Path.open = self._path_open
+        torch.UntypedStorage.from_file = self._from_file_helper
+
+    def _uninstall_hooks(self):
+        if builtins.open == self._connector_open:
+            builtins.open = self._origin_open
+        if io.open == self._connector_open:
+            io.open = self._origin_io_open
+        if pathlib.Path.open is self._path_open:
+            pathlib.Path.open = self._origin_path_open
+        if torch.UntypedStorage.from_file == self._from_file_helper:
+            torch.UntypedStorage.from_file = self._origin_from_file
+
+    def prepare_directory(self, uri: str, dir: str, libc_hook: bool = False,
+                          load_order: Union[str, List[Union[str, Tuple[str, int, int]]]] = None):
         """
         Prepare the directory from OSS storage, which can be used as directory 'dir' in vllm/transformers or other frameworks.
 
+        Large files are prefetched in alphabetical order by default. With 'load_order', a background thread reads the
+        byte ranges of the prepared files in the order they are consumed, so that the bytes needed next arrive first.
+        The files are opened by their local path without prefetch of whole objects: only the safetensors headers and
+        the planned ranges are read, from the data of the directory, so nothing is downloaded twice.
+
+        If 'uri' was preloaded, 'dir' is prepared from the files in memory without network I/O: small files are
+        written, larger ones are served from memory. Several directories can be prepared at the same time.
+
+        With a disk cache, if all the files of the directory are cached (same keys and sizes as listed in OSS, and
+        same last bytes, see 'DiskCache'), 'dir' is filled with links to the cached files and nothing is downloaded.
+        The native listing returns only key and size (no ETag or modification time), so the caches (disk, shared,
+        preloaded) can not detect an object overwritten in place with the same size: remove the cache directories
+        (or 'release' the preloaded directory) after such an overwrite.
+        Otherwise the directory is prepared from OSS, and its files are copied into the cache in background from the
+        prepared files (opened by their local path like the framework does, so that they are read from the data
+        prefetched for the directory rather than downloaded again).
+
         Args:
             uri(str): The URI (oss://{bucket}/{directory}) of the OSS directory.
             dir(str): The local directory used for vllm/transformers or other frameworks.
-            libc_hook (bool): Flag to enable libc hooking.
+            libc_hook (bool): Flag to enable libc hooking. Without it, the files are served from OSS to the Python
+                opens (open, io.open, pathlib.Path.open) and torch.UntypedStorage.from_file only: os.open, mmap and
+                native readers read the local files.
+            load_order(str or List, optional): "auto" derives the order of tensors from model.safetensors.index.json
+                (or the header of model.safetensors) and the safetensors headers: embeddings, layers by index, then the rest.
+                A list gives file names (read whole) or (file, start, end) byte ranges in consumption order. Defaults to None.
 
         Raises:
             RuntimeError: If prepare directory failed.
         """
-        if not dir.endswith('/'):
-            dir += '/'
-        self._connector.prepare_directory(uri, dir, libc_hook)
+        dir = os.path.abspath(dir) + '/'
+        if not uri.endswith('/'):
+            uri += '/'
+        if self._shared_cache is not None and uri in self._prepare_counts:
+            # the objects may have changed in OSS, entries of the previous generation are not reused
+            self._shared_cache.release(self._shared_key(uri))
+        self._prepare_counts[uri] = self._prepare_counts.get(uri, 0) + 1
+        if self._peer_group is not None:
+            self._peer_group.serve(self._shared_key(uri))
+        if uri in self._preloaded and not libc_hook and self._preloaded[uri].wait_listed():
+            with self._metrics.timed("prepare_directory"):
+                self._prepare_from_preload(uri, dir)
+            self._hook_directory(dir, uri, True, [name for name, _ in self._preloaded[uri].files])
+            return
+        bucket, _, prefix = uri[len("oss://"):].partition('/')
+        objects = None
+        if self._disk_cache is not None:
+            objects = [object for object in self.list(bucket, prefix) if not object.key.endswith('/')]
+            if self._prepare_from_disk_cache(uri, dir, objects):
+                return
+        with self._metrics.timed("prepare_directory"):
+            self._connector.prepare_directory(uri, dir, libc_hook)
+        if load_order is not None:
+            self._start_ordered_prefetch(uri, dir, load_order)
         if not libc_hook:
-            builtins.open = self._connector_open
-            torch.UntypedStorage.from_file = self._from_file_helper
-            self._hook_dir = dir
+            if objects is None:
+                objects = [object for object in self.list(bucket, prefix) if not object.key.endswith('/')]
+            self._hook_directory(dir, uri, False, [object.key[len(prefix):] for object in objects])
+        if self._disk_cache is not None:
+            self._disk_cache.fill_async(
+                (bucket + '/' + object.key, object.size,
+                 lambda path=dir + object.key[len(prefix):]: self._connector.open(path, True, True, True))
+                for object in objects)
+
+    def _hook_directory(self, dir: str, uri: str, preloaded: bool, names: List[str]):
+        self._install_hooks()
+        self._hook_dirs[dir] = (uri, preloaded)
+        for name in names:
+            self._hook_files[dir + name] = dir
+        self._hook_prefixes = tuple(self._hook_dirs)
+
+    def _prepare_from_preload(self, uri: str, dir: str):
+        preloaded = self._preloaded[uri]
+        # clean the directory as the native prepare_directory does
+        if os.path.isdir(dir):
+            shutil.rmtree(dir)
+        for name, size in preloaded.files:
+            path = dir + name
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._origin_open(path, 'wb') as f:
+                if size > PRELOAD_SMALL_FILE_SIZE:
+                    # placeholder of the right size, its data is served by the hooks
+                    f.truncate(size)
+                    continue
+                file = preloaded.get(name)
+                if file is None:
+                    file = self._connector.open(uri + name, True, True, True)
+                f.write(file.read(size))
+
+    def preload(self, uri: str, memory_budget: int = 0):
+        """
+        Preloads an OSS directory into memory in background, so that a later 'prepare_directory' of 'uri' (e.g.
+        switching to the next model) involves no network I/O. The directory is listed and its files are opened and
+        loaded by a background thread, this call returns right away: 'prepare_directory' of 'uri' waits for the
+        listing only, and files not opened by the thread by then are read from OSS. The memory is held until 'release'.
+
+        Args:
+            uri(str): The URI (oss://{bucket}/{directory}) of the OSS directory.
+            memory_budget(int, optional): Total size in bytes of the files held in memory, files beyond it in
+                listing order are read from OSS when prepared. Defaults to 0 (no limit).
+        """
+        if not uri.endswith('/'):
+            uri += '/'
+        if uri in self._preloaded:
+            return
+        bucket, _, prefix = uri[len("oss://"):].partition('/')
+
+        def list_files():
+            return [(object.key[len(prefix):], object.size) for object in self.list(bucket, prefix)
+                    if not object.key.endswith('/')]
+
+        # the native connector is built here rather than concurrently by the background thread
+        self._connector
+        self._preloaded[uri] = PreloadedDirectory(uri, list_files, lambda key: self._connector.open(key, True, True, True),
+                                                  memory_budget, self._metrics)
+
+    def release(self, uri: str):
+        """
+        Releases the memory of a preloaded OSS directory, and stops serving the directories prepared from it.
+        The memory of a file still mapped by storages or tensors of a loaded model is freed once they are freed.
+
+        Args:
+            uri(str): The URI (oss://{bucket}/{directory}) of the OSS directory.
+        """
+        if not uri.endswith('/'):
+            uri += '/'
+        for dir in [dir for dir, target in self._hook_dirs.items() if target[0] == uri]:
+            del self._hook_dirs[dir]
+            self._hook_files = {path: hook_dir for path, hook_dir in self._hook_files.items() if hook_dir != dir}
+        self._hook_prefixes = tuple(self._hook_dirs)
+        if not self._hook_dirs:
+            self._uninstall_hooks()
+        preloaded = self._preloaded.pop(uri, None)
+        if preloaded is not None:
+            preloaded.release()
+
+    def _prepare_from_disk_cache(self, uri: str, dir: str, objects: List[Any]) -> bool:
+        bucket, _, prefix = uri[len("oss://"):].partition('/')
+        cached = [self._disk_cache.lookup(bucket + '/' + object.key, object.size) for object in objects]
+        if not objects or not all(cached):
+            return False
+
+        def read_object(key: str, offset: int, size: int) -> bytes:
+            with self._connector.open("oss://%s/%s" % (bucket, key), False, False, True) as object:
+                object.seek(offset, io.SEEK_SET)
+                return object.read(size)
+
+        with ThreadPoolExecutor(max_workers=min(16, len(objects))) as executor:
+            verified = list(executor.map(
+                lambda item: self._disk_cache.verify(item[1], item[0].size,
+                                                     lambda offset, size: read_object(item[0].key, offset, size)),
+                zip(objects, cached)))
+        if not all(verified):
+            return False
+        # clean the directory as the native prepare_directory does
+        if os.path.isdir(dir):
+            shutil.rmtree(dir)
+        for object, path in zip(objects, cached):
+            link = os.path.join(dir, object.key[len(prefix):])
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            self._disk_cache.link(path, link)
+        self._metrics.inc("disk_cache_hit_bytes", sum(object.size for object in objects))
+        log.info("prepared %s from disk cache %s", uri, self._disk_cache.cache_dir)
+        return True
+
+    def _open_prepared(self, path: str):
+        # a file of a prepared directory, read from the data of the directory without prefetch of the whole object
+        return self._connector.open(path, False, False, True)
+
+    def _plan_load_order(self, dir: str, load_order: Union[str, List[Union[str, Tuple[str, int, int]]]]) -> List[Tuple[str, int, int]]:
+        if load_order != "auto":
+            # whole files are read to their end
+            return [(item, 0, -1) if isinstance(item, str) else tuple(item) for item in load_order]
+        try:
+            with self._open_prepared(dir + SAFETENSORS_INDEX) as index_file:
+                weight_map = json.loads(index_file.read(index_file.size()))["weight_map"]
+        except Exception:
+            # a single file model, tensors are ordered by their position in the header
+            weight_map = None
+        headers = {}
+        files = ["model.safetensors"] if weight_map is None else list(dict.fromkeys(weight_map.values()))
+        for name in files:
+            with self._open_prepared(dir + name) as file:
+                headers[name] = read_safetensors_header(file)
+        if weight_map is None:
+            weight_map = {tensor: "model.safetensors" for tensor in headers["model.safetensors"][1]}
+        return plan_load_order(weight_map, headers)
+
+    def _prefetch_in_order(self, uri: str, dir: str, load_order: Union[str, List[Union[str, Tuple[str, int, int]]]]):
+        try:
+            with self._metrics.timed("plan_load_order"):
+                ranges = self._plan_load_order(dir, load_order)
+            objects = {}
+            for name, _, _ in ranges:
+                if name not in objects and not self._prefetch_stop.is_set():
+                    objects[name] = self._open_prepared(dir + name)
+                    self._prefetch_objects.append(objects[name])
+            buffer = memoryview(bytearray(PREFETCH_CHUNK_SIZE))
+            for name, start, end in ranges:
+                object = objects[name]
+                object.seek(start, 0)
+                remaining = (end if end >= 0 else object.size()) - start
+                while remaining > 0 and not self._prefetch_stop.is_set():
+                    n = object.readinto(buffer[:min(PREFETCH_CHUNK_SIZE, remaining)])
+                    if n <= 0:
+                        break
+                    remaining -= n
+                    self._metrics.inc("ordered_prefetch_bytes", n)
+                if self._prefetch_stop.is_set():
+                    return
+            log.info("ordered prefetch of %s done, %d ranges", uri, len(ranges))
+        except Exception as e:
+            log.warning("ordered prefetch of %s failed: %s", uri, e)
+
+    def _start_ordered_prefetch(self, uri: str, dir: str, load_order: Union[str, List[Union[str, Tuple[str, int, int]]]]):
+        self._stop_ordered_prefetch()
+        self._prefetch_stop.clear()
+        self._prefetch_thread = threading.Thread(target=self._prefetch_in_order, args=(uri, dir, load_order),
+                                                 name="oss-ordered-prefetch", daemon=True)
+        self._prefetch_thread.start()
+
+    def _stop_ordered_prefetch(self):
+        if self._prefetch_thread is not None:
+            self._prefetch_stop.set()
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+        # the opened files are held until then
+        for object in self._prefetch_objects:
+            object.close()
+        self._prefetch_objects = []
 
     def list(self, bucket: str, prefix: str, fast: bool = False):
         """
@@ -159,6 +698,203 @@ class OssModelConnector:
             fast (bool): If true, enables fast list mode.
 
         Returns:
-            List: A list of objects matching the bucket and prefix criteria.
+            List: A list of objects matching the bucket and prefix criteria, with their key and size only (the native
+                listing returns no ETag or modification time).
+        """
+        with self._metrics.timed("list"):
+            objects = self._connector.list(bucket, prefix, fast)
+        self._metrics.inc("objects_listed", len(objects))
+        return objects
+
+    def iter_list(self, bucket: str, prefix: str, fast: bool = False, delimiter: str = "", min_size: int = 0,
+                  max_size: int = -1, partitions: List[str] = None, max_workers: int = 8) -> Iterator:
+        """
+        Lists objects in a specified OSS bucket with a given prefix, as an iterator over the filtered objects.
+
+        Each listing returns all its objects at once, as 'list' does, and filters are applied on them in this process:
+        with 'delimiter', the whole prefix is still listed. With 'partitions', the sub-prefixes are listed concurrently,
+        'max_workers' at a time, and the objects of each one are yielded as soon as it is listed, in completion order;
+        the next partition is submitted each time a listed one is taken, so at most 'max_workers' partition listings
+        are in flight or held, plus the one being yielded.
+
+        Args:
+            bucket(str): The OSS bucket name.
+            prefix(str): The prefix filter for object listing.
+            fast (bool): If true, enables fast list mode.
+            delimiter(str, optional): If set, yields the distinct "directories" (keys up to and including the first
+                delimiter after 'prefix') instead of the objects, e.g. "/" for the checkpoints of a directory.
+                Defaults to "".
+            min_size(int, optional): Only objects of at least this size are yielded. Defaults to 0.
+            max_size(int, optional): Only objects of at most this size are yielded, -1 for no limit. Defaults to -1.
+            partitions(List[str], optional): Sub-prefixes appended to 'prefix' and listed concurrently, they must cover
+                the keys of interest, e.g. the hex digits for hashed keys. Defaults to None (a single listing).
+            max_workers(int, optional): Number of partitions listed at the same time. Defaults to 8.
+
+        Returns:
+            Iterator: The objects (key and size, the native listing returns no version) matching the criteria, or the
+                directories (str) with 'delimiter'.
+        """
+        seen = set()
+
+        def select(objects):
+            for object in objects:
+                if object.size < min_size or (max_size >= 0 and object.size > max_size):
+                    continue
+                if not delimiter:
+                    yield object
+                    continue
+                end = object.key.find(delimiter, len(prefix))
+                if end < 0:
+                    continue
+                directory = object.key[:end + len(delimiter)]
+                if directory not in seen:
+                    seen.add(directory)
+                    yield directory
+
+        if not partitions:
+            yield from select(self.list(bucket, prefix, fast))
+            return
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="oss-list")
+        partitions = iter(partitions)
+        futures = set()
+        try:
+            for partition in islice(partitions, max_workers):
+                futures.add(executor.submit(self.list, bucket, prefix + partition, fast))
+            while futures:
+                future = next(iter(wait(futures, return_when=FIRST_COMPLETED).done))
+                futures.remove(future)
+                objects = future.result()
+                for partition in islice(partitions, 1):
+                    futures.add(executor.submit(self.list, bucket, prefix + partition, fast))
+                yield from select(objects)
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _load_cache_hits(self, uris: List[str], sizes: Dict[str, int]) -> Dict[str, bytes]:
+        # cached objects are checked against a listing rather than opened one by one: objects of the directories
+        # loaded are listed already (their size is in 'sizes'), the others take one listing per directory, of the
+        # common prefix of their keys (the key itself for a single object)
+        cached = {}
+        for uri in uris:
+            data = self._load_cache.get(uri)
+            if data is not None:
+                cached[uri] = data
+        unlisted = {}
+        for uri in cached:
+            if uri not in sizes:
+                unlisted.setdefault(uri[:uri.rfind('/') + 1], []).append(uri)
+        for directory, listed_uris in unlisted.items():
+            bucket, _, _ = directory[len("oss://"):].partition('/')
+            prefix = os.path.commonprefix(listed_uris)[len("oss://%s/" % bucket):]
+            for object in self.list(bucket, prefix):
+                sizes["oss://%s/%s" % (bucket, object.key)] = object.size
+        hits = {}
+        for uri, data in cached.items():
+            # cached data is served while the object keeps its size
+            if sizes.get(uri) == len(data):
+                hits[uri] = data
+            else:
+                self._metrics.inc("load_cache_stale")
+        return hits
+
+    def _read_loaded(self, file: Any, data: bytes, uri: str) -> bytes:
+        if file is None:
+            self._metrics.inc("load_cache_hits")
+            return data
+        with self._metrics.timed("load"), file:
+            data = file.read(file.size())
+        self._metrics.inc("bytes_loaded", len(data))
+        if self._load_cache is not None:
+            self._load_cache.put(uri, data)
+        return data
+
+    def load_many(self, uris: List[str], dir: str = "", max_prefetch: int = 32) -> Dict[str, Union[bytes, str]]:
+        """
+        Loads many small objects concurrently, e.g. the files of LoRA adapters, so that loading them takes about
+        the time of the slowest one rather than the sum of all.
+
+        Objects are opened with prefetch, which the native library runs in background, up to 'max_prefetch' ahead
+        of the object being read, and read in order; native calls hold the GIL, so threads would not add requests
+        in flight. With 'load_cache_size', cached objects are checked by size only (see '__init__'), against the
+        listing of their directory instead of a request per object, and are not opened.
+
+        Args:
+            uris(List[str]): The URIs (oss://{bucket}/{object_name}) of the objects, URIs ending with '/' are
+                directories whose objects are all loaded.
+            dir(str, optional): Local directory (e.g. on /dev/shm) where the objects are written, at
+                {dir}/{bucket}/{object_name}. Defaults to "" (kept in memory).
+            max_prefetch(int, optional): Number of objects prefetched at the same time. Defaults to 32.
+
+        Returns:
+            Dict: The data (bytes) of each object by URI, or its local path if 'dir' is set.
+
+        Raises:
+            The error of the first object (in the order of 'uris') which failed to be listed, opened or read from OSS,
+            or OSError if writing it into 'dir' failed. Objects loaded before are not removed from 'dir'.
+        """
+        expanded = []
+        sizes = {}
+        for uri in uris:
+            if not uri.endswith('/'):
+                expanded.append(uri)
+                continue
+            bucket, _, prefix = uri[len("oss://"):].partition('/')
+            for object in self.iter_list(bucket, prefix):
+                if not object.key.endswith('/'):
+                    object_uri = "oss://%s/%s" % (bucket, object.key)
+                    expanded.append(object_uri)
+                    sizes[object_uri] = object.size
+
+        def load(uri: str, file: Any, data: bytes) -> Union[bytes, str]:
+            data = self._read_loaded(file, data, uri)
+            if not dir:
+                return data
+            path = os.path.join(dir, uri[len("oss://"):])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._origin_open(path, 'wb') as f:
+                f.write(data)
+            return path
+
+        loaded = {}
+        opened = deque()
+        with self._metrics.timed("load_many"):
+            hits = self._load_cache_hits(expanded, sizes) if self._load_cache is not None else {}
+            try:
+                for uri in expanded:
+                    if uri in hits:
+                        opened.append((uri, None, hits[uri]))
+                    else:
+                        # opened with prefetch, the native library fetches the object in background while the next
+                        # ones are opened
+                        opened.append((uri, self._connector.open(uri, True, True, True), None))
+                    if len(opened) >= max(1, max_prefetch):
+                        uri, file, data = opened.popleft()
+                        loaded[uri] = load(uri, file, data)
+                while opened:
+                    uri, file, data = opened.popleft()
+                    loaded[uri] = load(uri, file, data)
+            finally:
+                # objects opened after a failed one
+                for _, file, _ in opened:
+                    if file is not None:
+                        file.close()
+        return loaded
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns metrics of the calls of this connector, which can be formatted with 'stats_to_prometheus'.
+
+        Returns:
+            Dict: Latency histograms and error counts per op (open, list, prepare_directory) in 'ops',
+                  counters of bytes opened, objects listed, hook hits, misses and open fallbacks in 'counters',
+                  and the number of in-flight calls in 'gauges'. With a memory budget, the bytes buffered, their peak
+                  and the peak RSS of the process in 'gauges', and the bytes evicted and read directly in 'counters'.
         """
-        return self._connector.list(bucket, prefix, fast)
+        stats = self._metrics.snapshot()
+        if self._memory_budget is not None:
+            stats["gauges"]["stream_buffered_peak_bytes"] = self._memory_budget.peak
+            stats["gauges"]["stream_memory_budget_bytes"] = self._memory_budget.limit
+            stats["gauges"]["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return stats
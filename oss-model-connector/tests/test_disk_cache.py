@@ -0,0 +1,118 @@
+import io
+import os
+import time
+import pytest
+
+from ossmodelconnector._oss_disk_cache import DISK_CACHE_VERIFY_SIZE, DiskCache
+from ossmodelconnector._oss_metrics import Metrics
+
+
+def opener(data: bytes):
+    return lambda: io.BytesIO(data)
+
+
+def set_age(path: str, seconds: float):
+    now = time.time()
+    os.utime(path, (now - seconds, now - seconds))
+
+
+def test_store_and_lookup(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 0, Metrics())
+    assert cache.lookup("oss://bucket/a", 3) is None
+    cache.store("oss://bucket/a", 3, opener(b"abc"))
+    path = cache.lookup("oss://bucket/a", 3)
+    with open(path, "rb") as f:
+        assert f.read() == b"abc"
+    # the object has a new size in OSS
+    assert cache.lookup("oss://bucket/a", 4) is None
+    cache.store("oss://bucket/a", 4, opener(b"abcd"))
+    assert not os.path.exists(path)
+    assert os.listdir(cache.cache_dir) == [os.path.basename(cache.path("oss://bucket/a", 4))]
+    assert cache._metrics.snapshot()["counters"]["disk_cache_stored_bytes"] == 7
+
+
+def test_store_short_object(tmp_path):
+    cache = DiskCache(str(tmp_path), 0, Metrics())
+    with pytest.raises(IOError):
+        cache.store("oss://bucket/a", 10, opener(b"abc"))
+    assert os.listdir(tmp_path) == []
+
+
+def test_verify(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 0, Metrics())
+    data = os.urandom(2 * DISK_CACHE_VERIFY_SIZE)
+    cache.store("oss://bucket/a", len(data), opener(data))
+    path = cache.lookup("oss://bucket/a", len(data))
+    reads = []
+
+    def read_object(offset: int, size: int) -> bytes:
+        reads.append((offset, size))
+        return data[offset:offset + size]
+
+    assert cache.verify(path, len(data), read_object)
+    assert reads == [(DISK_CACHE_VERIFY_SIZE, DISK_CACHE_VERIFY_SIZE)]
+    # overwritten in OSS with the same size
+    changed = data[:-1] + b"x"
+    assert not cache.verify(path, len(data), lambda offset, size: changed[offset:offset + size])
+    assert not os.path.exists(path)
+    assert cache._metrics.snapshot()["counters"]["disk_cache_stale"] == 1
+
+
+def test_verify_keeps_symlinked_file(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 0, Metrics())
+    cache.store("oss://bucket/a", 3, opener(b"abc"))
+    path = cache.lookup("oss://bucket/a", 3)
+    cache._pinned.add(path)
+    assert not cache.verify(path, 3, lambda offset, size: b"xyz"[offset:offset + size])
+    assert os.path.exists(path)
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 12, Metrics())
+    paths = {}
+    for i, key in enumerate(["a", "b", "c", "d"]):
+        cache.store(key, 4, opener(b"0123"))
+        paths[key] = cache.path(key, 4)
+        set_age(paths[key], 100 - i)
+    # "a" was used last, "b" is kept by the caller and "c" is linked into a directory
+    cache.lookup("a", 4)
+    os.link(paths["c"], str(tmp_path / "linked"))
+    cache.evict(keep={paths["b"]})
+    assert sorted(os.listdir(cache.cache_dir)) == sorted(os.path.basename(paths[key]) for key in ("a", "b", "c"))
+    assert cache._metrics.snapshot()["counters"]["disk_cache_evicted_bytes"] == 4
+
+
+def test_evict_without_limit(tmp_path):
+    cache = DiskCache(str(tmp_path), 0, Metrics())
+    cache.store("a", 4, opener(b"0123"))
+    cache.evict()
+    assert cache.lookup("a", 4) is not None
+
+
+def test_fill_async(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 0, Metrics())
+    objects = [("oss://bucket/%d" % i, i + 1, opener(b"x" * (i + 1))) for i in range(4)]
+
+    def failing():
+        raise IOError("open failed")
+
+    cache.fill_async(objects + [("oss://bucket/failing", 1, failing)])
+    cache._thread.join()
+    for key, size, _ in objects:
+        with open(cache.lookup(key, size), "rb") as f:
+            assert f.read() == b"x" * size
+    assert cache.lookup("oss://bucket/failing", 1) is None
+    assert cache._metrics.snapshot()["ops"]["disk_cache_store"]["errors"] == 1
+
+
+def test_stop_fill(tmp_path):
+    cache = DiskCache(str(tmp_path), 0, Metrics())
+
+    def slow():
+        time.sleep(0.2)
+        return io.BytesIO(b"abc")
+
+    cache.fill_async([("a", 3, slow), ("b", 3, opener(b"abc"))])
+    cache.stop()
+    # the interrupted copy is not cached and the remaining objects are skipped
+    assert os.listdir(tmp_path) == []
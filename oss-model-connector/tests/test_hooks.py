@@ -0,0 +1,67 @@
+import builtins
+import os
+import pathlib
+import pytest
+
+from ossmodelconnector import OssModelConnector
+
+
+@pytest.fixture
+def connector(tmp_path):
+    # the native connector is created on first use, hooks are tested without it
+    connector = OssModelConnector("http://oss-cn-hangzhou.aliyuncs.com", cred_path=str(tmp_path / "cred"))
+    dir = str(tmp_path / "model") + '/'
+    os.makedirs(dir)
+    connector._hook_directory(dir, "oss://bucket/model/", False, ["config.json", "sub/model.safetensors"])
+    yield connector
+    connector.close()
+
+
+def test_match_prepared_files(connector, tmp_path):
+    dir = str(tmp_path / "model") + '/'
+    assert connector._match(dir + "config.json") == dir + "config.json"
+    assert connector._match(pathlib.Path(dir) / "sub" / "model.safetensors") == dir + "sub/model.safetensors"
+    assert connector._match(dir + "sub/../config.json") == dir + "config.json"
+    assert connector._match(dir + "missing.json") is None
+    assert connector._metrics.snapshot()["counters"]["hook_misses"] == 1
+
+
+def test_match_relative_paths(connector, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert connector._match("model/config.json") == str(tmp_path / "model" / "config.json")
+    assert connector._match("config.json") is None
+
+
+def test_match_unrelated_files(connector):
+    assert connector._match("/etc/hostname") is None
+    assert connector._match(3) is None
+    assert connector._match(b"/etc/hostname") is None
+    # unrelated files are not counted as misses
+    assert "hook_misses" not in connector._metrics.snapshot()["counters"]
+
+
+def test_match_without_prepared_directory(tmp_path):
+    connector = OssModelConnector("http://oss-cn-hangzhou.aliyuncs.com", cred_path=str(tmp_path / "cred"))
+    try:
+        assert connector._match(str(tmp_path / "config.json")) is None
+        assert connector._match(tmp_path / "config.json") is None
+    finally:
+        connector.close()
+
+
+def test_hooks_uninstalled_on_close(tmp_path):
+    origin_open, origin_os_open = builtins.open, os.open
+    connector = OssModelConnector("http://oss-cn-hangzhou.aliyuncs.com", cred_path=str(tmp_path / "cred"))
+    dir = str(tmp_path / "model") + '/'
+    os.makedirs(dir)
+    connector._hook_directory(dir, "oss://bucket/model/", False, ["config.json"])
+    assert builtins.open == connector._connector_open
+    # file descriptors are left to the libc hook
+    assert os.open is origin_os_open and os.open in os.supports_dir_fd
+    # files are only written locally
+    with open(dir + "config.json", "w") as f:
+        f.write("{}")
+    with open(dir + "config.json", "r+") as f:
+        assert f.read() == "{}"
+    connector.close()
+    assert builtins.open is origin_open
@@ -0,0 +1,57 @@
+import io
+from collections import namedtuple
+
+from ossmodelconnector import OssModelConnector
+
+Listed = namedtuple("Listed", ["key", "size"])
+
+
+class MemoryObject(io.BytesIO):
+    """An object opened by the native library, in memory."""
+
+    def size(self) -> int:
+        return len(self.getbuffer())
+
+
+class MemoryConnector:
+    """The native connector over objects in memory, recording its requests."""
+
+    def __init__(self, objects: dict):
+        self.objects = objects
+        self.requests = []
+
+    def open(self, uri: str, prefetch: bool, userfault: bool, binary: bool) -> MemoryObject:
+        self.requests.append(("open", uri))
+        return MemoryObject(self.objects[uri])
+
+    def list(self, bucket: str, prefix: str, fast: bool):
+        self.requests.append(("list", prefix))
+        start = "oss://%s/" % bucket
+        return [Listed(uri[len(start):], len(data)) for uri, data in sorted(self.objects.items())
+                if uri.startswith(start + prefix)]
+
+
+def test_cached_objects_are_checked_without_opening(tmp_path):
+    objects = {"oss://bucket/lora/a/config.json": b"{}", "oss://bucket/lora/a/weights.bin": b"x" * 10,
+               "oss://bucket/lora/b/weights.bin": b"y" * 20, "oss://bucket/other.bin": b"z"}
+    connector = OssModelConnector("http://oss-cn-hangzhou.aliyuncs.com", cred_path=str(tmp_path / "cred"),
+                                  load_cache_size=1024)
+    native = connector._real_connector = MemoryConnector(objects)
+    try:
+        uris = ["oss://bucket/lora/a/", "oss://bucket/lora/b/weights.bin", "oss://bucket/other.bin"]
+        assert connector.load_many(uris) == objects
+        assert sorted(uri for op, uri in native.requests if op == "open") == sorted(objects)
+        native.requests.clear()
+        # hits take one listing per directory, not one request per object
+        assert connector.load_many(uris) == objects
+        assert native.requests == [("list", "lora/a/"), ("list", "lora/b/weights.bin"), ("list", "other.bin")]
+        # an object whose size changed is opened again
+        native.requests.clear()
+        objects["oss://bucket/lora/b/weights.bin"] = b"w" * 30
+        assert connector.load_many(uris[1:])["oss://bucket/lora/b/weights.bin"] == b"w" * 30
+        assert ("open", "oss://bucket/lora/b/weights.bin") in native.requests
+        counters = connector.get_stats()["counters"]
+        assert (counters["load_cache_hits"], counters["load_cache_stale"]) == (5, 1)
+    finally:
+        connector._real_connector = None
+        connector.close()
@@ -0,0 +1,62 @@
+import io
+import json
+import struct
+
+from ossmodelconnector._oss_load_order import plan_load_order, read_safetensors_header, tensor_sort_key
+
+
+def safetensors_header(tensors: dict) -> bytes:
+    # tensors: name -> (start, end) in the data section
+    header = {"__metadata__": {"format": "pt"}}
+    for name, (start, end) in tensors.items():
+        header[name] = {"dtype": "U8", "shape": [end - start], "data_offsets": [start, end]}
+    data = json.dumps(header).encode()
+    return struct.pack("<Q", len(data)) + data
+
+
+def test_tensor_sort_key_groups():
+    names = ["lm_head.weight", "model.layers.10.mlp.weight", "model.norm.weight", "model.layers.2.attn.weight",
+             "model.embed_tokens.weight", "transformer.h.1.attn.weight", "transformer.wte.weight"]
+    ordered = sorted(names, key=lambda name: tensor_sort_key(name, names.index(name)))
+    assert ordered == ["model.embed_tokens.weight", "transformer.wte.weight", "transformer.h.1.attn.weight",
+                       "model.layers.2.attn.weight", "model.layers.10.mlp.weight", "lm_head.weight", "model.norm.weight"]
+
+
+def test_tensor_sort_key_keeps_position_within_group():
+    assert tensor_sort_key("model.layers.3.b", 1) < tensor_sort_key("model.layers.3.a", 2)
+    assert tensor_sort_key("encoder.block.0.x", 9) < tensor_sort_key("encoder.block.1.x", 0)
+    assert tensor_sort_key("lm_head.weight", 0) == (2, 0, 0)
+    # the block of nested layers
+    assert tensor_sort_key("encoder.block.1.layer.0.w", 0) > tensor_sort_key("encoder.block.0.layer.1.w", 1)
+
+
+def test_read_safetensors_header():
+    header = safetensors_header({"a": (0, 4), "b": (4, 10)})
+    header_size, ranges = read_safetensors_header(io.BytesIO(header + b"\0" * 10))
+    assert header_size == len(header)
+    assert ranges == {"a": (len(header), len(header) + 4), "b": (len(header) + 4, len(header) + 10)}
+
+
+def test_plan_load_order_single_file():
+    weight_map = {"lm_head.weight": "model.safetensors", "model.layers.1.w": "model.safetensors",
+                  "model.layers.0.w": "model.safetensors", "model.embed_tokens.weight": "model.safetensors"}
+    headers = {"model.safetensors": (100, {"model.embed_tokens.weight": (100, 200), "model.layers.0.w": (200, 300),
+                                           "model.layers.1.w": (300, 400), "lm_head.weight": (400, 500)})}
+    # consumption order is contiguous in the file and follows the header, merged into one range
+    assert plan_load_order(weight_map, headers) == [("model.safetensors", 0, 500)]
+
+
+def test_plan_load_order_sharded():
+    weight_map = {"model.embed_tokens.weight": "b.safetensors", "model.layers.0.w": "a.safetensors",
+                  "model.layers.1.w": "b.safetensors", "model.norm.weight": "a.safetensors",
+                  "missing.weight": "c.safetensors"}
+    headers = {"a.safetensors": (64, {"model.layers.0.w": (64, 164), "model.norm.weight": (164, 200)}),
+               "b.safetensors": (32, {"model.embed_tokens.weight": (132, 232), "model.layers.1.w": (32, 132)})}
+    assert plan_load_order(weight_map, headers) == [
+        ("a.safetensors", 0, 64), ("b.safetensors", 0, 32),
+        ("b.safetensors", 132, 232), ("a.safetensors", 64, 164), ("b.safetensors", 32, 132), ("a.safetensors", 164, 200)]
+
+
+def test_plan_load_order_empty():
+    assert plan_load_order({}, {}) == []
+    assert plan_load_order({}, {"a.safetensors": (8, {})}) == [("a.safetensors", 0, 8)]
@@ -0,0 +1,35 @@
+from ossmodelconnector._oss_lru import LruCache
+
+
+def test_get_put_remove():
+    cache = LruCache(10)
+    assert cache.get("oss://bucket/a") is None
+    cache.put("oss://bucket/a", b"abc")
+    cache.put("oss://bucket/b", b"de")
+    assert (cache.get("oss://bucket/a"), cache.nbytes) == (b"abc", 5)
+    # replaced data is accounted once
+    cache.put("oss://bucket/a", b"abcdef")
+    assert (cache.get("oss://bucket/a"), cache.nbytes) == (b"abcdef", 8)
+    cache.remove("oss://bucket/a")
+    cache.remove("oss://bucket/missing")
+    assert (cache.get("oss://bucket/a"), cache.nbytes) == (None, 2)
+    cache.clear()
+    assert (cache.get("oss://bucket/b"), cache.nbytes) == (None, 0)
+
+
+def test_evicts_least_recently_used():
+    cache = LruCache(10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    # "a" is used after "b"
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (b"1234", None, b"1234")
+    assert cache.nbytes == 8
+
+
+def test_oversized_put_is_ignored():
+    cache = LruCache(4)
+    cache.put("a", b"1234")
+    cache.put("b", b"12345")
+    assert (cache.get("a"), cache.get("b"), cache.nbytes) == (b"1234", None, 4)
@@ -0,0 +1,62 @@
+import pytest
+
+from ossmodelconnector import stats_to_prometheus
+from ossmodelconnector._oss_metrics import LATENCY_BUCKETS, Metrics
+
+
+def test_observe_cumulative_buckets():
+    metrics = Metrics()
+    metrics.observe("open", 0.003)
+    metrics.observe("open", 0.2, error=True)
+    metrics.observe("open", 60.0)
+    stats = metrics.snapshot()["ops"]["open"]
+    assert (stats["count"], stats["errors"]) == (3, 1)
+    assert stats["seconds_sum"] == pytest.approx(60.203)
+    assert stats["buckets"] == [sum(seconds <= bound for seconds in (0.003, 0.2, 60.0)) for bound in LATENCY_BUCKETS]
+
+
+def test_timed_counters_and_gauges():
+    metrics = Metrics()
+    with metrics.timed("list"):
+        assert metrics.snapshot()["gauges"]["in_flight"] == 1
+    with pytest.raises(KeyError):
+        with metrics.timed("list"):
+            raise KeyError("key")
+    metrics.inc("bytes_read", 10)
+    metrics.inc("bytes_read", 5)
+    snapshot = metrics.snapshot()
+    assert (snapshot["ops"]["list"]["count"], snapshot["ops"]["list"]["errors"]) == (2, 1)
+    assert snapshot["gauges"] == {"in_flight": 0}
+    assert snapshot["counters"] == {"bytes_read": 15}
+
+
+def test_snapshot_is_a_copy():
+    metrics = Metrics()
+    metrics.observe("open", 0.1)
+    snapshot = metrics.snapshot()
+    snapshot["ops"]["open"]["buckets"][-1] = 100
+    metrics.observe("open", 0.1)
+    assert metrics.snapshot()["ops"]["open"]["buckets"][-1] == 2
+
+
+def test_stats_to_prometheus():
+    metrics = Metrics()
+    metrics.observe("open", 0.002)
+    metrics.observe("open", 0.002, error=True)
+    metrics.inc("bytes_read", 10)
+    metrics.add_gauge("mapped_bytes", 4096)
+    lines = stats_to_prometheus(metrics.snapshot(), labels={"model": "llama"}).splitlines()
+    name = "oss_model_connector_op_latency_seconds"
+    assert "# TYPE %s histogram" % name in lines
+    assert '%s_bucket{le="0.001",model="llama",op="open"} 0' % name in lines
+    assert '%s_bucket{le="0.005",model="llama",op="open"} 2' % name in lines
+    assert '%s_bucket{le="+Inf",model="llama",op="open"} 2' % name in lines
+    assert '%s_count{model="llama",op="open"} 2' % name in lines
+    assert 'oss_model_connector_op_errors_total{model="llama",op="open"} 1' in lines
+    assert 'oss_model_connector_bytes_read_total{model="llama"} 10' in lines
+    assert 'oss_model_connector_mapped_bytes{model="llama"} 4096' in lines
+
+
+def test_stats_to_prometheus_without_labels():
+    assert stats_to_prometheus({"gauges": {"mapped_bytes": 1}}, prefix="m") == "# TYPE m_mapped_bytes gauge\nm_mapped_bytes 1\n"
+    assert stats_to_prometheus({}) == "\n"
@@ -0,0 +1,92 @@
+import io
+import os
+import socket
+import zlib
+import pytest
+
+from ossmodelconnector._oss_metrics import Metrics
+from ossmodelconnector._oss_p2p import PeerGroup
+from ossmodelconnector._oss_shared_cache import SharedCache
+
+TOKEN = "secret"
+PREFIX = "oss://bucket/model/"
+
+
+class MemoryObject(io.BytesIO):
+    """An object of OSS opened by the native library, in memory."""
+
+    def size(self) -> int:
+        return len(self.getbuffer())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def owned_key(owner: int, nodes: int) -> str:
+    # a key whose first chunk is owned by 'owner'
+    for i in range(100):
+        key = PREFIX + "%d.bin" % i
+        if zlib.crc32(key.encode()) % nodes == owner:
+            return key
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="requires SO_REUSEPORT")
+def test_processes_of_a_node_share_its_address(tmp_path):
+    peers = ["127.0.0.1:%d" % free_port(), "127.0.0.1:%d" % free_port()]
+    data = {}
+    opened = []
+
+    def open_object(key: str) -> MemoryObject:
+        opened.append(key)
+        return MemoryObject(data[key])
+
+    # two processes (connectors) of node 0 with the cache of the node, and node 1
+    node0_dir = str(tmp_path / "node0")
+    node0_metrics = [Metrics(), Metrics()]
+    node0 = [PeerGroup(peers, 0, SharedCache(node0_dir, metrics), open_object, metrics, TOKEN) for metrics in node0_metrics]
+    node1 = PeerGroup(peers, 1, SharedCache(str(tmp_path / "node1"), Metrics()), open_object, Metrics(), TOKEN)
+    try:
+        for group in node0 + [node1]:
+            group.serve(PREFIX)
+        key = owned_key(0, len(peers))
+        data[key] = os.urandom(1000)
+        buffer = bytearray(1000)
+        for _ in range(4):
+            assert node1.fetch(key, len(buffer), 0, memoryview(buffer))
+            assert buffer == data[key]
+        # served from the cache of node 0, filled once from OSS
+        fetched = [metrics.snapshot()["counters"].get("shared_cache_fetched_bytes", 0) for metrics in node0_metrics]
+        assert sum(fetched) == len(buffer)
+        assert set(opened) == {key}
+        # the node keeps serving after one of its processes exits
+        exited = node0.pop()
+        exited.close()
+        exited.cache.close()
+        for _ in range(4):
+            assert node1.fetch(key, len(buffer), 0, memoryview(buffer))
+    finally:
+        for group in node0 + [node1]:
+            group.close()
+            group.cache.close()
+
+
+def test_bad_token_is_rejected(tmp_path):
+    peers = ["127.0.0.1:%d" % free_port(), "127.0.0.1:%d" % free_port()]
+    data = b"x" * 100
+    node0 = PeerGroup(peers, 0, SharedCache(str(tmp_path / "node0"), Metrics()), lambda key: MemoryObject(data),
+                      Metrics(), TOKEN)
+    node1 = PeerGroup(peers, 1, SharedCache(str(tmp_path / "node1"), Metrics()), lambda key: MemoryObject(data),
+                      Metrics(), "other", timeout=0.5)
+    try:
+        for group in (node0, node1):
+            group.serve(PREFIX)
+        assert not node1.fetch(owned_key(0, len(peers)), len(data), 0, memoryview(bytearray(len(data))))
+        assert node0.metrics.snapshot()["counters"]["p2p_rejected_requests"] == 1
+        assert node1.metrics.snapshot()["counters"]["p2p_fallbacks"] == 1
+    finally:
+        for group in (node0, node1):
+            group.close()
+            group.cache.close()
@@ -0,0 +1,85 @@
+import ctypes
+import threading
+
+from ossmodelconnector import OssModelConnector
+from ossmodelconnector._oss_metrics import Metrics
+from ossmodelconnector._oss_preload import PreloadedDirectory
+
+URI = "oss://bucket/model/"
+FILES = {"config.json": b'{"a": 1}', "vocab.txt": "line one\nligne deux é\n".encode()}
+
+
+class MemoryObject:
+    """An object opened with prefetch by the native library, in memory."""
+
+    def __init__(self, data: bytes):
+        self._buffer = ctypes.create_string_buffer(data, len(data))
+        self.closed = False
+
+    def mmap(self) -> int:
+        return ctypes.addressof(self._buffer)
+
+    def close(self):
+        self.closed = True
+
+
+def list_files():
+    return [(name, len(data)) for name, data in FILES.items()]
+
+
+def open_object(uri: str) -> MemoryObject:
+    return MemoryObject(FILES[uri[len(URI):]])
+
+
+def test_preload_in_background():
+    listing = threading.Event()
+
+    def slow_list_files():
+        listing.wait()
+        return list_files()
+
+    preloaded = PreloadedDirectory(URI, slow_list_files, open_object, 0, Metrics())
+    # the listing and the opens run on the background thread
+    assert not preloaded.listed.is_set() and preloaded.get("config.json") is None
+    listing.set()
+    assert preloaded.wait_listed()
+    assert preloaded.loaded.wait(10)
+    assert preloaded.files == list_files()
+    assert preloaded.get("config.json").read() == FILES["config.json"]
+    assert preloaded.nbytes == sum(len(data) for data in FILES.values())
+    preloaded.release()
+    assert preloaded.get("config.json") is None
+
+
+def test_preload_memory_budget():
+    preloaded = PreloadedDirectory(URI, list_files, open_object, len(FILES["config.json"]), Metrics())
+    assert preloaded.loaded.wait(10)
+    assert preloaded.get("config.json") is not None and preloaded.get("vocab.txt") is None
+    preloaded.release()
+
+
+def test_preload_listing_failed():
+    def failing():
+        raise RuntimeError("list failed")
+
+    preloaded = PreloadedDirectory(URI, failing, open_object, 0, Metrics())
+    assert not preloaded.wait_listed()
+    assert preloaded.files == [] and not preloaded.loaded.is_set()
+    preloaded.release()
+
+
+def test_open_preloaded_text_and_binary(tmp_path):
+    connector = OssModelConnector("http://oss-cn-hangzhou.aliyuncs.com", cred_path=str(tmp_path / "cred"))
+    try:
+        connector._preloaded[URI] = PreloadedDirectory(URI, list_files, open_object, 0, connector._metrics)
+        dir = str(tmp_path / "model") + '/'
+        # no network I/O, the native connector is not built
+        connector.prepare_directory(URI, dir)
+        with open(dir + "vocab.txt", encoding="utf-8") as f:
+            assert f.read() == FILES["vocab.txt"].decode()
+        with open(dir + "vocab.txt", "rb") as f:
+            assert f.read() == FILES["vocab.txt"]
+        assert connector.open(dir + "vocab.txt", binary=False).readline() == "line one\n"
+        assert connector._metrics.snapshot()["counters"]["preload_hits"] == 3
+    finally:
+        connector.close()
@@ -0,0 +1,99 @@
+import io
+import os
+import threading
+import time
+import pytest
+
+from ossmodelconnector._oss_metrics import Metrics
+from ossmodelconnector._oss_streaming import STREAM_CHUNK_SIZE, MemoryBudget, StreamingObject
+
+
+class MemoryObject(io.BytesIO):
+    """An opened object of the native library, in memory."""
+
+    def size(self) -> int:
+        return len(self.getbuffer())
+
+
+def test_memory_budget_limit():
+    with pytest.raises(ValueError):
+        MemoryBudget(STREAM_CHUNK_SIZE - 1)
+    budget = MemoryBudget(2 * STREAM_CHUNK_SIZE)
+    stop = threading.Event()
+    assert budget.acquire(STREAM_CHUNK_SIZE, stop)
+    assert budget.acquire(STREAM_CHUNK_SIZE, stop)
+    budget.release(STREAM_CHUNK_SIZE)
+    assert (budget.used, budget.peak) == (STREAM_CHUNK_SIZE, 2 * STREAM_CHUNK_SIZE)
+
+
+def test_memory_budget_waits_for_release():
+    budget = MemoryBudget(STREAM_CHUNK_SIZE)
+    stop = threading.Event()
+    assert budget.acquire(STREAM_CHUNK_SIZE, stop)
+    releaser = threading.Timer(0.2, budget.release, args=(STREAM_CHUNK_SIZE,))
+    releaser.start()
+    start_time = time.perf_counter()
+    assert budget.acquire(STREAM_CHUNK_SIZE, stop)
+    assert time.perf_counter() - start_time >= 0.1
+    releaser.join()
+    assert budget.used == STREAM_CHUNK_SIZE
+
+
+def test_memory_budget_stop():
+    budget = MemoryBudget(STREAM_CHUNK_SIZE)
+    stop = threading.Event()
+    assert budget.acquire(STREAM_CHUNK_SIZE, stop)
+    threading.Timer(0.1, stop.set).start()
+    assert not budget.acquire(1, stop)
+    assert budget.used == STREAM_CHUNK_SIZE
+
+
+def open_streaming(data: bytes, budget: MemoryBudget, read_ahead: int) -> StreamingObject:
+    return StreamingObject(lambda: MemoryObject(data), budget, read_ahead, Metrics())
+
+
+def test_streaming_object_reads_within_budget():
+    data = os.urandom(5 * STREAM_CHUNK_SIZE + 123)
+    budget = MemoryBudget(2 * STREAM_CHUNK_SIZE)
+    obj = open_streaming(data, budget, 2 * STREAM_CHUNK_SIZE)
+    assert obj.size() == len(data)
+    received = bytearray()
+    while True:
+        chunk = obj.read(3 << 20)
+        if not chunk:
+            break
+        received += chunk
+    assert received == data
+    assert budget.peak <= budget.limit
+    obj.close()
+    assert budget.used == 0
+    # closing twice is a no-op
+    obj.close()
+
+
+def test_streaming_object_seek():
+    data = os.urandom(3 * STREAM_CHUNK_SIZE)
+    budget = MemoryBudget(STREAM_CHUNK_SIZE)
+    with open_streaming(data, budget, STREAM_CHUNK_SIZE) as obj:
+        assert obj.read(10) == data[:10]
+        assert obj.seek(2 * STREAM_CHUNK_SIZE + 5) == 2 * STREAM_CHUNK_SIZE + 5
+        assert obj.read(10) == data[2 * STREAM_CHUNK_SIZE + 5:2 * STREAM_CHUNK_SIZE + 15]
+        assert obj.seek(-4, io.SEEK_END) == len(data) - 4
+        assert obj.read() == data[-4:]
+        assert obj.read() == b""
+        obj.seek(1)
+        assert obj.seek(3, io.SEEK_CUR) == 4
+        assert obj.read(STREAM_CHUNK_SIZE) == data[4:4 + STREAM_CHUNK_SIZE]
+    assert budget.used == 0
+
+
+def test_streaming_objects_share_budget():
+    data = os.urandom(4 * STREAM_CHUNK_SIZE)
+    budget = MemoryBudget(2 * STREAM_CHUNK_SIZE)
+    objects = [open_streaming(data, budget, 2 * STREAM_CHUNK_SIZE) for _ in range(3)]
+    # reads beyond the budget go directly to the object
+    assert [obj.read() for obj in objects] == [data] * 3
+    assert budget.peak <= budget.limit
+    for obj in objects:
+        obj.close()
+    assert budget.used == 0
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the memory budget of OssModelConnector streaming
+
+This script reads model files (e.g. the shards of a safetensors model) in
+order, as a framework loading them, once with whole objects prefetched into
+memory and once per given memory budget, each run in a fresh process, and
+reports the load time and the peak RSS of each run.
+
+Usage:
+    python benchmark_memory_budget.py --endpoint <endpoint> --cred-path <cred_path> --config-path <config_path> \
+                                      --uris oss://bucket/model/model-00001-of-00002.safetensors \
+                                             oss://bucket/model/model-00002-of-00002.safetensors \
+                                      --budgets 1073741824 4294967296 --read-ahead 268435456
+"""
+
+from ossmodelconnector import OssModelConnector
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+
+parser = argparse.ArgumentParser(description='Benchmark the memory budget of OssModelConnector streaming')
+parser.add_argument('-ep', '--endpoint', type=str, help='Endpoint of the OSS bucket where the objects are stored.')
+parser.add_argument('--cred-path', type=str, help='Credential info of the OSS bucket where the objects are stored.')
+parser.add_argument('--config-path', type=str, default='', help='Configuration file path of the OSS connector.')
+parser.add_argument('--uris', type=str, nargs='+', help='OSS URIs of the files, read in order.')
+parser.add_argument('--budgets', type=int, nargs='+', default=[1 << 30], help='Memory budgets (bytes) to benchmark.')
+parser.add_argument('--read-ahead', type=int, default=64 << 20, help='Read-ahead window (bytes) of each object.')
+parser.add_argument('--block-size', type=int, default=16 << 20, help='Bytes read per call, as copied into tensors.')
+
+
+def load(args, budget: int, queue):
+    connector = OssModelConnector(args.endpoint, cred_path=args.cred_path, config_path=args.config_path,
+                                  memory_budget=budget, read_ahead=args.read_ahead)
+    buffer = bytearray(args.block_size)
+    nbytes = 0
+    start_time = time.perf_counter()
+    # whole objects are prefetched in the order of open calls, so they are opened first
+    files = [connector.open(uri) for uri in args.uris]
+    for file in files:
+        while True:
+            n = file.readinto(buffer)
+            if n <= 0:
+                break
+            nbytes += n
+        file.close()
+    elapsed = time.perf_counter() - start_time
+    stats = connector.get_stats()
+    connector.close()
+    queue.put({"memory_budget": budget, "seconds": elapsed, "bytes": nbytes,
+               "throughput_mb_s": nbytes / elapsed / 1024 / 1024,
+               "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+               "counters": stats["counters"]})
+
+
+def main():
+    args = parser.parse_args()
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for budget in [0] + args.budgets:
+        queue = context.Queue()
+        process = context.Process(target=load, args=(args, budget, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+        result = results[-1]
+        print("budget %14d: %8.2f s, %8.1f MB/s, peak RSS %10.1f MB" % (
+            budget, result["seconds"], result["throughput_mb_s"], result["peak_rss_mb"]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
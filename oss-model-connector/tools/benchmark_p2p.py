@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark peer-to-peer distribution of OssModelConnector on loopback
+
+This script starts several local processes, each standing for a node with its
+own shared cache directory and chunk server on a loopback port, which read the
+same objects at the same time. It reports the load time of each node, and the
+bytes fetched from OSS and from peers: the group should fetch about one copy
+of the objects from OSS.
+
+With '--mock-size', no OSS endpoint is needed: each node reads in-memory objects
+of this size, with '--mock-latency' seconds per read, through its shared cache
+and chunk server. Nodes start '--skew' seconds apart and read each object from
+a different offset, so that they request chunks from each other while fetching
+their own. With '--check', the script fails if a node fell back to OSS, read
+wrong data, or if the group fetched more than one copy of the objects.
+
+Usage:
+    1. Against OSS:
+    python benchmark_p2p.py --endpoint <endpoint> --cred-path <cred_path> --config-path <config_path> \
+                            --uris oss://bucket/model/model-00001-of-00002.safetensors \
+                                   oss://bucket/model/model-00002-of-00002.safetensors \
+                            --nodes 4 --base-port 17300
+    2. Against in-memory objects, with skewed loaders:
+    python benchmark_p2p.py --mock-size 268435456 --mock-objects 4 --mock-latency 0.05 --skew 0.2 --nodes 4 --check
+"""
+
+from ossmodelconnector import OssModelConnector
+from ossmodelconnector._oss_metrics import Metrics
+from ossmodelconnector._oss_p2p import PeerGroup
+from ossmodelconnector._oss_shared_cache import SharedCache, SharedCacheObject
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='Benchmark peer-to-peer distribution of OssModelConnector on loopback')
+parser.add_argument('-ep', '--endpoint', type=str, help='Endpoint of the OSS bucket where the objects are stored.')
+parser.add_argument('--cred-path', type=str, help='Credential info of the OSS bucket where the objects are stored.')
+parser.add_argument('--config-path', type=str, default='', help='Configuration file path of the OSS connector.')
+parser.add_argument('--uris', type=str, nargs='+', help='OSS URIs of the objects read by every node.')
+parser.add_argument('--nodes', type=int, default=4, help='Number of local nodes.')
+parser.add_argument('--base-port', type=int, default=17300, help='Port of the chunk server of the first node.')
+parser.add_argument('--block-size', type=int, default=16 << 20, help='Bytes read per call.')
+parser.add_argument('--mock-size', type=int, default=0, help='Size of the in-memory objects read instead of OSS, 0 to read OSS.')
+parser.add_argument('--mock-objects', type=int, default=4, help='Number of in-memory objects.')
+parser.add_argument('--mock-latency', type=float, default=0.05, help='Seconds per read of the in-memory objects.')
+parser.add_argument('--skew', type=float, default=0.0, help='Seconds between the starts of consecutive nodes.')
+parser.add_argument('--check', action='store_true', help='Fail on fallbacks to OSS, wrong data, or more than one copy fetched.')
+
+
+class MockObject(io.RawIOBase):
+    """In-memory object of a deterministic content, read with a latency per call like an OSS object."""
+
+    def __init__(self, uri: str, size: int, latency: float):
+        super().__init__()
+        pattern = hashlib.sha1(uri.encode()).digest()
+        self._period = len(pattern)
+        self._block = pattern * ((1 << 20) // len(pattern) + 1)
+        self._size = size
+        self._latency = latency
+        self._pos = 0
+
+    def size(self) -> int:
+        return self._size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._pos = offset
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        time.sleep(self._latency)
+        view = memoryview(buffer).cast("B")
+        n = max(0, min(len(view), self._size - self._pos))
+        filled = 0
+        while filled < n:
+            offset = (self._pos + filled) % self._period
+            m = min(n - filled, len(self._block) - offset)
+            view[filled:filled + m] = self._block[offset:offset + m]
+            filled += m
+        self._pos += n
+        return n
+
+
+def read_object(file, start: int, buffer: bytearray, reference: MockObject = None) -> int:
+    """Reads the object from 'start' to its end, then from its beginning to 'start', returns the number of blocks
+    which differ from 'reference'."""
+    size = file.size()
+    view = memoryview(buffer)
+    expected = memoryview(bytearray(len(buffer)))
+    mismatches = 0
+    for offset, end in ((start, size), (0, start)):
+        file.seek(offset)
+        while offset < end:
+            n = file.readinto(view[:min(len(buffer), end - offset)])
+            if n <= 0:
+                break
+            if reference is not None:
+                reference.seek(offset)
+                reference.readinto(expected[:n])
+                mismatches += expected[:n] != view[:n]
+            offset += n
+    return mismatches
+
+
+def mock_opener(args, cache: SharedCache):
+    def open_object(uri: str):
+        return SharedCacheObject(cache.entry(uri, args.mock_size, lambda: MockObject(uri, args.mock_size, args.mock_latency)))
+    return open_object
+
+
+def node(args, peers, token: str, rank: int, barrier, queue):
+    cache_dir = tempfile.mkdtemp(prefix="ossmodelconnector-p2p-%d-" % rank)
+    if args.mock_size > 0:
+        metrics = Metrics()
+        cache = SharedCache(cache_dir, metrics)
+        group = PeerGroup(peers, rank, cache, lambda uri: MockObject(uri, args.mock_size, args.mock_latency), metrics,
+                          token)
+        group.serve("mock://model/")
+        open_object = mock_opener(args, cache)
+        get_stats = metrics.snapshot
+        close = group.close
+    else:
+        connector = OssModelConnector(args.endpoint, cred_path=args.cred_path, config_path=args.config_path,
+                                      shared_cache_dir=cache_dir, peers=peers, peer_rank=rank, peer_token=token)
+        # objects are opened without 'prepare_directory', which would make the nodes serve them
+        for uri in args.uris:
+            connector._peer_group.serve(uri)
+        open_object = connector.open
+        get_stats = connector.get_stats
+        close = connector.close
+    buffer = bytearray(args.block_size)
+    mismatches = 0
+    barrier.wait()
+    time.sleep(rank * args.skew)
+    start_time = time.perf_counter()
+    for uri in args.uris:
+        with open_object(uri) as file:
+            # nodes start at different offsets, so that they fetch the chunks they own while requesting the others
+            # (offsets in steps of 'size / nodes' would make all nodes request chunks of the same owner at once)
+            start = file.size() * rank // (len(peers) + 1)
+            reference = MockObject(uri, args.mock_size, 0.0) if args.mock_size > 0 and args.check else None
+            mismatches += read_object(file, start, buffer, reference)
+    elapsed = time.perf_counter() - start_time
+    counters = get_stats()["counters"]
+    queue.put({"rank": rank, "seconds": elapsed,
+               "oss_bytes": counters.get("shared_cache_fetched_bytes", 0),
+               "peer_bytes": counters.get("p2p_received_bytes", 0),
+               "fallbacks": counters.get("p2p_fallbacks", 0),
+               "mismatches": mismatches})
+    # serve the peers still loading
+    barrier.wait()
+    close()
+    shutil.rmtree(cache_dir)
+
+
+def check(args, results) -> bool:
+    passed = True
+    if any(result["fallbacks"] for result in results):
+        print("FAIL: fallbacks to OSS")
+        passed = False
+    if args.mock_size > 0:
+        if any(result["mismatches"] for result in results):
+            print("FAIL: wrong data read")
+            passed = False
+        if sum(result["oss_bytes"] for result in results) > args.mock_size * len(args.uris):
+            print("FAIL: more than one copy fetched")
+            passed = False
+    return passed
+
+
+def main():
+    args = parser.parse_args()
+    if args.mock_size > 0:
+        args.uris = ["mock://model/model-%05d.bin" % i for i in range(args.mock_objects)]
+    peers = ["127.0.0.1:%d" % (args.base_port + rank) for rank in range(args.nodes)]
+    token = secrets.token_hex(16)
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(args.nodes)
+    queue = context.Queue()
+    processes = [context.Process(target=node, args=(args, peers, token, rank, barrier, queue)) for rank in range(args.nodes)]
+    for process in processes:
+        process.start()
+    results = sorted((queue.get() for _ in processes), key=lambda result: result["rank"])
+    for process in processes:
+        process.join()
+    for result in results:
+        print("node %3d: %8.2f s, %14d bytes from OSS, %14d bytes from peers, %d fallbacks" % (
+            result["rank"], result["seconds"], result["oss_bytes"], result["peer_bytes"], result["fallbacks"]))
+    print(json.dumps({"nodes": args.nodes, "oss_bytes": sum(result["oss_bytes"] for result in results),
+                      "peer_bytes": sum(result["peer_bytes"] for result in results), "results": results}, indent=2))
+    if args.check and not check(args, results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark AsyncOssClient against a thread-pool wrapper of OssClient
+
+This script reads objects with many concurrent coroutines, either through
+AsyncOssClient (one bounded executor shared by all calls) or by wrapping each
+blocking OssClient call with run_in_executor on a thread pool sized to the
+concurrency (a thread per in-flight call). It reports throughput, the lag of
+the event loop (how late a 1 ms ticker wakes up) and the peak thread count.
+
+Without '--endpoint', a local mock OSS server with the given latency is started
+in a child process. Its bucket host <bucket>.<host suffix> must resolve to
+127.0.0.1, e.g. with a line '127.0.0.1 benchmark.localhost' in /etc/hosts.
+
+Usage:
+    python benchmark_async_client.py --latency 0.02 --num-objects 2000 --concurrency 256 --max-workers 16
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from osstorchconnector import OssClient, AsyncOssClient
+from mock_oss_server import MockOssServer, write_client_files
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+parser = argparse.ArgumentParser(description='Benchmark AsyncOssClient against a thread-pool wrapper of OssClient')
+parser.add_argument('-ep', '--endpoint', type=str, default='', help='Endpoint of OSS, a local mock server is started if not set.')
+parser.add_argument('--cred-path', type=str, default='', help='Credential info of the OSS bucket, a dummy one is used with the mock server.')
+parser.add_argument('--config-path', type=str, default='', help='Configuration file path of the OSS connector.')
+parser.add_argument('--region', type=str, default='', help='OSS region, "cn-hangzhou" is used with the mock server.')
+parser.add_argument('--bucket', type=str, default='benchmark', help='Bucket of the fixture.')
+parser.add_argument('--prefix', type=str, default='osstorchconnector-benchmark/async/', help='Prefix of the fixture in the bucket.')
+parser.add_argument('--latency', type=float, default=0.02, help='Mean seconds before each response of the mock server.')
+parser.add_argument('--host-suffix', type=str, default='localhost', help='Host of the mock server, <bucket>.<host-suffix> must resolve to 127.0.0.1.')
+parser.add_argument('--num-objects', type=int, default=2000, help='Number of objects read by each mode.')
+parser.add_argument('--object-size', type=int, default=64 * 1024, help='Size in bytes of each object.')
+parser.add_argument('--concurrency', type=int, default=256, help='Number of concurrent coroutines.')
+parser.add_argument('--max-workers', type=int, default=16, help='Number of executor threads of AsyncOssClient.')
+parser.add_argument('--output', type=str, default='', help='Path of the JSON result, printed if not set.')
+
+
+class LoopMonitor:
+    """Measures how late a ticker of 1 ms wakes up, and the peak number of threads."""
+
+    def __init__(self):
+        self.lags = []
+        self.peak_threads = threading.active_count()
+        self._task = None
+
+    async def _tick(self):
+        while True:
+            start_time = time.perf_counter()
+            await asyncio.sleep(0.001)
+            self.lags.append(time.perf_counter() - start_time - 0.001)
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._tick())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        lags = sorted(self.lags) or [0.0]
+        return {"loop_lag_p50_ms": lags[len(lags) // 2] * 1e3, "loop_lag_p99_ms": lags[int(len(lags) * 0.99)] * 1e3,
+                "loop_lag_max_ms": lags[-1] * 1e3, "peak_threads": self.peak_threads}
+
+
+async def run_mode(keys, bucket: str, concurrency: int, read_one) -> dict:
+    monitor = LoopMonitor()
+    monitor.start()
+    pending = iter(keys)
+    nbytes = 0
+
+    async def worker():
+        nonlocal nbytes
+        for key in pending:
+            # awaited before the addition, which would otherwise use the value of 'nbytes' before the await
+            n = await read_one(bucket, key)
+            nbytes += n
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+    result = {"seconds": elapsed, "bytes": nbytes, "objects_per_s": len(keys) / elapsed,
+              "throughput_mb_s": nbytes / elapsed / 1024 / 1024}
+    result.update(await monitor.stop())
+    return result
+
+
+async def run(args, client: OssClient, keys) -> dict:
+    results = {}
+
+    async with AsyncOssClient(client=client, max_workers=args.max_workers) as async_client:
+        async def read_async(bucket, key):
+            async with await async_client.get_object(bucket, key) as obj:
+                return len(await obj.read())
+        results["async_client"] = await run_mode(keys, args.bucket, args.concurrency, read_async)
+
+    executor = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="oss-thread-wrapper")
+    loop = asyncio.get_running_loop()
+
+    def read_blocking(bucket, key):
+        with client.get_object(bucket, key) as obj:
+            return len(obj.read())
+
+    async def read_threaded(bucket, key):
+        return await loop.run_in_executor(executor, read_blocking, bucket, key)
+    results["thread_pool_wrapper"] = await run_mode(keys, args.bucket, args.concurrency, read_threaded)
+    executor.shutdown()
+    return results
+
+
+def main():
+    args = parser.parse_args()
+    server = None
+    endpoint, cred_path, region = args.endpoint, args.cred_path, args.region
+    if not endpoint:
+        server = MockOssServer(tempfile.mkdtemp(prefix="osstorchconnector-mock-oss-"), latency=args.latency,
+                               host_suffix=args.host_suffix)
+        server.check_bucket(args.bucket)
+        server.start(process=True)
+        endpoint = server.endpoint
+        region = region or "cn-hangzhou"
+        mock_cred_path, mock_config_path = write_client_files(tempfile.mkdtemp(prefix="osstorchconnector-mock-client-"))
+        cred_path = cred_path or mock_cred_path
+        args.config_path = args.config_path or mock_config_path
+    try:
+        client = OssClient(endpoint, cred_path, args.config_path, region=region)
+        keys = [args.prefix + "%06d.bin" % i for i in range(args.num_objects)]
+        for key in keys:
+            with client.put_object(args.bucket, key) as writer:
+                writer.write(os.urandom(args.object_size))
+        results = asyncio.run(run(args, client, keys))
+    finally:
+        if server is not None:
+            server.stop()
+    report = {
+        "config": {"latency": args.latency if server is not None else None, "num_objects": args.num_objects,
+                   "object_size": args.object_size, "concurrency": args.concurrency, "max_workers": args.max_workers},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
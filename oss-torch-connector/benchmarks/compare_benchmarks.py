@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+"""
+Compare two results of run_benchmarks.py
+
+This script compares the median time of each benchmark of a result with a
+baseline, and exits with status 1 if any benchmark is slower than the baseline
+by more than the threshold, so that it can gate changes in CI.
+
+Usage:
+    python compare_benchmarks.py <baseline.json> <result.json> --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+parser = argparse.ArgumentParser(description='Compare two results of run_benchmarks.py')
+parser.add_argument('baseline', type=str, help='JSON result of the baseline.')
+parser.add_argument('result', type=str, help='JSON result to compare.')
+parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown reported as a regression.')
+
+
+def main():
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.result) as f:
+        result = json.load(f)
+    if baseline.get("mode") != result.get("mode") or baseline.get("config") != result.get("config"):
+        print("warning: mode or config differ, results may not be comparable")
+    regressions = []
+    print("%-24s %10s %10s %8s" % ("benchmark", "base_s", "new_s", "change"))
+    for name, new in result["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or "seconds" not in base or "seconds" not in new:
+            print("%-24s %10s %10s %8s" % (name, "-", "-", "skipped"))
+            continue
+        change = new["seconds"] / base["seconds"] - 1 if base["seconds"] > 0 else 0.0
+        mark = ""
+        if change > args.threshold:
+            regressions.append(name)
+            mark = " REGRESSION"
+        print("%-24s %10.3f %10.3f %+7.1f%%%s" % (name, base["seconds"], new["seconds"], change * 100, mark))
+    if regressions:
+        print("%d regression(s): %s" % (len(regressions), ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+
+"""
+Local OSS-compatible stand-in for benchmarks
+
+This script serves the subset of the OSS REST API used by the connector
+(GetObject with ranges, HeadObject, GetObjectMeta, PutObject, CopyObject,
+AppendObject, DeleteObject, ListObjects V1/V2, multipart upload), storing
+objects in a local directory. Signatures are not verified and buckets are
+created on first use. Both virtual-hosted style (<bucket>.<host>) and path
+style (/<bucket>/<key>) requests are accepted.
+
+Latency (seconds before the response headers), stragglers (a fraction of
+responses with a much longer latency), bandwidth (bytes per second of each
+response and request body, and of all of them together, the throttled link of
+a remote endpoint) and an error rate (503 SlowDown) can be injected to emulate
+a remote OSS endpoint.
+
+The connector always sends virtual-hosted style requests, so its endpoint is
+the host suffix (e.g. http://localhost:8765 with '--host-suffix localhost'),
+and <bucket>.<host suffix> must resolve to the server, e.g. with a line
+'127.0.0.1 <bucket>.localhost' in /etc/hosts.
+
+Usage:
+    python mock_oss_server.py --root <dir> --port 8765 --latency 0.02 --bandwidth 104857600 --host-suffix localhost
+"""
+
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+import argparse
+import hashlib
+import ipaddress
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+class ObjectStore:
+    """Objects of each bucket are files named by the quoted key in '<root>/<bucket>/'."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._uploads = {}
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, quote(key, safe=""))
+
+    def _tmp_path(self, bucket: str) -> str:
+        directory = os.path.join(self.root, ".tmp")
+        os.makedirs(directory, exist_ok=True)
+        os.makedirs(os.path.join(self.root, bucket), exist_ok=True)
+        return os.path.join(directory, uuid.uuid4().hex)
+
+    def stat(self, bucket: str, key: str):
+        try:
+            st = os.stat(self._path(bucket, key))
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def open(self, bucket: str, key: str):
+        return open(self._path(bucket, key), "rb")
+
+    def commit(self, bucket: str, key: str, tmp_path: str):
+        os.replace(tmp_path, self._path(bucket, key))
+
+    def new_file(self, bucket: str):
+        path = self._tmp_path(bucket)
+        return path, open(path, "wb")
+
+    def copy(self, bucket: str, key: str, src_bucket: str, src_key: str) -> bool:
+        if self.stat(src_bucket, src_key) is None:
+            return False
+        path = self._tmp_path(bucket)
+        shutil.copyfile(self._path(src_bucket, src_key), path)
+        self.commit(bucket, key, path)
+        return True
+
+    def append(self, bucket: str, key: str, data_path: str, position: int) -> int:
+        with self._lock:
+            current = self.stat(bucket, key)
+            size = current[0] if current else 0
+            if size != position:
+                return -1
+            with open(self._path(bucket, key), "ab") as f, open(data_path, "rb") as data:
+                shutil.copyfileobj(data, f)
+            os.remove(data_path)
+            return self.stat(bucket, key)[0]
+
+    def delete(self, bucket: str, key: str):
+        try:
+            os.remove(self._path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self, bucket: str):
+        directory = os.path.join(self.root, bucket)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(unquote(name) for name in os.listdir(directory))
+
+    def create_upload(self, bucket: str, key: str) -> str:
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = (bucket, key, {})
+        return upload_id
+
+    def upload_part(self, upload_id: str, number: int, data_path: str) -> bool:
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                return False
+            old = upload[2].get(number)
+            upload[2][number] = data_path
+        if old is not None:
+            os.remove(old)
+        return True
+
+    def complete_upload(self, upload_id: str, numbers) -> bool:
+        with self._lock:
+            upload = self._uploads.pop(upload_id, None)
+        if upload is None:
+            return False
+        bucket, key, parts = upload
+        numbers = list(numbers) or sorted(parts)
+        path, f = self.new_file(bucket)
+        with f:
+            for number in numbers:
+                with open(parts[number], "rb") as part:
+                    shutil.copyfileobj(part, f)
+        for part in parts.values():
+            os.remove(part)
+        self.commit(bucket, key, path)
+        return True
+
+    def abort_upload(self, upload_id: str):
+        with self._lock:
+            upload = self._uploads.pop(upload_id, None)
+        if upload is not None:
+            for part in upload[2].values():
+                os.remove(part)
+
+
+class OssRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "AliyunOSS"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # request parsing
+
+    def _parse(self):
+        url = urlsplit(self.path)
+        self.query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        path = unquote(url.path)
+        host = (self.headers.get("Host") or "").rsplit(":", 1)[0]
+        suffix = self.server.host_suffix
+        if suffix and not _is_ip(host) and host.endswith("." + suffix):
+            self.bucket, self.key = host[:-len(suffix) - 1], path[1:]
+            return
+        parts = path[1:].split("/", 1)
+        self.bucket = parts[0]
+        self.key = parts[1] if len(parts) > 1 else ""
+
+    def _read_body(self) -> str:
+        # request bodies are spooled to a file of the store, throttled like responses
+        path, f = self.server.store.new_file(self.bucket)
+        with f:
+            if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        break
+                    self._copy(self.rfile, f, size)
+                    self.rfile.readline()
+            else:
+                self._copy(self.rfile, f, int(self.headers.get("Content-Length") or 0))
+        return path
+
+    def _copy(self, src, dst, length: int):
+        start_time = time.perf_counter()
+        copied = 0
+        while copied < length:
+            data = src.read(min(CHUNK_SIZE, length - copied))
+            if not data:
+                break
+            self.server.throttle_link(len(data))
+            dst.write(data)
+            copied += len(data)
+            self._throttle(start_time, copied)
+
+    def _throttle(self, start_time: float, nbytes: int):
+        bandwidth = self.server.bandwidth
+        if bandwidth > 0:
+            delay = start_time + nbytes / bandwidth - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    # responses
+
+    def _headers(self, status: int, length: int, extra=None):
+        self.send_response(status)
+        self.send_header("x-oss-request-id", uuid.uuid4().hex.upper()[:24])
+        self.send_header("Content-Length", str(length))
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _xml(self, status: int, body: str, extra=None):
+        data = ('<?xml version="1.0" encoding="UTF-8"?>\n' + body).encode("utf-8")
+        headers = {"Content-Type": "application/xml"}
+        headers.update(extra or {})
+        self._headers(status, len(data), headers)
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _error(self, status: int, code: str, message: str):
+        self._xml(status, "<Error><Code>%s</Code><Message>%s</Message><BucketName>%s</BucketName></Error>"
+                  % (code, escape(message), escape(self.bucket)))
+
+    def _object_headers(self, size: int, mtime: float):
+        return {
+            "ETag": '"%s"' % hashlib.md5(("%s/%s/%d/%f" % (self.bucket, self.key, size, mtime)).encode()).hexdigest().upper(),
+            "Last-Modified": formatdate(mtime, usegmt=True),
+            "x-oss-object-type": "Normal",
+            "Accept-Ranges": "bytes",
+            "Content-Type": "application/octet-stream",
+        }
+
+    def _prepare(self) -> bool:
+        self._parse()
+        self.server.count_request()
+        if self.server.latency > 0:
+            time.sleep(max(0.0, random.gauss(self.server.latency, self.server.latency * self.server.jitter)))
+        if self.server.slow_rate > 0 and random.random() < self.server.slow_rate:
+            time.sleep(self.server.slow_latency)
+        if self.server.error_rate > 0 and random.random() < self.server.error_rate:
+            if self.command in ("PUT", "POST"):
+                # the body must be consumed to keep the connection usable
+                os.remove(self._read_body())
+            self._error(503, "SlowDown", "Please reduce your request rate.")
+            return False
+        return True
+
+    def do_HEAD(self):
+        if not self._prepare():
+            return
+        stat = self.server.store.stat(self.bucket, self.key)
+        if stat is None:
+            self._headers(404, 0)
+            return
+        self._headers(200, stat[0], self._object_headers(*stat))
+
+    def do_GET(self):
+        if not self._prepare():
+            return
+        if not self.key:
+            if "location" in self.query:
+                self._xml(200, "<LocationConstraint>oss-cn-mock</LocationConstraint>")
+            elif "bucketInfo" in self.query:
+                self._xml(200, "<BucketInfo><Bucket><Name>%s</Name><Location>oss-cn-mock</Location></Bucket></BucketInfo>"
+                          % escape(self.bucket))
+            else:
+                self._list()
+            return
+        stat = self.server.store.stat(self.bucket, self.key)
+        if stat is None:
+            self._error(404, "NoSuchKey", "The specified key does not exist.")
+            return
+        size, mtime = stat
+        headers = self._object_headers(size, mtime)
+        if "objectMeta" in self.query:
+            self._headers(200, 0, dict(headers, **{"x-oss-object-size": str(size)}))
+            return
+        start, end = 0, size - 1
+        status = 200
+        ranges = self.headers.get("Range")
+        if ranges and ranges.startswith("bytes="):
+            first, _, last = ranges[len("bytes="):].split(",")[0].partition("-")
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            elif last:
+                start = max(0, size - int(last))
+            if start >= size or start > end:
+                # OSS returns the whole object for an invalid range
+                start, end = 0, size - 1
+            else:
+                status = 206
+                headers["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+        length = max(0, end - start + 1)
+        self._headers(status, length, headers)
+        with self.server.store.open(self.bucket, self.key) as f:
+            f.seek(start)
+            self._copy(f, self.wfile, length)
+
+    def do_PUT(self):
+        if not self._prepare():
+            return
+        store = self.server.store
+        if "uploadId" in self.query:
+            path = self._read_body()
+            if not store.upload_part(self.query["uploadId"], int(self.query.get("partNumber", 1)), path):
+                os.remove(path)
+                self._error(404, "NoSuchUpload", "The specified upload does not exist.")
+                return
+            self._headers(200, 0, {"ETag": '"%s"' % uuid.uuid4().hex.upper()})
+            return
+        source = self.headers.get("x-oss-copy-source")
+        if source:
+            src_bucket, _, src_key = unquote(source).lstrip("/").partition("/")
+            os.remove(self._read_body())
+            if not store.copy(self.bucket, self.key, src_bucket, src_key):
+                self._error(404, "NoSuchKey", "The specified key does not exist.")
+                return
+            size, mtime = store.stat(self.bucket, self.key)
+            self._xml(200, "<CopyObjectResult><ETag>%s</ETag><LastModified>%s</LastModified></CopyObjectResult>"
+                      % (self._object_headers(size, mtime)["ETag"], formatdate(mtime, usegmt=True)))
+            return
+        store.commit(self.bucket, self.key, self._read_body())
+        size, mtime = store.stat(self.bucket, self.key)
+        self._headers(200, 0, {"ETag": self._object_headers(size, mtime)["ETag"]})
+
+    def do_POST(self):
+        if not self._prepare():
+            return
+        store = self.server.store
+        path = self._read_body()
+        if "uploads" in self.query:
+            os.remove(path)
+            upload_id = store.create_upload(self.bucket, self.key)
+            self._xml(200, "<InitiateMultipartUploadResult><Bucket>%s</Bucket><Key>%s</Key><UploadId>%s</UploadId>"
+                      "</InitiateMultipartUploadResult>" % (escape(self.bucket), escape(self.key), upload_id))
+        elif "uploadId" in self.query:
+            numbers = []
+            with open(path, "rb") as f:
+                body = f.read()
+            os.remove(path)
+            if body.strip():
+                for part in ElementTree.fromstring(body).iter():
+                    if part.tag.endswith("PartNumber"):
+                        numbers.append(int(part.text))
+            if not store.complete_upload(self.query["uploadId"], numbers):
+                self._error(404, "NoSuchUpload", "The specified upload does not exist.")
+                return
+            size, mtime = store.stat(self.bucket, self.key)
+            self._xml(200, "<CompleteMultipartUploadResult><Bucket>%s</Bucket><Key>%s</Key><ETag>%s</ETag>"
+                      "</CompleteMultipartUploadResult>" % (escape(self.bucket), escape(self.key),
+                                                            self._object_headers(size, mtime)["ETag"]))
+        elif "append" in self.query:
+            next_position = store.append(self.bucket, self.key, path, int(self.query.get("position", 0)))
+            if next_position < 0:
+                os.remove(path)
+                self._error(409, "PositionNotEqualToLength", "Position is not equal to file length.")
+                return
+            self._headers(200, 0, {"x-oss-next-append-position": str(next_position)})
+        else:
+            os.remove(path)
+            self._error(400, "InvalidRequest", "Unsupported request.")
+
+    def do_DELETE(self):
+        if not self._prepare():
+            return
+        if "uploadId" in self.query:
+            self.server.store.abort_upload(self.query["uploadId"])
+        else:
+            self.server.store.delete(self.bucket, self.key)
+        self._headers(204, 0)
+
+    def _list(self):
+        query = self.query
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter", "")
+        max_keys = int(query.get("max-keys") or 100)
+        v2 = query.get("list-type") == "2"
+        after = query.get("continuation-token") or query.get("start-after", "") if v2 else query.get("marker", "")
+        contents, prefixes = [], []
+        truncated = False
+        last = ""
+        for key in self.server.store.keys(self.bucket):
+            if not key.startswith(prefix) or key <= after:
+                continue
+            if delimiter:
+                pos = key.find(delimiter, len(prefix))
+                if pos >= 0:
+                    common = key[:pos + len(delimiter)]
+                    if prefixes and prefixes[-1] == common:
+                        continue
+                    if common <= after:
+                        continue
+                    if len(contents) + len(prefixes) >= max_keys:
+                        truncated = True
+                        break
+                    prefixes.append(common)
+                    # keys under a returned common prefix are skipped by the next page
+                    last = common
+                    continue
+            if len(contents) + len(prefixes) >= max_keys:
+                truncated = True
+                break
+            contents.append(key)
+            last = key
+        items = []
+        for key in contents:
+            size, mtime = self.server.store.stat(self.bucket, key) or (0, 0)
+            items.append("<Contents><Key>%s</Key><LastModified>%s</LastModified><ETag>%s</ETag><Type>Normal</Type>"
+                         "<Size>%d</Size><StorageClass>Standard</StorageClass></Contents>"
+                         % (escape(key), time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(mtime)),
+                            self._object_headers(size, mtime)["ETag"], size))
+        items.extend("<CommonPrefixes><Prefix>%s</Prefix></CommonPrefixes>" % escape(p) for p in prefixes)
+        if v2:
+            page = "<KeyCount>%d</KeyCount>" % (len(contents) + len(prefixes))
+            if truncated:
+                page += "<NextContinuationToken>%s</NextContinuationToken>" % escape(last)
+        else:
+            page = "<Marker>%s</Marker>" % escape(after)
+            if truncated:
+                page += "<NextMarker>%s</NextMarker>" % escape(last)
+        self._xml(200, "<ListBucketResult><Name>%s</Name><Prefix>%s</Prefix>%s<MaxKeys>%d</MaxKeys><Delimiter>%s</Delimiter>"
+                  "<IsTruncated>%s</IsTruncated>%s</ListBucketResult>"
+                  % (escape(self.bucket), escape(prefix), page, max_keys, escape(delimiter),
+                     "true" if truncated else "false", "".join(items)))
+
+
+class MockOssServer(ThreadingHTTPServer):
+    """A mock OSS endpoint serving objects of 'root' on 'host':'port' (0 picks a free port).
+
+    Args:
+      root(str): Directory of the objects.
+      latency(float): Mean seconds before each response.
+      jitter(float): Standard deviation of the latency, relative to 'latency'.
+      slow_rate(float): Fraction of requests delayed by 'slow_latency' more, the stragglers of a remote endpoint.
+      slow_latency(float): Additional seconds before the response of a straggler.
+      bandwidth(float): Bytes per second of each response or request body, 0 for unlimited.
+      total_bandwidth(float): Bytes per second of all responses and request bodies together, 0 for unlimited.
+      error_rate(float): Fraction of requests failed with 503 SlowDown.
+      host_suffix(str): Host of virtual-hosted style requests (<bucket>.<host_suffix>), path style is used otherwise.
+
+    The native clients of the connector send virtual-hosted style requests to <bucket>.<endpoint host>, so they need a
+    'host_suffix' whose bucket hosts resolve to the server (see 'check_bucket'), and they hold the GIL while waiting for
+    responses, so the server runs in a child process for them (see 'start').
+    """
+
+    daemon_threads = True
+    # the native clients open a connection per concurrent prefetch, beyond the default backlog of 5 connections are
+    # dropped and retried after a second
+    request_queue_size = 1024
+
+    def __init__(self, root: str, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 bandwidth: float = 0, error_rate: float = 0.0, host_suffix: str = "", verbose: bool = False,
+                 slow_rate: float = 0.0, slow_latency: float = 0.0, total_bandwidth: float = 0):
+        super().__init__((host, port), OssRequestHandler)
+        self.store = ObjectStore(root)
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.bandwidth = bandwidth
+        self.total_bandwidth = total_bandwidth
+        self._link_time = 0.0
+        self.error_rate = error_rate
+        self.host_suffix = host_suffix
+        self.verbose = verbose
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._process = None
+
+    @property
+    def endpoint(self) -> str:
+        return "http://%s:%d" % (self.host_suffix or self.server_address[0], self.server_address[1])
+
+    def check_bucket(self, bucket: str):
+        """Raises if the virtual-hosted style requests of 'bucket' cannot reach the server."""
+        if not self.host_suffix:
+            return
+        host = "%s.%s" % (bucket, self.host_suffix)
+        try:
+            socket.getaddrinfo(host, self.server_address[1])
+        except socket.gaierror:
+            raise RuntimeError("%s does not resolve, add '%s %s' to /etc/hosts" % (host, self.server_address[0], host))
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def throttle_link(self, nbytes: int):
+        """Waits for the transfer of 'nbytes' on the link shared by all requests, first come first served."""
+        if self.total_bandwidth <= 0:
+            return
+        with self._lock:
+            self._link_time = max(self._link_time, time.perf_counter()) + nbytes / self.total_bandwidth
+            end_time = self._link_time
+        delay = end_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def start(self, process: bool = False) -> "MockOssServer":
+        """Serves requests on a background thread, or in a forked child process if 'process' is set.
+        Requests served in a child process are not counted in 'requests'."""
+        if process:
+            self._process = multiprocessing.get_context("fork").Process(target=self.serve_forever,
+                                                                        name="mock-oss-server", daemon=True)
+            self._process.start()
+            return self
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-oss-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+        else:
+            self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def write_client_files(directory: str) -> Tuple[str, str]:
+    """Writes credentials (signatures are not verified by the mock server) and a configuration file of the
+    connector, logging into 'directory', and returns their paths."""
+    cred_path = os.path.join(directory, "credentials")
+    with open(cred_path, "w") as f:
+        json.dump({"AccessKeyId": "mock", "AccessKeySecret": "mock"}, f)
+    config_path = os.path.join(directory, "config.json")
+    with open(config_path, "w") as f:
+        json.dump({"logLevel": 1, "logPath": os.path.join(directory, "connector.log"),
+                   "auditPath": os.path.join(directory, "audit.log")}, f)
+    return cred_path, config_path
+
+
+parser = argparse.ArgumentParser(description='Local OSS-compatible stand-in for benchmarks')
+parser.add_argument('--root', type=str, required=True, help='Directory of the objects.')
+parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on.')
+parser.add_argument('--port', type=int, default=8765, help='Port to listen on.')
+parser.add_argument('--latency', type=float, default=0.0, help='Mean seconds before each response.')
+parser.add_argument('--jitter', type=float, default=0.0, help='Standard deviation of the latency, relative to the latency.')
+parser.add_argument('--slow-rate', type=float, default=0.0, help='Fraction of requests delayed by --slow-latency more.')
+parser.add_argument('--slow-latency', type=float, default=0.0, help='Additional seconds before the response of a delayed request.')
+parser.add_argument('--bandwidth', type=float, default=0, help='Bytes per second of each response or request body, 0 for unlimited.')
+parser.add_argument('--total-bandwidth', type=float, default=0, help='Bytes per second of all responses and request bodies together, 0 for unlimited.')
+parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failed with 503 SlowDown.')
+parser.add_argument('--host-suffix', type=str, default='', help='Host of virtual-hosted style requests (<bucket>.<host-suffix>).')
+parser.add_argument('--verbose', action='store_true', help='Log each request.')
+
+
+def main():
+    args = parser.parse_args()
+    server = MockOssServer(args.root, args.host, args.port, args.latency, args.jitter, args.bandwidth,
+                           args.error_rate, args.host_suffix, args.verbose, args.slow_rate, args.slow_latency,
+                           args.total_bandwidth)
+    print("serving %s on %s" % (args.root, server.endpoint))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the read and write paths of osstorchconnector
+
+This script uploads a fixture (small objects, a tar archive of them) and measures
+dataset listing, OssMapDataset random access, OssIterableDataset streaming, tar
+mode, OssCheckpoint save/load, DCP save/load and safetensors save/load. Each
+benchmark is repeated and the median is reported as JSON, which
+compare_benchmarks.py compares against a baseline.
+
+Without '--endpoint', a local mock OSS server (mock_oss_server.py) is started
+in a child process, with the given latency and bandwidth. Its bucket host
+<bucket>.<host suffix> must resolve to 127.0.0.1, e.g. with a line
+'127.0.0.1 benchmark.localhost' in /etc/hosts. With '--local', datasets are read from a
+local directory through the empty-endpoint mode, and benchmarks which require
+an endpoint are skipped.
+
+Usage:
+    1. Against the local mock OSS server, emulating a remote endpoint:
+    python run_benchmarks.py --latency 0.02 --bandwidth 104857600 --output result.json
+    2. Against an OSS endpoint:
+    python run_benchmarks.py --endpoint <endpoint> --cred-path <cred_path> --config-path <config_path> \
+                             --bucket <bucket> --output result.json
+    3. Against a local directory:
+    python run_benchmarks.py --local --local-dir /tmp/osstorchconnector-benchmark --output result.json
+"""
+
+from osstorchconnector import OssClient, OssMapDataset, OssIterableDataset, OssCheckpoint, OssFileSystem, OssSafetensor
+from mock_oss_server import MockOssServer, write_client_files
+import argparse
+import json
+import os
+import osstorchconnector
+import platform
+import statistics
+import tempfile
+import time
+import torch
+import torch.distributed.checkpoint as DCP
+import torch.utils.data
+
+BENCHMARKS = [
+    "list",
+    "map_random_access",
+    "iterable_streaming",
+    "tar_map_random_access",
+    "tar_iterable_streaming",
+    "checkpoint_save",
+    "checkpoint_load",
+    "checkpoint_read",
+    "dcp_save",
+    "dcp_load",
+    "safetensors_save",
+    "safetensors_load",
+]
+
+# benchmarks which run without an endpoint, on a local directory
+LOCAL_BENCHMARKS = ["list", "map_random_access", "iterable_streaming"]
+
+parser = argparse.ArgumentParser(description='Benchmark the read and write paths of osstorchconnector')
+parser.add_argument('-ep', '--endpoint', type=str, default='', help='Endpoint of OSS, a local mock server is started if not set.')
+parser.add_argument('--cred-path', type=str, default='', help='Credential info of the OSS bucket, a dummy one is used with the mock server.')
+parser.add_argument('--config-path', type=str, default='', help='Configuration file path of the OSS connector.')
+parser.add_argument('--region', type=str, default='', help='OSS region, "cn-hangzhou" is used with the mock server.')
+parser.add_argument('--bucket', type=str, default='benchmark', help='Bucket of the fixture.')
+parser.add_argument('--prefix', type=str, default='osstorchconnector-benchmark/', help='Prefix of the fixture in the bucket.')
+parser.add_argument('--local', action='store_true', help='Read datasets from a local directory (empty endpoint mode).')
+parser.add_argument('--local-dir', type=str, default='', help='Local directory of the fixture with --local, a temporary one if not set.')
+parser.add_argument('--mock-root', type=str, default='', help='Directory of the mock server objects, a temporary one if not set.')
+parser.add_argument('--latency', type=float, default=0.0, help='Mean seconds before each response of the mock server.')
+parser.add_argument('--jitter', type=float, default=0.0, help='Standard deviation of the mock server latency, relative to the latency.')
+parser.add_argument('--bandwidth', type=float, default=0, help='Bytes per second of each mock server response, 0 for unlimited.')
+parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of mock server requests failed with 503 SlowDown.')
+parser.add_argument('--host-suffix', type=str, default='localhost', help='Host of the mock server, <bucket>.<host-suffix> must resolve to 127.0.0.1.')
+parser.add_argument('--num-objects', type=int, default=1000, help='Number of objects of the dataset fixture.')
+parser.add_argument('--object-size', type=int, default=100 * 1024, help='Size in bytes of each object.')
+parser.add_argument('--batch-size', type=int, default=64, help='Batch size of the DataLoader.')
+parser.add_argument('--batches', type=int, default=20, help='Number of batches read by random access benchmarks.')
+parser.add_argument('--num-workers', type=int, default=0, help='Number of DataLoader workers.')
+parser.add_argument('--checkpoint-size', type=int, default=256 << 20, help='Size in bytes of the checkpoint fixtures.')
+parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each benchmark, the median is reported.')
+parser.add_argument('--benchmarks', type=str, nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='Benchmarks to run.')
+parser.add_argument('--skip-upload', action='store_true', help='Reuse the fixture uploaded by a previous run.')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the checkpoint fixtures and of the samplers.')
+parser.add_argument('--output', type=str, default='', help='Path of the JSON result, printed if not set.')
+
+
+def read_size(object) -> int:
+    return len(object.read())
+
+
+def sum_sizes(sizes) -> int:
+    return sum(sizes)
+
+
+class Fixture:
+    def __init__(self, args, endpoint: str, cred_path: str, region: str):
+        self.args = args
+        self.endpoint = endpoint
+        self.cred_path = cred_path
+        self.region = region
+        if args.local:
+            # local paths are used as URIs in the empty endpoint mode
+            self.base_uri = os.path.join(os.path.abspath(args.local_dir), args.prefix)
+        else:
+            self.base_uri = "oss://%s/%s" % (args.bucket, args.prefix)
+        self.objects_uri = self.base_uri + "objects/"
+        self.tar_uri = self.base_uri + "tar/objects.tar"
+        self.tar_index_uri = self.base_uri + "tar/objects.tar.idx"
+        self.checkpoint_uri = self.base_uri + "checkpoint/model.pt"
+        self.dcp_uri = self.base_uri + "dcp/"
+        self.safetensors_uri = self.base_uri + "safetensors/model.safetensors"
+
+    @property
+    def kwargs(self):
+        return {"cred_path": self.cred_path, "config_path": self.args.config_path, "region": self.region}
+
+    def object_uris(self):
+        return [self.objects_uri + "%06d.bin" % i for i in range(self.args.num_objects)]
+
+    def state_dict(self):
+        # tensors of 16 MB at most, like layers of a model
+        generator = torch.Generator().manual_seed(self.args.seed)
+        state, remaining, i = {}, self.args.checkpoint_size // 4, 0
+        while remaining > 0:
+            numel = min(remaining, 4 << 20)
+            state["layer%d.weight" % i] = torch.rand(numel, generator=generator)
+            remaining -= numel
+            i += 1
+        return state
+
+    def upload(self):
+        uris = self.object_uris()
+        if self.args.local:
+            os.makedirs(self.objects_uri, exist_ok=True)
+            for uri in uris:
+                with open(uri, "wb") as f:
+                    f.write(os.urandom(self.args.object_size))
+            return
+        client = OssClient(self.endpoint, self.cred_path, self.args.config_path, region=self.region)
+        for uri in uris:
+            bucket, key = uri[len("oss://"):].split("/", 1)
+            with client.put_object(bucket, key) as writer:
+                writer.write(os.urandom(self.args.object_size))
+        client.gen_tar_archive(self.tar_uri, self.tar_index_uri, self.objects_uri)
+        checkpoint = OssCheckpoint(self.endpoint, **self.kwargs)
+        with checkpoint.writer(self.checkpoint_uri) as writer:
+            torch.save(self.state_dict(), writer)
+        fs = OssFileSystem(self.endpoint, **self.kwargs)
+        DCP.save(self.state_dict(), storage_writer=fs.writer(self.dcp_uri))
+        OssSafetensor(self.endpoint, **self.kwargs).save_file(self.state_dict(), self.safetensors_uri)
+
+
+def run_loader(dataset, args, sampler=None) -> dict:
+    loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, sampler=sampler,
+                                         num_workers=args.num_workers, collate_fn=sum_sizes)
+    nbytes, batches = 0, 0
+    start_time = time.perf_counter()
+    for size in loader:
+        nbytes += size
+        batches += 1
+        if sampler is not None and batches >= args.batches:
+            break
+    return {"seconds": time.perf_counter() - start_time, "bytes": nbytes, "ops": batches * args.batch_size}
+
+
+def random_sampler(dataset, args):
+    return torch.utils.data.RandomSampler(dataset, generator=torch.Generator().manual_seed(args.seed))
+
+
+def bench_list(fixture: Fixture, args) -> dict:
+    start_time = time.perf_counter()
+    dataset = OssMapDataset.from_prefix(fixture.objects_uri, fixture.endpoint, **fixture.kwargs)
+    return {"seconds": time.perf_counter() - start_time, "bytes": 0, "ops": len(dataset)}
+
+
+def bench_map_random_access(fixture: Fixture, args) -> dict:
+    dataset = OssMapDataset.from_prefix(fixture.objects_uri, fixture.endpoint, transform=read_size, **fixture.kwargs)
+    return run_loader(dataset, args, random_sampler(dataset, args))
+
+
+def bench_iterable_streaming(fixture: Fixture, args) -> dict:
+    dataset = OssIterableDataset.from_prefix(fixture.objects_uri, fixture.endpoint, transform=read_size, **fixture.kwargs)
+    return run_loader(dataset, args)
+
+
+def bench_tar_map_random_access(fixture: Fixture, args) -> dict:
+    dataset = OssMapDataset.from_tar(fixture.tar_uri, fixture.tar_index_uri, fixture.endpoint, transform=read_size,
+                                     **fixture.kwargs)
+    return run_loader(dataset, args, random_sampler(dataset, args))
+
+
+def bench_tar_iterable_streaming(fixture: Fixture, args) -> dict:
+    dataset = OssIterableDataset.from_tar(fixture.tar_uri, fixture.tar_index_uri, fixture.endpoint, transform=read_size,
+                                          **fixture.kwargs)
+    return run_loader(dataset, args)
+
+
+def bench_checkpoint_save(fixture: Fixture, args) -> dict:
+    checkpoint = OssCheckpoint(fixture.endpoint, **fixture.kwargs)
+    state = fixture.state_dict()
+    start_time = time.perf_counter()
+    with checkpoint.writer(fixture.base_uri + "checkpoint/save.pt") as writer:
+        torch.save(state, writer)
+    return {"seconds": time.perf_counter() - start_time, "bytes": args.checkpoint_size, "ops": 1}
+
+
+def bench_checkpoint_load(fixture: Fixture, args) -> dict:
+    checkpoint = OssCheckpoint(fixture.endpoint, **fixture.kwargs)
+    start_time = time.perf_counter()
+    with checkpoint.reader(fixture.checkpoint_uri) as reader:
+        torch.load(reader)
+    return {"seconds": time.perf_counter() - start_time, "bytes": args.checkpoint_size, "ops": 1}
+
+
+def bench_checkpoint_read(fixture: Fixture, args) -> dict:
+    checkpoint = OssCheckpoint(fixture.endpoint, **fixture.kwargs)
+    start_time = time.perf_counter()
+    nbytes = len(checkpoint.read(fixture.checkpoint_uri))
+    return {"seconds": time.perf_counter() - start_time, "bytes": nbytes, "ops": 1}
+
+
+def bench_dcp_save(fixture: Fixture, args) -> dict:
+    fs = OssFileSystem(fixture.endpoint, **fixture.kwargs)
+    state = fixture.state_dict()
+    start_time = time.perf_counter()
+    DCP.save(state, storage_writer=fs.writer(fixture.base_uri + "dcp-save/"))
+    return {"seconds": time.perf_counter() - start_time, "bytes": args.checkpoint_size, "ops": len(state)}
+
+
+def bench_dcp_load(fixture: Fixture, args) -> dict:
+    fs = OssFileSystem(fixture.endpoint, **fixture.kwargs)
+    state = {key: torch.zeros_like(value) for key, value in fixture.state_dict().items()}
+    start_time = time.perf_counter()
+    DCP.load(state, storage_reader=fs.reader(fixture.dcp_uri))
+    return {"seconds": time.perf_counter() - start_time, "bytes": args.checkpoint_size, "ops": len(state)}
+
+
+def bench_safetensors_save(fixture: Fixture, args) -> dict:
+    safetensor = OssSafetensor(fixture.endpoint, **fixture.kwargs)
+    state = fixture.state_dict()
+    start_time = time.perf_counter()
+    safetensor.save_file(state, fixture.base_uri + "safetensors/save.safetensors")
+    return {"seconds": time.perf_counter() - start_time, "bytes": args.checkpoint_size, "ops": len(state)}
+
+
+def bench_safetensors_load(fixture: Fixture, args) -> dict:
+    safetensor = OssSafetensor(fixture.endpoint, **fixture.kwargs)
+    start_time = time.perf_counter()
+    state = safetensor.load_file(fixture.safetensors_uri)
+    return {"seconds": time.perf_counter() - start_time, "bytes": args.checkpoint_size, "ops": len(state)}
+
+
+def run(name: str, fixture: Fixture, args) -> dict:
+    bench = globals()["bench_" + name]
+    runs = [bench(fixture, args) for _ in range(args.repeat)]
+    seconds = [r["seconds"] for r in runs]
+    median = statistics.median(seconds)
+    result = {
+        "seconds": median,
+        "min_seconds": min(seconds),
+        "max_seconds": max(seconds),
+        "bytes": runs[0]["bytes"],
+        "ops": runs[0]["ops"],
+        "throughput_mb_s": runs[0]["bytes"] / median / 1024 / 1024 if median > 0 else 0.0,
+        "ops_per_s": runs[0]["ops"] / median if median > 0 else 0.0,
+    }
+    print("%-24s %8.3f s %10.1f MB/s %10.1f ops/s" % (name, median, result["throughput_mb_s"], result["ops_per_s"]), flush=True)
+    return result
+
+
+def main():
+    args = parser.parse_args()
+    server = None
+    endpoint, cred_path, region = args.endpoint, args.cred_path, args.region
+    if args.local:
+        endpoint = ""
+        if not args.local_dir:
+            args.local_dir = tempfile.mkdtemp(prefix="osstorchconnector-benchmark-")
+    elif not endpoint:
+        server = MockOssServer(args.mock_root or tempfile.mkdtemp(prefix="osstorchconnector-mock-oss-"),
+                               latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth,
+                               error_rate=args.error_rate, host_suffix=args.host_suffix)
+        server.check_bucket(args.bucket)
+        server.start(process=True)
+        endpoint = server.endpoint
+        region = region or "cn-hangzhou"
+        mock_cred_path, mock_config_path = write_client_files(tempfile.mkdtemp(prefix="osstorchconnector-mock-client-"))
+        cred_path = cred_path or mock_cred_path
+        args.config_path = args.config_path or mock_config_path
+    fixture = Fixture(args, endpoint, cred_path, region)
+    try:
+        if not args.skip_upload:
+            start_time = time.perf_counter()
+            fixture.upload()
+            print("fixture uploaded in %.1f s" % (time.perf_counter() - start_time), flush=True)
+        results = {}
+        for name in args.benchmarks:
+            if args.local and name not in LOCAL_BENCHMARKS:
+                results[name] = {"skipped": "requires an endpoint"}
+                continue
+            results[name] = run(name, fixture, args)
+    finally:
+        if server is not None:
+            server.stop()
+    report = {
+        "schema": 1,
+        "mode": "local" if args.local else ("mock" if server is not None else "endpoint"),
+        "config": {
+            "latency": args.latency, "jitter": args.jitter, "bandwidth": args.bandwidth, "error_rate": args.error_rate,
+            "num_objects": args.num_objects, "object_size": args.object_size, "batch_size": args.batch_size,
+            "batches": args.batches, "num_workers": args.num_workers, "checkpoint_size": args.checkpoint_size,
+            "repeat": args.repeat, "seed": args.seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "package": os.path.dirname(osstorchconnector.__file__),
+        },
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+"""
+Validate behaviours of osstorchconnector against the local mock OSS server
+
+This script starts the mock OSS server (mock_oss_server.py) in a child process
+with the given latency and bandwidth, uploads a fixture of small objects and a tar archive of
+them, and runs checks of behaviours which only show against a remote-like
+endpoint. Each check prints PASS or FAIL with its measurements, and the script
+exits with a non-zero status if a check fails. The bucket host
+<bucket>.<host suffix> must resolve to 127.0.0.1, e.g. with a line
+'127.0.0.1 validate.localhost' in /etc/hosts.
+
+Usage:
+    python validate_mock.py --latency 0.05 --bandwidth 10485760
+    python validate_mock.py --latency 0.02 --slow-rate 0.05 --slow-latency 1.0 --checks hedge
+    python validate_mock.py --latency 0.05 --slow-rate 0 --bandwidth 4194304 --total-bandwidth 268435456 --checks adaptive_dataset adaptive_checkpoint
+"""
+
+from typing import List
+from osstorchconnector import OssClient, OssMapDataset, OssIterableDataset, OssCheckpoint, HedgePolicy
+from mock_oss_server import MockOssServer, write_client_files
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+CHECKS = [
+    "tar_len",
+    "hedge",
+    "adaptive_dataset",
+    "adaptive_checkpoint",
+]
+UPLOAD_ATTEMPTS = 10
+
+parser = argparse.ArgumentParser(description='Validate behaviours of osstorchconnector against the local mock OSS server')
+parser.add_argument('--latency', type=float, default=0.05, help='Mean seconds before each response of the mock server.')
+parser.add_argument('--jitter', type=float, default=0.0, help='Standard deviation of the mock server latency, relative to the latency.')
+parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failed by the mock server with 503 SlowDown.')
+parser.add_argument('--slow-rate', type=float, default=0.05, help='Fraction of requests of the mock server delayed by --slow-latency more.')
+parser.add_argument('--slow-latency', type=float, default=1.0, help='Additional seconds before the response of a delayed request.')
+parser.add_argument('--bandwidth', type=float, default=0, help='Bytes per second of each mock server response, 0 for unlimited.')
+parser.add_argument('--total-bandwidth', type=float, default=0, help='Bytes per second of all mock server responses together, 0 for unlimited.')
+parser.add_argument('--bucket', type=str, default='validate', help='Bucket of the fixture.')
+parser.add_argument('--host-suffix', type=str, default='localhost', help='Host of the mock server, <bucket>.<host-suffix> must resolve to 127.0.0.1.')
+parser.add_argument('--num-objects', type=int, default=64, help='Number of objects of the dataset fixture.')
+parser.add_argument('--object-size', type=int, default=64 * 1024, help='Size in bytes of each object.')
+parser.add_argument('--batches', type=int, default=20, help='Number of batches read by the hedge check.')
+parser.add_argument('--batch-size', type=int, default=16, help='Batch size of the hedge check.')
+parser.add_argument('--adaptive-batches', type=int, default=24, help='Number of batches (of all the objects) read by the adaptive_dataset check.')
+parser.add_argument('--checkpoint-size', type=int, default=32 << 20, help='Size in bytes of the checkpoint of the adaptive_checkpoint check.')
+parser.add_argument('--checkpoint-reads', type=int, default=12, help='Number of reads of the checkpoint by the adaptive_checkpoint check.')
+parser.add_argument('--checks', type=str, nargs='+', choices=CHECKS, default=CHECKS, help='Checks to run.')
+
+
+class Fixture:
+    def __init__(self, args, endpoint: str, cred_path: str, config_path: str):
+        self.args = args
+        self.endpoint = endpoint
+        self.kwargs = {"cred_path": cred_path, "config_path": config_path, "region": "cn-hangzhou"}
+        self.objects_uri = "oss://%s/objects/" % args.bucket
+        self.tar_uri = "oss://%s/tar/objects.tar" % args.bucket
+        self.tar_index_uri = "oss://%s/tar/objects.tar.idx" % args.bucket
+        self.checkpoint_uri = "oss://%s/checkpoint/model.pt" % args.bucket
+
+    def object_uris(self):
+        return [self.objects_uri + "%06d.bin" % i for i in range(self.args.num_objects)]
+
+    def upload(self):
+        client = OssClient(self.endpoint, **self.kwargs)
+        for uri in self.object_uris():
+            bucket, key = uri[len("oss://"):].split("/", 1)
+            for attempt in range(UPLOAD_ATTEMPTS):
+                # uploads are not retried by the native library, and may fail with '--error-rate'
+                try:
+                    with client.put_object(bucket, key) as writer:
+                        writer.write(os.urandom(self.args.object_size))
+                    break
+                except RuntimeError:
+                    if attempt == UPLOAD_ATTEMPTS - 1:
+                        raise
+        client.gen_tar_archive(self.tar_uri, self.tar_index_uri, self.objects_uri)
+        if "adaptive_checkpoint" in self.args.checks:
+            bucket, key = self.checkpoint_uri[len("oss://"):].split("/", 1)
+            with client.put_object(bucket, key) as writer:
+                writer.write(os.urandom(self.args.checkpoint_size))
+
+
+def check_tar_len(fixture: Fixture, args) -> dict:
+    # the length of tar map datasets, and the chunks of shuffled tar iterable datasets, come from the length of the
+    # (timed) native member stream
+    n = args.num_objects
+    lengths = {
+        "map": len(OssMapDataset.from_tar(fixture.tar_uri, fixture.tar_index_uri, fixture.endpoint, **fixture.kwargs)),
+        "iterable": sum(1 for _ in OssIterableDataset.from_tar(fixture.tar_uri, fixture.tar_index_uri,
+                                                               fixture.endpoint, **fixture.kwargs)),
+        "iterable_shuffle": sum(1 for _ in OssIterableDataset.from_tar(fixture.tar_uri, fixture.tar_index_uri,
+                                                                       fixture.endpoint, shuffle=True,
+                                                                       **fixture.kwargs)),
+    }
+    return {"passed": all(length == n for length in lengths.values()), "expected": n, "lengths": lengths}
+
+
+def read_size(object) -> int:
+    return len(object.read())
+
+
+def batch_seconds(dataset, args) -> List[float]:
+    seconds = []
+    for b in range(args.batches):
+        indices = [(b * args.batch_size + i) % len(dataset) for i in range(args.batch_size)]
+        start_time = time.perf_counter()
+        sizes = dataset.__getitems__(indices)
+        seconds.append(time.perf_counter() - start_time)
+        if sizes != [args.object_size] * len(indices):
+            raise IOError("read sizes %s" % sizes)
+    return seconds
+
+
+def check_hedge(fixture: Fixture, args) -> dict:
+    # with stragglers, the slowest batches are faster with hedged requests, whose number stays within the budget
+    policy = HedgePolicy(min_samples=args.batch_size)
+    plain = OssMapDataset.from_objects(fixture.object_uris(), fixture.endpoint, transform=read_size, **fixture.kwargs)
+    hedged = OssMapDataset.from_objects(fixture.object_uris(), fixture.endpoint, transform=read_size,
+                                        hedge_policy=policy, **fixture.kwargs)
+    # the first batch starts the worker processes and fills the observed fetch times
+    batch_seconds(hedged, argparse.Namespace(**dict(vars(args), batches=2)))
+    plain_seconds = sorted(batch_seconds(plain, args))
+    hedged_seconds = sorted(batch_seconds(hedged, args))
+    policy.close()
+    stats = policy.stats()
+    budget = stats["requests"] * policy.budget_ratio + policy.budget_burst
+    quantile = int(0.9 * (args.batches - 1))
+    return {"passed": stats["hedged"] <= budget and hedged_seconds[quantile] < plain_seconds[quantile],
+            "budget": budget, "stats": stats,
+            "p90_batch_seconds": {"plain": plain_seconds[quantile], "hedged": hedged_seconds[quantile]},
+            "max_batch_seconds": {"plain": plain_seconds[-1], "hedged": hedged_seconds[-1]}}
+
+
+def median(values: List[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def check_adaptive_dataset(fixture: Fixture, args) -> dict:
+    # batches read with the adapted prefetch concurrency are faster than with the configured one, once adapted
+    plain = OssMapDataset.from_objects(fixture.object_uris(), fixture.endpoint, transform=read_size, **fixture.kwargs)
+    adaptive = OssMapDataset.from_objects(fixture.object_uris(), fixture.endpoint, transform=read_size,
+                                          adaptive_prefetch=True, **fixture.kwargs)
+    batches = argparse.Namespace(**dict(vars(args), batches=args.adaptive_batches, batch_size=args.num_objects))
+    plain_seconds = batch_seconds(plain, batches)
+    adaptive_seconds = batch_seconds(adaptive, batches)
+    # the last quarter of batches, once adapted
+    tail = max(1, args.adaptive_batches // 4)
+    seconds = {"plain": median(plain_seconds[-tail:]), "adaptive": median(adaptive_seconds[-tail:])}
+    return {"passed": seconds["adaptive"] < seconds["plain"] * 0.9, "median_batch_seconds": seconds,
+            "configured_concurrency": plain._get_client().prefetch_concurrency("datasetConfig"),
+            "stats": adaptive.prefetch_stats()}
+
+
+def check_adaptive_checkpoint(fixture: Fixture, args) -> dict:
+    # reads with the adapted prefetch concurrency are faster than with the configured one, once adapted
+    plain = OssCheckpoint(fixture.endpoint, **fixture.kwargs)
+    adaptive = OssCheckpoint(fixture.endpoint, config_path=fixture.kwargs["config_path"] + ".adaptive",
+                             **{k: v for k, v in fixture.kwargs.items() if k != "config_path"})
+
+    def read_plain(uri: str) -> bytes:
+        # streams of 'reader' use the configured concurrency until 'read' is called
+        with plain.reader(uri) as reader:
+            return reader.read()
+
+    seconds = {}
+    for name, read in (("plain", read_plain), ("adaptive", adaptive.read)):
+        read_seconds = []
+        for _ in range(args.checkpoint_reads):
+            start_time = time.perf_counter()
+            if len(read(fixture.checkpoint_uri)) != args.checkpoint_size:
+                raise IOError("read size of %s" % fixture.checkpoint_uri)
+            read_seconds.append(time.perf_counter() - start_time)
+        seconds[name] = median(read_seconds[-max(1, args.checkpoint_reads // 4):])
+    return {"passed": seconds["adaptive"] < seconds["plain"] * 0.9, "median_read_seconds": seconds,
+            "stats": adaptive.read_stats()}
+
+
+def main():
+    args = parser.parse_args()
+    server = MockOssServer(tempfile.mkdtemp(prefix="osstorchconnector-mock-oss-"), latency=args.latency,
+                           jitter=args.jitter, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                           host_suffix=args.host_suffix, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                           total_bandwidth=args.total_bandwidth)
+    server.check_bucket(args.bucket)
+    server.start(process=True)
+    cred_path, config_path = write_client_files(tempfile.mkdtemp(prefix="osstorchconnector-mock-client-"))
+    # a copy of the configuration, so that checks do not share the client of another
+    shutil.copyfile(config_path, config_path + ".adaptive")
+    fixture = Fixture(args, server.endpoint, cred_path, config_path)
+    failed = []
+    try:
+        fixture.upload()
+        for name in args.checks:
+            start_time = time.perf_counter()
+            try:
+                result = globals()["check_" + name](fixture, args)
+            except Exception as e:
+                result = {"passed": False, "error": repr(e)}
+            result["elapsed"] = time.perf_counter() - start_time
+            if not result["passed"]:
+                failed.append(name)
+            print("%-4s %-16s %s" % ("PASS" if result["passed"] else "FAIL", name, json.dumps(result)), flush=True)
+    finally:
+        server.stop()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,44 @@ from .oss_map_dataset import OssMapDataset
 from .oss_checkpoint import OssCheckpoint
 from .oss_safetensor import OssSafetensor
 from .oss_filesystem import OssFileSystem, OssStorageReader, OssStorageWriter
-from ._oss_client import OssClient
+from ._oss_client import OssClient, set_concurrency_budget
+from ._oss_async import AsyncOssClient, AsyncDataObject
 from ._oss_connector import new_data_object
 from ._oss_bucket_iterable import imagenet_manifest_parser
-from ._oss_tar_iterable import generate_tar_archive
+from ._oss_tar_iterable import generate_tar_archive, generate_tar_shards
+from ._oss_buffer import OwnedObject, as_memoryview, as_numpy, as_tensor
+from ._oss_batch import BatchBufferPool, PackedBatch, packed_collate
+from ._oss_worker import warmup_worker_init_fn
+from ._oss_hedge import HedgePolicy
+from ._oss_metrics import stats_to_prometheus
+from ._oss_profiler import Profiler, summarize_traces
 
 __all__ = [
     "OssIterableDataset",
     "OssMapDataset",
     "OssCheckpoint",
-    "OssSafetensor"
+    "OssSafetensor",
     "OssFileSystem",
     "OssStorageReader",
     "OssStorageWriter",
     "OssClient",
+    "set_concurrency_budget",
+    "AsyncOssClient",
+    "AsyncDataObject",
     "new_data_object",
     "imagenet_manifest_parser",
     "generate_tar_archive",
+    "generate_tar_shards",
+    "OwnedObject",
+    "as_memoryview",
+    "as_numpy",
+    "as_tensor",
+    "BatchBufferPool",
+    "PackedBatch",
+    "packed_collate",
+    "warmup_worker_init_fn",
+    "HedgePolicy",
+    "stats_to_prometheus",
+    "Profiler",
+    "summarize_traces",
 ]
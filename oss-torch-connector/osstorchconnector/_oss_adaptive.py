@@ -0,0 +1,185 @@
+from typing import Dict, Any, Iterator, Sequence
+import threading
+import logging
+import errno
+import time
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_adaptive.py
+    AIMD controller of the number of in-flight requests, driven by observed
+    throughput and latency.
+"""
+
+class AdaptiveController:
+    """Adapts the number of in-flight requests ('limit') to observed throughput and latency, AIMD-style.
+
+    Completed reads are recorded with 'record'. Every 'window' records (or 'limit' records if 'window' is 0)
+    form a window, whose throughput is measured over wall time since the previous window (or 'start'), or over
+    the sum of latencies if reads are 'sequential' (e.g. batches separated by idle time):
+    - a failed read, or a mean latency above 'latency_target' (if set), decreases the limit multiplicatively
+      (congestion or throttling),
+    - a throughput higher than the previous window by more than 'tolerance' increases the limit additively,
+    - a throughput lower than the previous window by more than 'tolerance' after an increase undoes it,
+      otherwise the limit is kept.
+    With 'levels', the limit only takes their values: an increase moves 'increase' levels up, and a decrease to
+    the highest level not above the decreased limit.
+
+    Args:
+      initial_limit(int): Limit before the first window, 0 to start from the limit given to 'start'.
+      min_limit(int): Lowest limit.
+      max_limit(int): Highest limit.
+      latency_target(float): Mean latency of a window above which the limit is decreased, 0 for none.
+      increase(int): Additive increase of the limit, or number of levels with 'levels'.
+      decrease(float): Multiplicative decrease of the limit.
+      tolerance(float): Relative change of throughput between windows taken as noise.
+      window(int): Number of records of a window, 0 for 'limit' records.
+      sequential(bool): Whether reads are sequential, their throughput is then measured over their latencies.
+      levels(Sequence[int]): Values the limit can take, e.g. because each value has a cost.
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 64,
+                 latency_target: float = 0, increase: int = 1, decrease: float = 0.5, tolerance: float = 0.05,
+                 window: int = 0, sequential: bool = False, levels: Sequence[int] = None):
+        if min_limit < 1 or min_limit > max_limit:
+            raise ValueError("invalid limit range [%d, %d]" % (min_limit, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.window = window
+        self.sequential = sequential
+        self.levels = None
+        if levels is not None:
+            self.levels = sorted(level for level in set(levels) if min_limit <= level <= max_limit)
+            if not self.levels:
+                raise ValueError("no level in limit range [%d, %d]" % (min_limit, max_limit))
+        self.limit = self._bound(initial_limit) if initial_limit > 0 else None
+        self._lock = threading.Lock()
+        self._window_start = None
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._window_count = 0
+        self._window_errors = 0
+        self._last_throughput = 0.0
+        self._previous_limit = None
+        self._stats = {"reads": 0, "errors": 0, "bytes": 0, "increases": 0, "decreases": 0,
+                       "throughput_mb_s": 0.0, "latency_seconds": 0.0}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _bound(self, limit: int) -> int:
+        # the highest level not above 'limit', or the lowest level
+        limit = min(max(limit, self.min_limit), self.max_limit)
+        if self.levels is None:
+            return limit
+        return max([level for level in self.levels if level <= limit] or self.levels[:1])
+
+    def start(self, limit: int = 0):
+        """Marks the start of a series of reads, the partial window of previous reads is dropped.
+        'limit' is the current value of the adapted setting, taken as the limit if none is set yet."""
+        with self._lock:
+            if self.limit is None:
+                self.limit = self._bound(limit if limit > 0 else self.min_limit)
+            self._reset_window(time.perf_counter())
+
+    def _reset_window(self, now: float):
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_latency = 0.0
+        self._window_count = 0
+        self._window_errors = 0
+
+    def record(self, nbytes: int, latency: float, error: bool = False):
+        now = time.perf_counter()
+        with self._lock:
+            if self.limit is None:
+                self.limit = self._bound(self.min_limit)
+            if self._window_start is None:
+                self._window_start = now - latency
+            self._window_bytes += nbytes
+            self._window_latency += latency
+            self._window_count += 1
+            self._window_errors += int(error)
+            self._stats["reads"] += 1
+            self._stats["errors"] += int(error)
+            self._stats["bytes"] += nbytes
+            if self._window_count >= (self.window or self.limit) or error:
+                self._update(now)
+
+    def _update(self, now: float):
+        elapsed = max(self._window_latency if self.sequential else now - self._window_start, 1e-9)
+        throughput = self._window_bytes / elapsed
+        latency = self._window_latency / self._window_count
+        self._stats["throughput_mb_s"] = throughput / 1024 / 1024
+        self._stats["latency_seconds"] = latency
+        congested = self._window_errors > 0 or (self.latency_target > 0 and latency > self.latency_target)
+        if congested:
+            self._decrease()
+        elif throughput > self._last_throughput * (1 + self.tolerance):
+            self._increase()
+        elif self._previous_limit is not None and throughput < self._last_throughput * (1 - self.tolerance):
+            self.limit = self._previous_limit
+            self._previous_limit = None
+        else:
+            self._previous_limit = None
+        log.debug("AdaptiveController window: %.1f MB/s, latency %.3f s, limit %d",
+                  throughput / 1024 / 1024, latency, self.limit)
+        self._last_throughput = throughput
+        self._reset_window(now)
+
+    def _increase(self):
+        previous_limit = self.limit
+        if self.levels is None:
+            self.limit = min(self.max_limit, self.limit + self.increase)
+        else:
+            index = self.levels.index(self.limit)
+            self.limit = self.levels[min(len(self.levels) - 1, index + self.increase)]
+        self._previous_limit = previous_limit if self.limit != previous_limit else None
+        self._stats["increases"] += 1
+
+    def _decrease(self):
+        self.limit = self._bound(int(self.limit * self.decrease))
+        self._previous_limit = None
+        self._stats["decreases"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the current limit, throughput and mean latency of the last window,
+        and counters of reads, errors, bytes, increases and decreases."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["limit"] = self.limit
+        return stats
+
+
+def record_stream(controller: AdaptiveController, objects: Iterator[Any]) -> Iterator[Any]:
+    """Yields the DataObjects of 'objects', and records the stream as one read of 'controller' once it is
+    exhausted or closed: the bytes received over the time from the first request to the end of the stream.
+    A stream with an object failed with an error other than ENOENT is recorded as a failed read."""
+    start_time = time.perf_counter()
+    nbytes = 0
+    error = False
+    try:
+        for object in objects:
+            eno = object.err()
+            if eno == 0:
+                nbytes += max(object.size, 0)
+            elif eno != errno.ENOENT:
+                error = True
+            yield object
+    except Exception:
+        error = True
+        raise
+    finally:
+        # a stream abandoned by its consumer (after a failed object) is recorded too
+        controller.record(nbytes, time.perf_counter() - start_time, error)
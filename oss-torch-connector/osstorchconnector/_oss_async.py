@@ -0,0 +1,191 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Dict, Any
+import asyncio
+import logging
+import copy
+import io
+
+from ._oss_client import OssClient, DataObject, request_slot
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_async.py
+    Asyncio API of OssClient: blocking native calls run on a bounded
+    executor shared by the calls of a client, not on a thread per call.
+"""
+
+# objects of a listing are pulled from the native stream by chunks, one executor call per chunk
+LIST_CHUNK_SIZE = 1000
+
+
+class AsyncDataObject:
+    """Awaitable wrapper of a DataObject, whose blocking calls run on the executor of its AsyncOssClient
+    (or on its stream thread for objects of streams).
+
+    The wrapped DataObject is 'object', e.g. for 'as_memoryview'. Objects of a stream are valid until
+    the next object is received, like the objects of OssClient streams.
+    """
+
+    def __init__(self, object: DataObject, client: "AsyncOssClient", executor: ThreadPoolExecutor = None):
+        self.object = object
+        self._client = client
+        self._executor = executor
+
+    @property
+    def key(self) -> str:
+        return self.object.key
+
+    @property
+    def size(self) -> int:
+        return self.object.size
+
+    @property
+    def label(self) -> str:
+        return self.object.label
+
+    def err(self) -> int:
+        return self.object.err()
+
+    def error_msg(self) -> str:
+        return self.object.error_msg()
+
+    def tell(self) -> int:
+        return self.object.tell()
+
+    async def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return await self._client._run(self.object.seek, offset, whence, executor=self._executor)
+
+    async def read(self, size: int = -1) -> bytes:
+        # the native read takes an unsigned count, reading to the end by default
+        if size is None or size < 0:
+            return await self._client._run(self.object.read, executor=self._executor)
+        return await self._client._run(self.object.read, size, executor=self._executor)
+
+    async def readinto(self, buffer) -> int:
+        return await self._client._run(self.object.readinto, buffer, executor=self._executor)
+
+    async def write(self, data) -> int:
+        return await self._client._run(self.object.write, data, executor=self._executor)
+
+    async def copy(self) -> "AsyncDataObject":
+        return AsyncDataObject(await self._client._run(self.object.copy, executor=self._executor), self._client,
+                               self._executor)
+
+    async def close(self):
+        await self._client._run(self.object.close, executor=self._executor)
+
+    async def __aenter__(self) -> "AsyncDataObject":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncOssClient:
+    """Asyncio API of OssClient.
+
+    Requests and reads are blocking calls of the native client, they run on one executor of 'max_workers'
+    threads shared by all the calls of this client (and within the budget of 'set_concurrency_budget'),
+    so that many concurrent coroutines do not need a thread each, and the event loop does not wait for them. Native
+    calls which hold the GIL still delay the event loop while they run.
+    Streams are received by the native prefetch workers, coroutines only wait for the next object. Native streams
+    can only be iterated on the thread which created their native client, so streams, and the reads of their objects,
+    run on a thread of their own with a copy of the client built on that thread.
+
+    Args:
+      endpoint(str): Endpoint of the OSS bucket where the objects are stored.
+      cred_path(str): Credential info of the OSS bucket where the objects are stored.
+      config_path(str): Configuration file path of the OSS connector.
+      cred_provider: OSS credential provider.
+      region(str): OSS region.
+      max_workers(int): Number of threads running the blocking calls.
+      client(OssClient): Client to use instead of building one from the arguments above.
+    """
+
+    def __init__(self, endpoint: str = "", cred_path: str = "", config_path: str = "", cred_provider: Any = None,
+                 region: str = "", max_workers: int = 16, client: OssClient = None):
+        if client is None:
+            client = OssClient(endpoint, cred_path, config_path, cred_provider=cred_provider, region=region)
+        self.client = client
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="oss-async")
+        # the copy builds its native client on first use, on the stream thread, and shares the metrics
+        self._stream_client = copy.copy(client)
+        self._stream_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="oss-async-stream")
+
+    async def _run(self, fn: Callable, *args, executor: ThreadPoolExecutor = None) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(executor or self._executor, partial(fn, *args))
+
+    async def _request(self, fn: Callable, *args) -> Any:
+        def call():
+            with request_slot():
+                return fn(*args)
+        return await self._run(call)
+
+    async def get_object(self, bucket: str, key: str, size: int = 0, type: int = 0, label: str = "") -> AsyncDataObject:
+        return AsyncDataObject(await self._request(self.client.get_object, bucket, key, size, type, label), self)
+
+    async def put_object(self, bucket: str, key: str) -> AsyncDataObject:
+        return AsyncDataObject(await self._request(self.client.put_object, bucket, key), self)
+
+    async def head_object(self, bucket: str, key: str) -> DataObject:
+        return await self._request(self.client.head_object, bucket, key)
+
+    async def rename_object(self, bucket: str, key: str, new_bucket: str, new_key: str) -> DataObject:
+        return await self._request(self.client.rename_object, bucket, key, new_bucket, new_key)
+
+    async def remove_object(self, bucket: str, key: str):
+        return await self._request(self.client.remove_object, bucket, key)
+
+    async def _iter_chunks(self, open_stream: Callable[[], Iterable[DataObject]], chunk_size: int) -> AsyncIterator[DataObject]:
+        executor = self._stream_executor
+        stream = await self._run(lambda: iter(open_stream()), executor=executor)
+
+        def next_chunk(it: Iterator[DataObject]) -> List[DataObject]:
+            return list(islice(it, chunk_size))
+
+        while True:
+            chunk = await self._run(next_chunk, stream, executor=executor)
+            if not chunk:
+                return
+            for object in chunk:
+                yield object
+
+    async def _iter_objects(self, open_stream: Callable[[], Iterable[DataObject]]) -> AsyncIterator[AsyncDataObject]:
+        # objects of data streams hold a prefetch buffer each until released, so they are received one at a time
+        async for object in self._iter_chunks(open_stream, 1):
+            yield AsyncDataObject(object, self, self._stream_executor)
+
+    def list_objects(self, bucket: str, prefix: str = "") -> AsyncIterator[DataObject]:
+        """Returns an async iterator of the objects (key and size) of 'bucket' under 'prefix'."""
+        return self._iter_chunks(partial(self._stream_client.list_objects, bucket, prefix), LIST_CHUNK_SIZE)
+
+    def list_objects_from_uris(self, object_uris: Iterable, prefetch: bool = False,
+                               include_errors: bool = False) -> AsyncIterator[AsyncDataObject]:
+        """Returns an async iterator of the opened objects of 'object_uris', prefetched by the native workers if 'prefetch'."""
+        return self._iter_objects(partial(self._stream_client.list_objects_from_uris, object_uris, prefetch,
+                                          include_errors))
+
+    def list_objects_from_tar(self, bucket: str, tar_key: str, index_key: str, chunks: Iterable = [], sizes: Iterable = [],
+                              prefetch: bool = False, include_errors: bool = False) -> AsyncIterator[AsyncDataObject]:
+        return self._iter_objects(partial(self._stream_client.list_objects_from_tar, bucket, tar_key, index_key, chunks, sizes,
+                                          prefetch, include_errors))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns the metrics of the underlying client, see 'OssClient.get_stats'."""
+        return self.client.get_stats()
+
+    async def close(self):
+        """Waits for the running calls and stops the executors."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(self._executor.shutdown, wait=True))
+        await loop.run_in_executor(None, partial(self._stream_executor.shutdown, wait=True))
+
+    async def __aenter__(self) -> "AsyncOssClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,256 @@
+from typing import List, Iterable, Tuple, Any
+import ctypes
+import threading
+import weakref
+import logging
+import uuid
+import os
+import torch
+import torch.utils.data
+
+from ._oss_connector import DataObject
+from ._oss_buffer import _readinto_full
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_batch.py
+    Collate-aware batches: sample bytes are read directly into slices of
+    a reusable (optionally pinned) batch buffer.
+"""
+
+MIN_BUFFER_SIZE = 1 << 20
+
+# pools of this process by id, batches received from DataLoader workers are pinned into buffers of their pool
+_pools = weakref.WeakValueDictionary()
+
+def _round_up_size(nbytes: int) -> int:
+    size = MIN_BUFFER_SIZE
+    while size < nbytes:
+        size <<= 1
+    return size
+
+
+class PackedBatch:
+    """A batch of samples stored back to back in one uint8 tensor.
+
+    Sample i is 'data[starts[i]:starts[i] + sizes[i]]', as returned by 'batch[i]'. Missing objects are empty samples.
+    When 'data' comes from the buffers of a BatchBufferPool, it is recycled once the batch is garbage collected
+    (in the main process for batches of DataLoader workers), so clone the tensors which are kept longer than the batch.
+    """
+
+    def __init__(self, data: torch.Tensor, starts: List[int], sizes: List[int], keys: List[str], labels: List[str]):
+        self.data = data
+        self.starts = starts
+        self.sizes = sizes
+        self.keys = keys
+        self.labels = labels
+        self._release = None
+        # shared flag of a buffer of a DataLoader worker, cleared once the batch is released by the main process
+        self._in_use = None
+        self._pool_id = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_release"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._in_use is not None:
+            self._release = weakref.finalize(self, self._in_use.fill_, 0)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> torch.Tensor:
+        return self.data[self.starts[i]:self.starts[i] + self.sizes[i]]
+
+    def pin_memory(self, device: Any = None) -> "PackedBatch":
+        # called by the pin memory thread of DataLoader, batches packed into pinned buffers are not copied again
+        if self.data.is_pinned():
+            return self
+        pool = _pools.get(self._pool_id)
+        if pool is not None and pool.pin_memory and device is None:
+            # a batch of a DataLoader worker, copied into a pinned buffer of the pool of this process
+            buffer = pool.acquire(self.data.numel())
+            buffer[:self.data.numel()].copy_(self.data)
+            batch = PackedBatch(buffer[:self.data.numel()], self.starts, self.sizes, self.keys, self.labels)
+            batch._release = weakref.finalize(batch, pool.release, buffer)
+            return batch
+        data = self.data.pin_memory() if device is None else self.data.pin_memory(device)
+        return PackedBatch(data, self.starts, self.sizes, self.keys, self.labels)
+
+    def select(self, positions: List[int]) -> "PackedBatch":
+        """Returns a batch of the samples at 'positions', sharing the buffer (which is then released with it)."""
+        batch = PackedBatch(self.data, [self.starts[i] for i in positions], [self.sizes[i] for i in positions],
+                            [self.keys[i] for i in positions], [self.labels[i] for i in positions])
+        batch._in_use, batch._pool_id = self._in_use, self._pool_id
+        if self._release is not None and self._release.alive:
+            _, release, args, _ = self._release.detach()
+            batch._release = weakref.finalize(batch, release, *args)
+        return batch
+
+
+def packed_collate(batch: Any) -> Any:
+    """'collate_fn' for DataLoader over OssMapDataset with 'batch_buffer_pool', batches are already collated."""
+    return batch
+
+
+class BatchBufferPool:
+    """A pool of batch buffers reused across batches of OssMapDataset and OssIterableDataset.
+
+    Buffers are sized by the bytes of the previous batches (rounded up to a power of two), and
+    kept for reuse up to 'num_buffers'. In DataLoader worker processes, batches are sent to the
+    main process through shared memory, so each worker keeps up to 'num_buffers' buffers in shared
+    memory, each with a shared flag cleared once its batch is garbage collected in the main process,
+    after which the worker reuses it. With 'pin_memory', pin_memory of DataLoader copies batches of
+    workers into pinned buffers of the pool of the main process, which are reused the same way.
+
+    Args:
+      batch_size(int): Number of samples per batch packed by OssIterableDataset, whose DataLoader must use 'batch_size=None'.
+      pin_memory(bool): Allocate page-locked buffers, so that copies to GPU need no staging copy.
+      num_buffers(int): Maximum number of free buffers kept for reuse.
+    """
+
+    def __init__(self, batch_size: int = 0, pin_memory: bool = False, num_buffers: int = 4):
+        if pin_memory and not torch.cuda.is_available():
+            log.warning("BatchBufferPool pin_memory is set but CUDA is not available, buffers are not pinned")
+            pin_memory = False
+        self.batch_size = batch_size
+        self.pin_memory = pin_memory
+        self.num_buffers = num_buffers
+        self._free = []
+        self._lock = threading.Lock()
+        self._batch_bytes = 0
+        self._id = uuid.uuid4().hex
+        _pools[self._id] = self
+        # shared buffers of this DataLoader worker: data_ptr -> (buffer, in use flag)
+        self._shared = {}
+        self._shared_pid = os.getpid()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_free"] = []
+        state["_lock"] = None
+        state["_shared"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        _pools.setdefault(self._id, self)
+
+    @property
+    def _in_worker(self) -> bool:
+        return torch.utils.data.get_worker_info() is not None
+
+    def acquire(self, nbytes: int = 0) -> torch.Tensor:
+        """Returns a uint8 buffer of at least 'nbytes', or of the size of the previous batches if 0."""
+        nbytes = max(nbytes, self._batch_bytes)
+        if self._in_worker:
+            return self._acquire_shared(nbytes)
+        with self._lock:
+            fits = [buffer for buffer in self._free if buffer.numel() >= nbytes]
+            if fits:
+                buffer = min(fits, key=lambda buffer: buffer.numel())
+                self._free.remove(buffer)
+                return buffer
+        return torch.empty(_round_up_size(nbytes), dtype=torch.uint8, pin_memory=self.pin_memory)
+
+    def _acquire_shared(self, nbytes: int) -> torch.Tensor:
+        with self._lock:
+            if self._shared_pid != os.getpid():
+                # buffers of the process this worker was forked from
+                self._shared = {}
+                self._shared_pid = os.getpid()
+            free = [(buffer, in_use) for buffer, in_use in self._shared.values() if in_use.item() == 0]
+            fits = [(buffer, in_use) for buffer, in_use in free if buffer.numel() >= nbytes]
+            if fits:
+                buffer, in_use = min(fits, key=lambda item: item[0].numel())
+                in_use.fill_(1)
+                return buffer
+            if free and len(self._shared) >= self.num_buffers:
+                # batches grew, replace the smallest free buffer
+                smallest, _ = min(free, key=lambda item: item[0].numel())
+                del self._shared[smallest.data_ptr()]
+            # allocate in shared memory directly like default_collate, to avoid a copy when sent to the main process
+            elem = torch.empty(0, dtype=torch.uint8)
+            buffer = elem.new(elem._typed_storage()._new_shared(_round_up_size(nbytes)))
+            if len(self._shared) < self.num_buffers:
+                self._shared[buffer.data_ptr()] = (buffer, torch.ones(1, dtype=torch.uint8).share_memory_())
+            return buffer
+
+    def _in_use_flag(self, buffer: torch.Tensor) -> torch.Tensor:
+        # the shared flag of a buffer of this worker, None if the buffer is not kept for reuse
+        shared = self._shared.get(buffer.data_ptr())
+        return shared[1] if shared is not None and shared[0] is buffer else None
+
+    def release(self, buffer: torch.Tensor):
+        if self._in_worker:
+            in_use = self._in_use_flag(buffer)
+            if in_use is not None:
+                in_use.fill_(0)
+            return
+        with self._lock:
+            if len(self._free) < self.num_buffers:
+                self._free.append(buffer)
+
+    def pack(self, objects: Iterable[Tuple[DataObject, bool]]) -> PackedBatch:
+        """Reads (object, ok) pairs back to back into one buffer, objects which are not ok become empty samples."""
+        writer = _BatchWriter(self)
+        for object, ok in objects:
+            writer.write(object, ok)
+        return writer.finish()
+
+
+class _BatchWriter:
+    def __init__(self, pool: BatchBufferPool):
+        self._pool = pool
+        self._buffer = pool.acquire()
+        self._offset = 0
+        self.starts = []
+        self.sizes = []
+        self.keys = []
+        self.labels = []
+
+    def _reserve(self, nbytes: int):
+        needed = self._offset + nbytes
+        if needed <= self._buffer.numel():
+            return
+        # the estimate was too small, move what is received to a larger buffer
+        buffer = self._pool.acquire(needed * 2)
+        if self._offset > 0:
+            ctypes.memmove(buffer.data_ptr(), self._buffer.data_ptr(), self._offset)
+        self._pool.release(self._buffer)
+        self._buffer = buffer
+
+    def write(self, object: DataObject, ok: bool = True):
+        size = 0
+        if ok:
+            size = object.size - object.tell() if object.size > 0 else -1
+            if size < 0:
+                # size is unknown, one more copy
+                data = object.read()
+                size = len(data)
+                self._reserve(size)
+                ctypes.memmove(self._buffer.data_ptr() + self._offset, data, size)
+            elif size > 0:
+                self._reserve(size)
+                _readinto_full(object, (ctypes.c_char * size).from_address(self._buffer.data_ptr() + self._offset), size)
+        self.starts.append(self._offset)
+        self.sizes.append(size)
+        self.keys.append(object.key)
+        self.labels.append(object.label)
+        self._offset += size
+
+    def finish(self) -> PackedBatch:
+        self._pool._batch_bytes = self._offset
+        batch = PackedBatch(self._buffer[:self._offset], self.starts, self.sizes, self.keys, self.labels)
+        batch._pool_id = self._pool._id
+        if self._pool._in_worker:
+            # released by the main process, see 'PackedBatch.__setstate__'
+            batch._in_use = self._pool._in_use_flag(self._buffer)
+        else:
+            batch._release = weakref.finalize(batch, self._pool.release, self._buffer)
+        return batch
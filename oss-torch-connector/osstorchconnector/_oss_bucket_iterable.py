@@ -1,16 +1,18 @@
 from typing import Iterator, Iterable, Union, Tuple, Callable
 from ._oss_client import OssClient, DataObject
 from ._oss_connector import new_data_object
+from ._oss_buffer import own_object
 import logging
 import io
 
 log = logging.getLogger(__name__)
 
 def identity(obj: DataObject) -> DataObject:
-    if obj is not None:
-        return obj.copy()
-    else:
-        return None
+    # objects of prefetch streams hold a prefetch buffer until they are released, and the stream stops once all
+    # its buffers are held, so objects returned as samples are copied once into an OwnedObject, which is not a
+    # sequence either (collating it fails as before); objects already owned are returned as they are, transforms
+    # reading the data (e.g. as_memoryview) make the only copy instead
+    return own_object(obj)
 
 def parse_oss_uri(uri: str) -> Tuple[str, str]:
     if not uri or not (uri.startswith("oss://") or uri.startswith("/")):
@@ -0,0 +1,169 @@
+from typing import Any
+import ctypes
+import logging
+import io
+
+from ._oss_connector import DataObject
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_buffer.py
+    Helpers reading DataObjects into a single buffer, so that transforms
+    and decoders can consume samples without intermediate bytes objects.
+"""
+
+def _remaining_size(obj: Any) -> int:
+    # size of stream objects is known, size of some opened objects is not (<= 0) and is found by seeking to the end
+    if obj.size > 0:
+        return max(obj.size - obj.tell(), 0)
+    if not obj.seekable():
+        return -1
+    position = obj.tell()
+    end = obj.seek(0, io.SEEK_END)
+    obj.seek(position, io.SEEK_SET)
+    return max(end - position, 0)
+
+
+def _readinto_full(obj: DataObject, buffer: Any, size: int):
+    view = memoryview(buffer).cast("B")
+    offset = 0
+    while offset < size:
+        bytes_read = obj.readinto(view[offset:])
+        if bytes_read <= 0:
+            break
+        offset += bytes_read
+    if offset != size:
+        raise IOError("failed to read %s, expected %d bytes, got %d" % (obj.key, size, offset))
+
+
+class OwnedObject(io.BytesIO):
+    """The data of a DataObject copied into memory owned by this process, with the attributes and the read methods
+    of DataObjects.
+
+    Like DataObjects, it is not a sequence of bytes, so collating samples holding objects fails instead of
+    splitting their data. 'getbuffer()' exposes the data without another copy: 'np.frombuffer(obj.getbuffer(),
+    dtype)' or 'torch.frombuffer(obj.getbuffer(), dtype=...)'. 'read' returns a copy, as it does on DataObjects.
+    """
+
+    def __init__(self, key: str, size: int, label: str = "", err: int = 0, error_msg: str = ""):
+        super().__init__()
+        if err == 0 and size > 0:
+            # one zero-filled allocation, the data is read into it in place
+            self.seek(size - 1)
+            self.write(b"\0")
+            self.seek(0)
+        self.key = key
+        self.size = max(size, 0) if err == 0 else size
+        self.label = label
+        self._err = err
+        self._error_msg = error_msg
+
+    @classmethod
+    def read_from(cls, obj: DataObject) -> "OwnedObject":
+        """Copies the remaining data of 'obj' into a new object, with one 'readinto'."""
+        if obj.err() != 0:
+            return cls(obj.key, obj.size, obj.label, obj.err(), obj.error_msg())
+        size = _remaining_size(obj)
+        if size < 0:
+            data = obj.read()
+            owned = cls(obj.key, 0, obj.label)
+            owned.write(data)
+            owned.seek(0)
+            owned.size = len(data)
+            return owned
+        owned = cls(obj.key, size, obj.label)
+        if size > 0:
+            with owned.getbuffer() as view:
+                _readinto_full(obj, view, size)
+        return owned
+
+    def err(self) -> int:
+        return self._err
+
+    def error_msg(self) -> str:
+        return self._error_msg
+
+    def close(self):
+        # buffers and arrays returned for the object may still share its data
+        pass
+
+    def copy(self) -> "OwnedObject":
+        # the data is owned by this process, a copy of an owned object is itself
+        return self
+
+
+def own_object(obj: Any) -> Any:
+    """Returns an object owned by this process for 'obj': DataObjects, which may hold a prefetch buffer of their
+    stream, are copied into an OwnedObject, other objects (None, owned objects, samples) are returned as they are."""
+    if isinstance(obj, DataObject):
+        return OwnedObject.read_from(obj)
+    return obj
+
+
+def _owned_view(obj: OwnedObject) -> memoryview:
+    # the remaining data of an owned object, without a copy
+    view = obj.getbuffer()
+    view = view[min(obj.tell(), len(view)):]
+    obj.seek(0, io.SEEK_END)
+    return view
+
+
+def as_memoryview(obj: DataObject) -> memoryview:
+    """Reads the remaining data of the object into one buffer and returns a read-only memoryview over it.
+
+    The data is copied once from the prefetched data to the buffer, unlike 'io.BytesIO(obj.read())'
+    which copies it twice. This copy can not be avoided: objects of prefetch streams hold a prefetch buffer
+    until they are released, so samples never refer to the prefetched data itself. The memoryview can be
+    passed to 'Image.open(io.BytesIO(...))', 'np.frombuffer', 'torch.frombuffer' or other decoders accepting
+    the buffer protocol. Used as 'transform', it replaces the copy of the object made by the default one.
+    Objects already copied (OwnedObject, e.g. in a transform pipeline) are viewed without a copy.
+    """
+    if obj is None:
+        return None
+    if isinstance(obj, OwnedObject):
+        return _owned_view(obj).toreadonly()
+    size = _remaining_size(obj)
+    if size < 0:
+        return memoryview(obj.read())
+    buffer = bytearray(size)
+    _readinto_full(obj, buffer, size)
+    return memoryview(buffer).toreadonly()
+
+
+def as_numpy(obj: DataObject) -> Any:
+    """Reads the remaining data of the object directly into a new uint8 numpy array.
+    The array of an OwnedObject shares its data."""
+    import numpy as np
+    if obj is None:
+        return None
+    if isinstance(obj, OwnedObject):
+        return np.frombuffer(_owned_view(obj), dtype=np.uint8)
+    size = _remaining_size(obj)
+    if size < 0:
+        return np.frombuffer(_owned_view(OwnedObject.read_from(obj)), dtype=np.uint8)
+    array = np.empty(size, dtype=np.uint8)
+    if size > 0:
+        _readinto_full(obj, array, size)
+    return array
+
+
+def as_tensor(obj: DataObject) -> Any:
+    """Reads the remaining data of the object directly into the storage of a new uint8 tensor,
+    e.g. for 'torchvision.io.decode_image'. The tensor of an OwnedObject shares its data."""
+    import torch
+    if obj is None:
+        return None
+    if not isinstance(obj, OwnedObject):
+        size = _remaining_size(obj)
+        if size >= 0:
+            tensor = torch.empty(size, dtype=torch.uint8)
+            if size > 0:
+                buffer = (ctypes.c_char * size).from_address(tensor.data_ptr())
+                _readinto_full(obj, buffer, size)
+            return tensor
+        obj = OwnedObject.read_from(obj)
+    view = _owned_view(obj)
+    if len(view) == 0:
+        return torch.empty(0, dtype=torch.uint8)
+    return torch.frombuffer(view, dtype=torch.uint8)
@@ -1,7 +1,16 @@
 import os
-from typing import Iterator, Iterable, Any
+from typing import Iterator, Iterable, Any, Dict, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
 import logging
 import threading
+import json
+import time
+import weakref
+
+from ._oss_metrics import Metrics
 
 log = logging.getLogger(__name__)
 
@@ -13,6 +22,15 @@ from ._oss_connector import (
 
 O_MULTI_PART = 0x40000000   # oss multi-part upload
 
+# sections of the configuration file with a 'prefetchConcurrency'
+DATASET_CONFIG = "datasetConfig"
+CHECKPOINT_CONFIG = "checkpointConfig"
+DEFAULT_PREFETCH_CONCURRENCY = 24
+# values of an adapted prefetch concurrency, each is read by a native client built for it
+PREFETCH_CONCURRENCY_LEVELS = (1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96, 128, 192, 256)
+# native clients of adapted prefetch concurrencies kept per process when no stream uses them
+MAX_PREFETCH_CLIENTS = 2
+
 """
 _oss_client.py
     Internal client wrapper class on top of OSS client interface
@@ -37,64 +55,325 @@ class OssClient:
         self._uuid = uuid
         self._real_client = None
         self._client_pid = None
+        # native clients by tar archive (None for the other requests)
+        self._real_clients = {}
+        # (section, concurrency, tar archive) -> [native client, number of streams using it], least recently used first
+        self._prefetch_clients = OrderedDict()
         self._id = id
         self._total = total
         self._cred_provider = cred_provider
         self._region = region
+        self._lock = threading.Lock()
+        self._metrics = Metrics()
+
+    def __getstate__(self):
+        # native client and lock are rebuilt in the new process
+        state = self.__dict__.copy()
+        state["_real_client"] = None
+        state["_client_pid"] = None
+        state["_real_clients"] = {}
+        state["_prefetch_clients"] = OrderedDict()
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
-    _lock = threading.Lock()
     @property
     def _client(self) -> DataSet:
-        with OssClient._lock:
-            if self._client_pid is None or self._client_pid != os.getpid() :
-                # does OSS client survive forking ? NO
-                if self._client_pid != os.getpid() and self._real_client is not None:
-                    log.info("OssClient delete dataset")
-                    # del self._real_client
-                self._client_pid = os.getpid()
-                self._real_client = self._client_builder()
+        return self._native_client()
+
+    def _check_pid(self):
+        # called with the lock held
+        if self._client_pid is None or self._client_pid != os.getpid() :
+            # does OSS client survive forking ? NO
+            if self._client_pid != os.getpid() and self._real_client is not None:
+                log.info("OssClient delete dataset")
+                # del self._real_client
+            self._client_pid = os.getpid()
+            self._real_clients = {}
+            self._prefetch_clients = OrderedDict()
+
+    def _native_client(self, tar: Tuple[str, str] = None) -> DataSet:
+        with self._lock:
+            self._check_pid()
+            client = self._real_clients.get(tar)
+            if client is None:
+                client = self._client_builder()
+                self._real_clients[tar] = client
+            if tar is None:
+                self._real_client = client
+
+        return client
+
+    def _acquire_prefetch_client(self, section: str, concurrency: int, tar: Tuple[str, str] = None) -> Tuple[Any, DataSet]:
+        # the native client of 'concurrency' for a stream, which must be released by '_release_prefetch_client'
+        key = (section, prefetch_concurrency_level(concurrency), tar)
+        with self._lock:
+            self._check_pid()
+            entry = self._prefetch_clients.get(key)
+            if entry is None:
+                entry = [self._client_builder({section: key[1]}), 0]
+                self._prefetch_clients[key] = entry
+            self._prefetch_clients.move_to_end(key)
+            entry[1] += 1
+            self._evict_prefetch_clients()
+            return key, entry[0]
+
+    def _release_prefetch_client(self, key: Any, client: DataSet):
+        with self._lock:
+            entry = self._prefetch_clients.get(key)
+            if entry is not None and entry[0] is client:
+                entry[1] -= 1
+                self._evict_prefetch_clients()
+
+    def _evict_prefetch_clients(self):
+        # called with the lock held, native clients in use by streams are kept, the others are freed once dropped
+        unused = [key for key, (_, users) in self._prefetch_clients.items() if users <= 0]
+        for key in unused[:max(len(self._prefetch_clients) - MAX_PREFETCH_CLIENTS, 0)]:
+            del self._prefetch_clients[key]
+
+    def _prefetch_stream(self, op: str, section: str, concurrency: int, tar: Tuple[str, str], open_stream) -> Iterator[DataObject]:
+        if concurrency <= 0:
+            client = self._tar_client(*tar) if tar is not None else self._client
+            return self._metrics.timed_stream(op, open_stream(client))
+        key, client = self._acquire_prefetch_client(section, concurrency, tar)
+        try:
+            stream = self._metrics.timed_stream(op, open_stream(client))
+        except BaseException:
+            self._release_prefetch_client(key, client)
+            raise
+        # the native client is kept until the stream is dropped
+        weakref.finalize(stream, self._release_prefetch_client, key, client)
+        return stream
 
-        return self._real_client
+    def _tar_client(self, bucket: str, tar_key: str) -> DataSet:
+        # a native client opens the first tar archive it reads and keeps reading it, whatever the tar key of later
+        # requests, so each tar archive (e.g. each shard of a manifest) is read by its own native client
+        return self._native_client((bucket, tar_key))
 
-    def _client_builder(self) -> DataSet:
-        log.info("OssClient new_oss_dataset, id %d, total %d", self._id, self._total)
-        return new_oss_dataset(self._endpoint, self._cred_path, self._cred_provider, self._config_path, str(self._uuid), self._id, self._total, self._region)
+    def _client_builder(self, prefetch_concurrency: Dict[str, int] = None) -> DataSet:
+        log.info("OssClient new_oss_dataset, id %d, total %d, prefetch concurrency %s",
+                 self._id, self._total, prefetch_concurrency or "configured")
+        if not prefetch_concurrency:
+            return new_oss_dataset(self._endpoint, self._cred_path, self._cred_provider, self._config_path, str(self._uuid), self._id, self._total, self._region)
+        # the configuration is read when the native client is built, from a copy with the overrides
+        config = self._load_config()
+        for section, concurrency in prefetch_concurrency.items():
+            config[section] = dict(config.get(section, {}), prefetchConcurrency=concurrency)
+        fd, config_path = tempfile.mkstemp(prefix="oss-connector-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(config, f)
+            return new_oss_dataset(self._endpoint, self._cred_path, self._cred_provider, config_path, str(self._uuid), self._id, self._total, self._region)
+        finally:
+            os.remove(config_path)
+
+    def _load_config(self) -> Dict[str, Any]:
+        if not self._config_path:
+            return {}
+        with open(self._config_path) as f:
+            return json.load(f)
+
+    def prefetch_concurrency(self, section: str) -> int:
+        """Returns the prefetch concurrency of 'section' (DATASET_CONFIG or CHECKPOINT_CONFIG) of the configuration."""
+        return self._load_config().get(section, {}).get("prefetchConcurrency", DEFAULT_PREFETCH_CONCURRENCY)
+
+    def warmup(self, n_connections: int = 4, bucket: str = "", key: str = "") -> Dict[str, float]:
+        """Builds the native client of this process (resolving credentials) and establishes connections
+        with 'n_connections' concurrent HEAD requests of the given object, so that the first reads do not pay for them.
+
+        Returns:
+            Dict: Seconds to build the client, first-byte latency of the first request (cold) and of a request after warmup.
+        """
+        start_time = time.perf_counter()
+        self._client
+        report = {"client_seconds": time.perf_counter() - start_time, "connections": n_connections}
+        if not key:
+            log.info("OssClient warmup, client: %.3f s", report["client_seconds"])
+            return report
+
+        def first_byte_latency(_=None) -> float:
+            with request_slot():
+                start_time = time.perf_counter()
+                self.head_object(bucket, key)
+                return time.perf_counter() - start_time
+
+        report["cold_first_byte_seconds"] = first_byte_latency()
+        if n_connections > 1:
+            with ThreadPoolExecutor(max_workers=n_connections) as executor:
+                list(executor.map(first_byte_latency, range(n_connections)))
+        report["warm_first_byte_seconds"] = first_byte_latency()
+        log.info("OssClient warmup, client: %.3f s, connections: %d, first byte latency: %.3f s (cold), %.3f s (warm)",
+                 report["client_seconds"], n_connections, report["cold_first_byte_seconds"], report["warm_first_byte_seconds"])
+        return report
 
     def get_object(self, bucket: str, key: str, size: int = 0, type: int = 0, label: str = "") -> DataObject:
-        return self._client.open_ro(bucket, key, size, type, label)
+        client = self._tar_client(bucket, key) if type == 3 else self._client
+        with self._metrics.timed("get"):
+            obj = client.open_ro(bucket, key, size, type, label)
+        self._metrics.inc("bytes_opened", max(obj.size, 0))
+        return obj
+
+    @contextmanager
+    def open_prefetched(self, bucket: str, key: str, size: int, prefetch_concurrency: int = 0) -> Iterator[DataObject]:
+        """Opens the object with a prefetching stream (type 1) for the duration of the context, with
+        'prefetch_concurrency' in place of checkpointConfig.prefetchConcurrency if set, see 'list_objects_from_uris'."""
+        if prefetch_concurrency <= 0:
+            with self.get_object(bucket, key, size, type=1) as obj:
+                yield obj
+            return
+        pool_key, client = self._acquire_prefetch_client(CHECKPOINT_CONFIG, prefetch_concurrency)
+        try:
+            with self._metrics.timed("get"):
+                obj = client.open_ro(bucket, key, size, 1, "")
+            self._metrics.inc("bytes_opened", max(obj.size, 0))
+            with obj:
+                yield obj
+        finally:
+            self._release_prefetch_client(pool_key, client)
 
     def put_object(self, bucket: str, key: str) -> DataObject:
-        return self._client.open_wo(bucket, key)
+        with self._metrics.timed("put"):
+            return self._client.open_wo(bucket, key)
 
     def head_object(self, bucket: str, key: str) -> DataObject:
-        return self._client.stat(bucket, key)
+        with self._metrics.timed("stat"):
+            return self._client.stat(bucket, key)
 
     def rename_object(self, bucket: str, key: str, new_bucket: str, new_key: str) -> DataObject:
-        return self._client.rename(bucket, key, new_bucket, new_key)
+        with self._metrics.timed("rename"):
+            return self._client.rename(bucket, key, new_bucket, new_key)
 
     def remove_object(self, bucket: str, key: str):
-        return self._client.remove(bucket, key)
+        with self._metrics.timed("remove"):
+            return self._client.remove(bucket, key)
 
     def list_objects(self, bucket: str, prefix: str = "") -> Iterator[DataObject]:
         log.debug("OssClient list_objects")
-        return self._client.list(bucket, prefix)
+        return self._metrics.timed_stream("list", self._client.list(bucket, prefix))
 
     def list_objects_with_preload(self, bucket: str, prefix: str = "", include_errors: bool = False) -> Iterator[DataObject]:
         log.debug("OssClient list_objects_with_preload")
-        return self._client.list_with_preload(bucket, prefix, include_errors)
+        return self._metrics.timed_stream("list", self._client.list_with_preload(bucket, prefix, include_errors))
+
+    def list_objects_from_uris(self, object_uris: Iterable, prefetch: bool = False, include_errors: bool = False,
+                               prefetch_concurrency: int = 0) -> Iterator[DataObject]:
+        """Streams the objects of 'object_uris'. With 'prefetch_concurrency', the stream is read by a native client
+        with this value (rounded down to PREFETCH_CONCURRENCY_LEVELS) in place of datasetConfig.prefetchConcurrency.
 
-    def list_objects_from_uris(self, object_uris: Iterable, prefetch: bool = False, include_errors: bool = False) -> Iterator[DataObject]:
+        The native library reads its configuration once, so each value has its own native client, used by the streams
+        of this value only: other requests keep the native client of the configuration. A native client is kept while
+        its streams are referenced, and at most MAX_PREFETCH_CLIENTS unused ones are kept per process.
+        """
         log.debug("OssClient list_objects_from_uris")
-        return self._client.list_from_uris(object_uris, prefetch, include_errors)
+        return self._prefetch_stream("get_stream", DATASET_CONFIG, prefetch_concurrency, None,
+                                     lambda client: client.list_from_uris(object_uris, prefetch, include_errors))
 
     def list_objects_from_uris_with_preload(self, object_uris: Iterable, include_errors: bool = False) -> Iterator[DataObject]:
         log.debug("OssClient list_objects_from_uris_with_preload")
-        return self._client.list_from_uris_with_preload(object_uris, include_errors)
+        return self._metrics.timed_stream("get_stream", self._client.list_from_uris_with_preload(object_uris, include_errors))
 
     def list_objects_from_tar(self, bucket: str, tar_key: str, index_key: str, chunks: Iterable = [], sizes: Iterable = [],
-                              prefetch: bool = False, include_errors: bool = False) -> Iterator[DataObject]:
+                              prefetch: bool = False, include_errors: bool = False, prefetch_concurrency: int = 0) -> Iterator[DataObject]:
+        """Streams the members of the tar archive, see 'list_objects_from_uris' for 'prefetch_concurrency'."""
         log.debug("OssClient list_objects_from_tar")
-        return self._client.list_from_tar(bucket, tar_key, index_key, chunks, sizes, prefetch, include_errors)
+        # latency to the first member includes loading the tar index
+        return self._prefetch_stream("tar_index", DATASET_CONFIG, prefetch_concurrency, (bucket, tar_key),
+                                     lambda client: client.list_from_tar(bucket, tar_key, index_key, chunks, sizes, prefetch, include_errors))
 
     def gen_tar_archive(self, tar_path: str, index_path: str, source_path: str, index_only: bool = False) -> int:
-        return self._client.gen_tar_archive(tar_path, index_path, source_path, index_only)
+        with self._metrics.timed("gen_tar_archive"):
+            return self._client.gen_tar_archive(tar_path, index_path, source_path, index_only)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns metrics of this client in the current process: latency histograms and error counts per op
+        (get, put, stat, rename, remove, list, get_stream, tar_index), counters of bytes and objects received,
+        prefetch hits and misses (estimated from the wait for each object of a stream), and in-flight ops and open streams."""
+        return self._metrics.snapshot()
+
+
+def prefetch_concurrency_level(concurrency: int) -> int:
+    """Rounds 'concurrency' down to PREFETCH_CONCURRENCY_LEVELS, which bound the native clients built for them."""
+    levels = [level for level in PREFETCH_CONCURRENCY_LEVELS if level <= concurrency]
+    return levels[-1] if levels else PREFETCH_CONCURRENCY_LEVELS[0]
+
+
+class _ConcurrencyBudget:
+    def __init__(self):
+        self._limit = 0
+        self._semaphore = None
+
+    def set(self, limit: int):
+        self._limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @contextmanager
+    def slot(self):
+        semaphore = self._semaphore
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+
+_concurrency_budget = _ConcurrencyBudget()
+
+def set_concurrency_budget(limit: int):
+    """Limits the number of concurrent requests issued from Python threads (warmup, AsyncOssClient requests)
+    across all clients of the process, 0 for no limit. This is not a budget of all requests: prefetch of the native library runs on its own workers, bounded by its configuration, and is
+    not counted. Native calls hold the GIL while they wait, so requests of Python threads overlap little."""
+    _concurrency_budget.set(limit)
+
+
+def request_slot():
+    return _concurrency_budget.slot()
+
+
+_shared_clients_lock = threading.Lock()
+_shared_clients = {}
+
+def _shared_client_key(endpoint: str, cred_path: str, config_path: str, cred_provider: Any, region: str,
+                       worker_id: int, num_workers: int):
+    # credential providers are compared by identity, entries hold their provider so that its id is not reused
+    return (endpoint, cred_path or "", config_path or "", id(cred_provider) if cred_provider is not None else None, region or "",
+            worker_id, num_workers)
+
+
+def get_shared_client(endpoint: str, cred_path: str = "", config_path: str = "", cred_provider: Any = None, region: str = "",
+                      worker_id: int = 0, num_workers: int = 1, uuid: str = "") -> OssClient:
+    """Returns the OssClient of the process for the given endpoint, credentials, configuration, region and
+    DataLoader worker ('worker_id' of 'num_workers' workers, which partition datasets), so that components share one
+    native client (connection pool and prefetch workers). 'uuid' only names a new client in logs.
+    Each call must be paired with 'release_shared_client'."""
+    key = _shared_client_key(endpoint, cred_path, config_path, cred_provider, region, worker_id, num_workers)
+    with _shared_clients_lock:
+        entry = _shared_clients.get(key)
+        if entry is None:
+            entry = [OssClient(endpoint, cred_path, config_path, uuid, worker_id, num_workers, cred_provider=cred_provider,
+                               region=region), 0, cred_provider]
+            _shared_clients[key] = entry
+            log.info("OssClient new shared client, endpoint: %s, id %d, total %d", endpoint, worker_id, num_workers)
+        entry[1] += 1
+        return entry[0]
+
+
+def release_shared_client(client: OssClient):
+    """Releases a client returned by 'get_shared_client', the client is dropped when no component uses it."""
+    key = _shared_client_key(client._endpoint, client._cred_path, client._config_path, client._cred_provider, client._region,
+                             client._id, client._total)
+    with _shared_clients_lock:
+        entry = _shared_clients.get(key)
+        if entry is None or entry[0] is not client:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _shared_clients[key]
+            log.info("OssClient release shared client, endpoint: %s", client._endpoint)
+
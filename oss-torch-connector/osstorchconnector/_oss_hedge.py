@@ -0,0 +1,351 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from collections import deque
+from typing import Iterator, List, Dict, Tuple, Any
+import multiprocessing
+import threading
+import logging
+import errno
+import time
+import io
+import os
+import re
+
+from ._oss_client import OssClient, DataObject
+from ._oss_bucket_iterable import parse_oss_uri
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_hedge.py
+    Hedged requests: objects of a batch are fetched by worker processes, and an
+    object slower than the observed quantile of fetches is requested again on a
+    second pool, the first response wins.
+"""
+
+class LatencyTracker:
+    """Quantiles of the last 'window' latencies."""
+
+    def __init__(self, window: int = 1000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class FetchedObject(io.BytesIO):
+    """An object received whole by a fetch worker, with the attributes of the DataObjects of streams."""
+
+    def __init__(self, key: str, size: int, label: str, data: bytes = b"", err: int = 0, error_msg: str = ""):
+        super().__init__(data)
+        self.key = key
+        self.size = len(data) if err == 0 else size
+        self.label = label
+        self._err = err
+        self._error_msg = error_msg
+
+    def err(self) -> int:
+        return self._err
+
+    def error_msg(self) -> str:
+        return self._error_msg
+
+    def copy(self) -> "FetchedObject":
+        # the data is owned by this process, copies share it
+        return FetchedObject(self.key, self.size, self.label, self.getvalue(), self._err, self._error_msg)
+
+
+# client of a fetch worker process
+_worker_client = None
+
+def _init_worker(client: OssClient):
+    global _worker_client
+    _worker_client = client
+
+
+# errno of the errors raised by native requests, e.g. "open_ro failed, errno=2(No such file or directory), msg=..."
+_NATIVE_ERRNO = re.compile(r"errno=(\d+)")
+
+
+def _fetch(key: str, size: int, label: str) -> Tuple[bytes, int, str, float]:
+    # runs in a fetch worker: returns the data, the error and the seconds of the request
+    start_time = time.perf_counter()
+    bucket, object_key = parse_oss_uri(key)
+    try:
+        if size <= 0:
+            object = _worker_client.get_object(bucket, object_key, 0, type=2, label=label)     # mem
+        else:
+            object = _worker_client.get_object(bucket, object_key, size, type=0, label=label)  # basic
+        err = object.err()
+        data = object.read() if err == 0 else b""
+        error_msg = object.error_msg() if err != 0 else ""
+    except RuntimeError as e:
+        # failed requests raise instead of returning an object with an error, as objects of streams do
+        match = _NATIVE_ERRNO.search(str(e))
+        if match is None:
+            raise
+        data, err, error_msg = b"", int(match.group(1)), str(e)
+    return data, err, error_msg, time.perf_counter() - start_time
+
+
+class _Request:
+    # an object of a batch with its primary and hedge requests
+    def __init__(self, listed: DataObject):
+        self.listed = listed
+        self.primary: Future = None
+        self.hedge: Future = None
+        self.start_time = 0.0
+        # the time to hedge passed, whether it was hedged or not
+        self.late = False
+        self.recorded = False
+        self.result = None
+
+    def futures(self) -> List[Future]:
+        return [future for future in (self.primary, self.hedge) if future is not None]
+
+
+class HedgePolicy:
+    """Fetches the objects of OssMapDataset batches with hedged requests.
+
+    Native calls hold the GIL while they wait for a response, so a request can not be raced by another from the
+    same process. With a policy, objects of a batch are fetched by 'num_workers' worker processes, each with its own
+    native client, instead of the prefetch stream of the process. Once a fetch has taken longer than the observed
+    'quantile' of fetches, the object is requested again on a second pool of 'num_hedge_workers' processes, so that
+    hedges never wait behind the requests they race, and the first response wins: the other request is cancelled
+    if it is still queued, or its response is dropped if it is running (a native request can not be interrupted).
+    An object delivered with an error other than ENOENT is requested again right away.
+    Hedges are budgeted with a token bucket: each request adds 'budget_ratio' token up to 'budget_burst', and each
+    hedge takes one, so that hedges stay a small fraction of the requests.
+
+    Objects are read whole by the workers and returned with their data to this process, so hedging is meant for
+    small objects, for which the time of a fetch is about its time to first byte. Worker processes are started from
+    a fork server on the first batch of each process using the policy (e.g. each DataLoader worker).
+
+    Each worker process has its own native client (connection pool) built from a copy of the client of the dataset,
+    so 'cred_provider' must be picklable, and the policy opens connections for 'num_workers' + 'num_hedge_workers'
+    native clients in each process using it, in addition to the client shared by the process: with 8 DataLoader
+    workers and the defaults, 40 native clients. Keep the pools small, the requests in flight of a process are at
+    most 'num_workers' anyway.
+
+    Args:
+      quantile(float): Quantile of the observed fetch times after which an object is requested again.
+      min_delay(float): Minimum seconds before an object is requested again, so that hedges are not issued on noise.
+      min_samples(int): Number of observed fetches required before hedging on time.
+      budget_ratio(float): Hedges per request.
+      budget_burst(float): Maximum number of hedges at once.
+      max_hedges(int): Maximum number of hedges per batch.
+      num_workers(int): Number of processes fetching the objects of a batch, the requests in flight.
+      num_hedge_workers(int): Number of processes fetching hedges.
+    """
+
+    def __init__(self, quantile: float = 0.95, min_delay: float = 0.01, min_samples: int = 20,
+                 budget_ratio: float = 0.05, budget_burst: float = 4, max_hedges: int = 2,
+                 num_workers: int = 4, num_hedge_workers: int = 1):
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self.max_hedges = max_hedges
+        self.num_workers = num_workers
+        self.num_hedge_workers = num_hedge_workers
+        self._tracker = LatencyTracker()
+        self._tokens = budget_burst
+        self._lock = threading.Lock()
+        self._executors = None
+        self._executors_pid = None
+        # submitted requests not done yet, cancelled on close
+        self._futures = set()
+        self._stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "hedge_cancelled": 0, "hedge_dropped": 0,
+                       "errors": 0, "budget_exhausted": 0}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        state["_executors"] = None
+        state["_executors_pid"] = None
+        state["_futures"] = set()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _delay(self) -> float:
+        if len(self._tracker) < self.min_samples:
+            return None
+        return max(self.min_delay, self._tracker.quantile(self.quantile))
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                self._stats["budget_exhausted"] += 1
+                return False
+            self._tokens -= 1
+            self._stats["hedged"] += 1
+            return True
+
+    def _add_request(self):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._tokens = min(self.budget_burst, self._tokens + self.budget_ratio)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns counters of requests (objects), hedges, hedges which delivered the object first (hedge_wins),
+        losing requests cancelled before they started or whose response was dropped, failed requests, objects not
+        hedged for lack of budget, and the current delay after which an object is requested again."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["delay_seconds"] = self._delay() or 0.0
+        return stats
+
+    def _get_executors(self, client: OssClient) -> Tuple[ProcessPoolExecutor, ProcessPoolExecutor]:
+        # workers are forked from a fork server, which holds no native client, rather than from this process
+        if self._executors is None or self._executors_pid != os.getpid():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["osstorchconnector"])
+            self._executors = tuple(
+                ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                    initargs=(client,))
+                for workers in (self.num_workers, self.num_hedge_workers))
+            self._executors_pid = os.getpid()
+        return self._executors
+
+    def close(self):
+        """Stops the worker processes of this process, they are started again by the next batch."""
+        if self._executors is not None and self._executors_pid == os.getpid():
+            # queued requests are cancelled here, 'shutdown' has no 'cancel_futures' before Python 3.9
+            with self._lock:
+                futures, self._futures = self._futures, set()
+            for future in futures:
+                future.cancel()
+            for executor in self._executors:
+                executor.shutdown(wait=False)
+        self._executors = None
+
+    def _submit(self, executor: ProcessPoolExecutor, listed: DataObject) -> Future:
+        future = executor.submit(_fetch, listed.key, listed.size, listed.label)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard_future)
+        return future
+
+    def _discard_future(self, future: Future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _finish(self, request: _Request, winner: Future):
+        # the first response wins, the other request is cancelled or its response dropped
+        for future in request.futures():
+            if future is winner:
+                continue
+            if future.cancel():
+                self._count("hedge_cancelled")
+            elif not future.done():
+                self._count("hedge_dropped")
+        if winner is request.hedge:
+            self._count("hedge_wins")
+        data, err, error_msg, _ = winner.result()
+        listed = request.listed
+        request.result = FetchedObject(listed.key, listed.size, listed.label, data, err, error_msg)
+
+    def _hedge(self, request: _Request, executor: ProcessPoolExecutor, hedges: int) -> bool:
+        if request.hedge is not None or hedges >= self.max_hedges or not self._take_token():
+            return False
+        log.debug("hedge request of %s", request.listed.key)
+        request.hedge = self._submit(executor, request.listed)
+        return True
+
+    def iter(self, objects: List[DataObject], client: OssClient) -> Iterator[DataObject]:
+        """Yields the objects of 'objects' in order, fetched by the workers (with clients copied from 'client')
+        with hedged requests."""
+        executor, hedge_executor = self._get_executors(client)
+        requests = [_Request(listed) for listed in objects]
+        pending = deque(requests)
+        running = []
+        hedges = 0
+        position = 0
+        while position < len(requests):
+            # at most 'num_workers' requests are submitted, so that a submitted request is running
+            while pending and len(running) < self.num_workers:
+                request = pending.popleft()
+                self._add_request()
+                request.primary = self._submit(executor, request.listed)
+                request.start_time = time.perf_counter()
+                running.append(request)
+            delay = self._delay()
+            timeout = None
+            if delay is not None:
+                deadlines = [request.start_time + delay for request in running if not request.late]
+                if deadlines:
+                    timeout = max(0.0, min(deadlines) - time.perf_counter())
+            futures = [future for request in running for future in request.futures() if not future.done()]
+            if futures:
+                wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            now = time.perf_counter()
+            for request in list(running):
+                primary = request.primary
+                if primary.done() and not request.recorded and not primary.cancelled() and primary.exception() is None:
+                    request.recorded = True
+                    self._tracker.add(primary.result()[3])
+                winner = self._winner(request)
+                if winner is not None:
+                    self._finish(request, winner)
+                    running.remove(request)
+                    continue
+                if not request.late and delay is not None and now - request.start_time >= delay:
+                    request.late = True
+                    if self._hedge(request, hedge_executor, hedges):
+                        hedges += 1
+                if all(future.done() for future in request.futures()):
+                    # failed, requested again right away if not hedged yet
+                    if self._hedge(request, hedge_executor, hedges):
+                        hedges += 1
+                    else:
+                        self._finish_failed(request)
+                        running.remove(request)
+            while position < len(requests) and requests[position].result is not None:
+                yield requests[position].result
+                requests[position].result = None
+                position += 1
+
+    def _winner(self, request: _Request) -> Future:
+        # the first successful response (an object or ENOENT, which is missing for any request)
+        for future in request.futures():
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                continue
+            if future.result()[1] in (0, errno.ENOENT):
+                return future
+        return None
+
+    def _finish_failed(self, request: _Request):
+        self._count("errors")
+        future = request.hedge if request.hedge is not None else request.primary
+        exception = future.exception()
+        if exception is not None:
+            raise exception
+        self._finish(request, future)
@@ -0,0 +1,325 @@
+from typing import Dict, Iterable, Iterator, List, Callable, Any
+from contextlib import contextmanager
+import multiprocessing.util
+import threading
+import tempfile
+import weakref
+import logging
+import shutil
+import json
+import time
+import os
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_metrics.py
+    Per-op latency histograms, byte counters and in-flight gauges of
+    clients, mergeable across processes and exportable as Prometheus text.
+"""
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# a stream object received faster than this is taken as prefetched already: the native stream does not tell,
+# so prefetch hits and misses are estimates, counted as 'prefetch_hits_estimated' and 'prefetch_misses_estimated'
+PREFETCH_HIT_SECONDS = 0.001
+
+# metrics of this process, reset in forked children
+_all_metrics = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    # runs in the child right after fork, which only has the forking thread: locks held by other threads of the
+    # parent are replaced rather than waited for
+    for metrics in list(_all_metrics):
+        metrics._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Metrics:
+    """Thread-safe metrics of one process.
+
+    Ops record a latency histogram (cumulative counts of LATENCY_BUCKETS, plus count and sum)
+    and an error count. Counters only increase, gauges hold the current value (e.g. in-flight ops).
+    """
+
+    def __init__(self):
+        self._reset()
+        _all_metrics.add(self)
+
+    def _reset(self):
+        # forked processes start from empty metrics, so that aggregated stats count each op once
+        self._lock = threading.Lock()
+        self._ops = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def __reduce__(self):
+        # metrics are per process
+        return (Metrics, ())
+
+    def _op_stats(self, op: str) -> Dict[str, Any]:
+        stats = self._ops.get(op)
+        if stats is None:
+            stats = {"count": 0, "errors": 0, "seconds_sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)}
+            self._ops[op] = stats
+        return stats
+
+    def observe(self, op: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self._op_stats(op)
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["seconds_sum"] += seconds
+            buckets = stats["buckets"]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+
+    def count_error(self, op: str):
+        """Counts an error of an op whose latency was already observed, e.g. a stream failing after its first object."""
+        with self._lock:
+            self._op_stats(op)["errors"] += 1
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + value
+
+    @contextmanager
+    def timed(self, op: str):
+        """Records the latency of the enclosed op, and counts it in the 'in_flight' gauge while it runs."""
+        self.add_gauge("in_flight", 1)
+        start_time = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(op, time.perf_counter() - start_time, error)
+            self.add_gauge("in_flight", -1)
+
+    def timed_stream(self, op: str, objects: Iterable[Any]) -> "TimedStream":
+        """Records the latency of the first object of a stream as 'op', bytes of received objects,
+        and estimated prefetch hits (objects received without waiting) and misses. See 'TimedStream'."""
+        return TimedStream(self, op, objects)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ops": {op: dict(stats, buckets=list(stats["buckets"])) for op, stats in self._ops.items()},
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+            }
+
+
+class TimedStream:
+    """Iterator over a stream of objects which records its metrics while iterating.
+
+    The stream is observed once as 'op': the latency to its first object, or to its end or error if it has none.
+    An error after the first object is counted as an error of 'op' without another observation. Each object is
+    counted once, as an estimated prefetch hit if it was received within PREFETCH_HIT_SECONDS, else as a miss.
+    Other attributes, e.g. the length of native streams, are those of the wrapped stream.
+    """
+
+    def __init__(self, metrics: Metrics, op: str, objects: Iterable[Any]):
+        self._metrics = metrics
+        self._op = op
+        self._objects = objects
+        self._it = None
+        self._start_time = 0.0
+        self._first = True
+        self._open = False
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes not found on the wrapper
+        objects = self.__dict__.get("_objects")
+        if objects is None:
+            raise AttributeError(name)
+        return getattr(objects, name)
+
+    def __iter__(self) -> "TimedStream":
+        return self
+
+    def __next__(self) -> Any:
+        metrics = self._metrics
+        if self._it is None:
+            self._start_time = time.perf_counter()
+            self._it = iter(self._objects)
+            self._open = True
+            metrics.add_gauge("open_streams", 1)
+        wait_start = time.perf_counter()
+        try:
+            obj = next(self._it)
+        except StopIteration:
+            if self._first:
+                self._first = False
+                metrics.observe(self._op, time.perf_counter() - self._start_time)
+            self.close()
+            raise
+        except BaseException:
+            if self._first:
+                self._first = False
+                metrics.observe(self._op, time.perf_counter() - self._start_time, error=True)
+            else:
+                metrics.count_error(self._op)
+            self.close()
+            raise
+        now = time.perf_counter()
+        if self._first:
+            self._first = False
+            metrics.observe(self._op, now - self._start_time)
+        with metrics._lock:
+            counters = metrics._counters
+            name = "prefetch_hits_estimated" if now - wait_start <= PREFETCH_HIT_SECONDS else "prefetch_misses_estimated"
+            counters[name] = counters.get(name, 0) + 1
+            counters["objects_received"] = counters.get("objects_received", 0) + 1
+            counters["bytes_received"] = counters.get("bytes_received", 0) + max(obj.size, 0)
+        return obj
+
+    def close(self):
+        if self._open:
+            self._open = False
+            self._metrics.add_gauge("open_streams", -1)
+
+    def __del__(self):
+        if "_open" in self.__dict__:
+            self.close()
+
+
+def merge_stats(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sums snapshots of several processes."""
+    merged = {"ops": {}, "counters": {}, "gauges": {}}
+    for snapshot in snapshots:
+        for op, stats in snapshot.get("ops", {}).items():
+            total = merged["ops"].setdefault(op, {"count": 0, "errors": 0, "seconds_sum": 0.0,
+                                                  "buckets": [0] * len(LATENCY_BUCKETS)})
+            total["count"] += stats["count"]
+            total["errors"] += stats["errors"]
+            total["seconds_sum"] += stats["seconds_sum"]
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], stats["buckets"])]
+        for kind in ("counters", "gauges"):
+            for name, value in snapshot.get(kind, {}).items():
+                merged[kind][name] = merged[kind].get(name, 0) + value
+    return merged
+
+
+def stats_to_prometheus(stats: Dict[str, Any], prefix: str = "oss_connector", labels: Dict[str, str] = None) -> str:
+    """Formats stats returned by 'get_stats' in the Prometheus text exposition format."""
+    base = dict(labels or {})
+
+    def format_labels(extra: Dict[str, str]) -> str:
+        items = dict(base, **extra)
+        if not items:
+            return ""
+        return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in sorted(items.items())) + "}"
+
+    lines = []
+    ops = stats.get("ops", {})
+    if ops:
+        name = prefix + "_op_latency_seconds"
+        lines.append("# HELP %s Latency of OSS operations." % name)
+        lines.append("# TYPE %s histogram" % name)
+        for op, op_stats in sorted(ops.items()):
+            for bound, count in zip(LATENCY_BUCKETS, op_stats["buckets"]):
+                lines.append("%s_bucket%s %d" % (name, format_labels({"op": op, "le": repr(bound)}), count))
+            lines.append("%s_bucket%s %d" % (name, format_labels({"op": op, "le": "+Inf"}), op_stats["count"]))
+            lines.append("%s_sum%s %f" % (name, format_labels({"op": op}), op_stats["seconds_sum"]))
+            lines.append("%s_count%s %d" % (name, format_labels({"op": op}), op_stats["count"]))
+        name = prefix + "_op_errors_total"
+        lines.append("# TYPE %s counter" % name)
+        for op, op_stats in sorted(ops.items()):
+            lines.append("%s%s %d" % (name, format_labels({"op": op}), op_stats["errors"]))
+    for counter, value in sorted(stats.get("counters", {}).items()):
+        name = "%s_%s_total" % (prefix, counter)
+        lines.append("# TYPE %s counter" % name)
+        lines.append("%s%s %s" % (name, format_labels({}), value))
+    for gauge, value in sorted(stats.get("gauges", {}).items()):
+        name = "%s_%s" % (prefix, gauge)
+        lines.append("# TYPE %s gauge" % name)
+        lines.append("%s%s %s" % (name, format_labels({}), value))
+    return "\n".join(lines) + "\n"
+
+
+class StatsPublisher:
+    """Publishes snapshots of a process to 'stats_dir' (one file per process), so that the main process
+    can aggregate the stats of DataLoader workers. Counters of exited workers are kept, gauges are only
+    taken from files updated within 'gauge_ttl' seconds."""
+
+    def __init__(self, stats_dir: str, interval: float = 1.0, gauge_ttl: float = 10.0):
+        self.stats_dir = stats_dir
+        self.interval = interval
+        self.gauge_ttl = gauge_ttl
+        self._owner_pid = os.getpid()
+        self._last_publish = 0.0
+        self._exit_pid = None
+
+    @classmethod
+    def for_dataset(cls, dataset_uuid: Any) -> "StatsPublisher":
+        return cls(os.path.join(tempfile.gettempdir(), "osstorchconnector-stats", str(dataset_uuid)))
+
+    def publish(self, get_snapshot: Callable[[], Dict[str, Any]], force: bool = False):
+        """Writes the snapshot returned by 'get_snapshot', at most once per 'interval' unless 'force'.
+        The first publish of a process also registers a final publish at its exit."""
+        if self._exit_pid != os.getpid():
+            # worker processes exit without running atexit handlers, but do run multiprocessing finalizers
+            self._exit_pid = os.getpid()
+            multiprocessing.util.Finalize(None, self.publish, args=(get_snapshot, True), exitpriority=10)
+        now = time.time()
+        if not force and now - self._last_publish < self.interval:
+            return
+        self._last_publish = now
+        snapshot = get_snapshot()
+        try:
+            os.makedirs(self.stats_dir, exist_ok=True)
+            path = os.path.join(self.stats_dir, "%d.json" % os.getpid())
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log.warning("failed to publish stats to %s: %s", self.stats_dir, e)
+
+    def collect(self, exclude_pid: int = None) -> List[Dict[str, Any]]:
+        snapshots = []
+        if not os.path.isdir(self.stats_dir):
+            return snapshots
+        now = time.time()
+        for name in os.listdir(self.stats_dir):
+            if not name.endswith(".json") or name == "%d.json" % (exclude_pid or -1):
+                continue
+            path = os.path.join(self.stats_dir, name)
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+                if now - os.path.getmtime(path) > self.gauge_ttl:
+                    snapshot["gauges"] = {}
+            except (OSError, ValueError) as e:
+                log.debug("failed to read stats %s: %s", path, e)
+                continue
+            snapshots.append(snapshot)
+        return snapshots
+
+    def remove(self):
+        """Removes 'stats_dir', in the process which created the publisher only."""
+        if os.getpid() == self._owner_pid:
+            shutil.rmtree(self.stats_dir, ignore_errors=True)
+
+
+def iter_published(items: Iterable[Any], publisher: StatsPublisher,
+                   get_snapshot: Callable[[], Dict[str, Any]]) -> Iterator[Any]:
+    """Yields 'items', publishing snapshots while iterating and once the items are exhausted."""
+    for item in items:
+        publisher.publish(get_snapshot)
+        yield item
+    publisher.publish(get_snapshot, force=True)
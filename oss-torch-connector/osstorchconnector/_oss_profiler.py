@@ -0,0 +1,273 @@
+from typing import Dict, Iterable, Iterator, List, Callable, Any
+from contextlib import contextmanager
+import multiprocessing.util
+import threading
+import logging
+import atexit
+import json
+import time
+import os
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_profiler.py
+    Per-sample timings of datasets and checkpoint readers, written as
+    Chrome trace events (opened by chrome://tracing and Perfetto).
+"""
+
+# categories of trace events, 'summarize_traces' attributes data loading time to io and cpu
+CATEGORY_IO = "io"
+CATEGORY_CPU = "cpu"
+CATEGORY_BATCH = "batch"
+CATEGORY_STEP = "step"
+
+
+class _Traced:
+    # picklable wrapper of a transform, so that it can be sent to DataLoader workers
+    def __init__(self, profiler: "Profiler", fn: Callable, name: str, category: str):
+        self.profiler = profiler
+        self.fn = fn
+        self.name = name
+        self.category = category
+
+    def __call__(self, *args, **kwargs):
+        with self.profiler.span(self.name, self.category, _object_args(args[0]) if args else None):
+            return self.fn(*args, **kwargs)
+
+
+def _object_args(object: Any) -> Dict[str, Any]:
+    if isinstance(object, list):
+        return {"count": len(object)}
+    key = getattr(object, "key", None)
+    if not isinstance(key, str):
+        return None
+    return {"key": key, "size": getattr(object, "size", -1)}
+
+
+class Profiler:
+    """Records the timings of samples as Chrome trace events, in one file per process ('trace-<pid>.json' in 'trace_dir').
+
+    Events are complete events ('X') on the thread which recorded them:
+    - 'wait' (io): the wait for an object of a stream, from the previous object (or the request) until the object is
+      received, with the key, size and time since the request of the stream ('since_request_ms') in args,
+    - 'open' (io): opening an object, 'read' (io): reading a range of a checkpoint,
+    - 'transform', 'batch_transform', 'deserialize' (cpu),
+    - 'getitem', 'getitems' (batch): a sample or batch of OssMapDataset, ending when it is returned to the DataLoader,
+    - 'stream' (batch): the lifetime of a stream read by OssFileSystem, including its reads and deserialization,
+    - 'yield' (instant): a sample or batch of OssIterableDataset returned to the DataLoader,
+    - 'next_batch' (step): the wait of the training loop for a batch, see 'iter_steps'.
+    Files are in the JSON array format, appended every 'flush_events' events and at process exit,
+    'summarize_traces' summarizes them.
+
+    Args:
+      trace_dir(str): Directory of the trace files.
+      flush_events(int): Number of events buffered before they are appended to the trace file.
+    """
+
+    def __init__(self, trace_dir: str, flush_events: int = 10000):
+        self.trace_dir = trace_dir
+        self.flush_events = flush_events
+        self._pid = None
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = set()
+
+    def __reduce__(self):
+        # events are per process
+        return (Profiler, (self.trace_dir, self.flush_events))
+
+    def _start_process(self):
+        # called with the lock held, on the first event of a process
+        self._pid = os.getpid()
+        self._events = []
+        self._threads = set()
+        # trace timestamps are wall clock, so that processes line up
+        self._offset = time.time() - time.perf_counter()
+        self._path = os.path.join(self.trace_dir, "trace-%d.json" % self._pid)
+        name = "main"
+        try:
+            import torch.utils.data
+            worker_info = torch.utils.data.get_worker_info()
+            if worker_info is not None:
+                name = "worker %d" % worker_info.id
+        except ImportError:
+            pass
+        self._events.append({"name": "process_name", "ph": "M", "pid": self._pid, "args": {"name": name}})
+        # DataLoader workers exit without running atexit handlers, but do run multiprocessing finalizers
+        multiprocessing.util.Finalize(None, self.flush, exitpriority=10)
+        atexit.register(self.flush)
+
+    def _us(self, t: float) -> float:
+        return round((t + self._offset) * 1e6, 1)
+
+    def _emit(self, event: Dict[str, Any]):
+        tid = threading.get_ident()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start_process()
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self._events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid,
+                                     "args": {"name": threading.current_thread().name}})
+            event["ts"] = self._us(event["ts"])
+            event["pid"] = self._pid
+            event["tid"] = tid
+            self._events.append(event)
+            if len(self._events) < self.flush_events:
+                return
+        self.flush()
+
+    def complete(self, name: str, category: str, start: float, end: float, args: Dict[str, Any] = None):
+        """Records an event from 'start' to 'end' (time.perf_counter seconds)."""
+        event = {"name": name, "cat": category, "ph": "X", "ts": start, "dur": round((end - start) * 1e6, 1)}
+        if args:
+            event["args"] = args
+        self._emit(event)
+
+    def instant(self, name: str, category: str, args: Dict[str, Any] = None):
+        event = {"name": name, "cat": category, "ph": "i", "s": "t", "ts": time.perf_counter()}
+        if args:
+            event["args"] = args
+        self._emit(event)
+
+    @contextmanager
+    def span(self, name: str, category: str, args: Dict[str, Any] = None):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, category, start_time, time.perf_counter(), args)
+
+    def traced(self, fn: Callable, name: str, category: str = CATEGORY_CPU) -> Callable:
+        """Returns 'fn' recording each call as an event, e.g. a transform or the 'collate_fn' of a DataLoader."""
+        return _Traced(self, fn, name, category)
+
+    def iter_waits(self, objects: Iterable[Any]) -> Iterator[Any]:
+        """Yields 'objects' recording the wait for each of them, the request time is the time of this call."""
+        return self._iter_waits(objects, time.perf_counter())
+
+    def _iter_waits(self, objects: Iterable[Any], issue: float) -> Iterator[Any]:
+        it = iter(objects)
+        start_time = issue
+        while True:
+            try:
+                object = next(it)
+            except StopIteration:
+                return
+            end_time = time.perf_counter()
+            args = _object_args(object) or {}
+            args["since_request_ms"] = round((end_time - issue) * 1e3, 3)
+            self.complete("wait", CATEGORY_IO, start_time, end_time, args)
+            yield object
+            start_time = time.perf_counter()
+
+    def iter_yields(self, items: Iterable[Any]) -> Iterator[Any]:
+        """Yields 'items' recording the time each one is returned."""
+        for item in items:
+            self.instant("yield", CATEGORY_BATCH)
+            yield item
+
+    def iter_steps(self, loader: Iterable[Any]) -> Iterator[Any]:
+        """Yields the batches of 'loader' (e.g. a DataLoader) recording the wait of the training loop for each batch,
+        which 'summarize_traces' compares with the time spent in steps."""
+        it = iter(loader)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                batch = next(it)
+            except StopIteration:
+                return
+            self.complete("next_batch", CATEGORY_STEP, start_time, time.perf_counter())
+            yield batch
+
+    def flush(self):
+        """Appends buffered events of this process to its trace file."""
+        with self._lock:
+            if self._pid != os.getpid() or not self._events:
+                return
+            events = self._events
+            self._events = []
+            try:
+                os.makedirs(self.trace_dir, exist_ok=True)
+                # the JSON array format allows a missing closing bracket, so files are only appended
+                with open(self._path, "a") as f:
+                    if f.tell() == 0:
+                        f.write("[\n")
+                    f.write("".join(json.dumps(event, separators=(",", ":")) + ",\n" for event in events))
+            except OSError as e:
+                log.warning("failed to write trace %s: %s", self._path, e)
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    """Loads the events of a trace file written by 'Profiler'."""
+    with open(path) as f:
+        text = f.read().rstrip().rstrip(",")
+    if not text.endswith("]"):
+        text += "]"
+    return json.loads(text)
+
+
+def _quantile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize_traces(trace_dir: str) -> Dict[str, Any]:
+    """Summarizes the trace files of 'trace_dir'.
+
+    Returns:
+        Dict: Count, total and quantiles (ms) per event name in 'events', seconds of io and cpu events in
+              all processes, the io share of data loading, and if 'iter_steps' was used, the number of steps, the time
+              of the training loop, the time it waited for batches ('stall_seconds') and its attribution to io and cpu.
+    """
+    durations = {}
+    categories = {}
+    processes = set()
+    step_bounds = []
+    for name in sorted(os.listdir(trace_dir)):
+        if not (name.startswith("trace-") and name.endswith(".json")):
+            continue
+        try:
+            events = load_trace(os.path.join(trace_dir, name))
+        except (OSError, ValueError) as e:
+            log.warning("failed to load trace %s: %s", name, e)
+            continue
+        for event in events:
+            if event.get("ph") != "X":
+                continue
+            processes.add(event["pid"])
+            durations.setdefault(event["name"], []).append(event["dur"] / 1e3)
+            categories[event["name"]] = event.get("cat", "")
+            if event["name"] == "next_batch":
+                step_bounds.append((event["ts"], event["ts"] + event["dur"]))
+    summary = {"processes": len(processes), "events": {}}
+    for name, values in sorted(durations.items()):
+        summary["events"][name] = {
+            "category": categories[name],
+            "count": len(values),
+            "total_ms": sum(values),
+            "p50_ms": _quantile(values, 0.5),
+            "p99_ms": _quantile(values, 0.99),
+        }
+
+    def total_seconds(category: str) -> float:
+        return sum(event["total_ms"] for event in summary["events"].values() if event["category"] == category) / 1e3
+
+    io_seconds = total_seconds(CATEGORY_IO)
+    cpu_seconds = total_seconds(CATEGORY_CPU)
+    summary["io_seconds"] = io_seconds
+    summary["cpu_seconds"] = cpu_seconds
+    summary["io_share"] = io_seconds / (io_seconds + cpu_seconds) if io_seconds + cpu_seconds > 0 else 0.0
+    steps = summary["events"].get("next_batch")
+    if steps is not None:
+        stall_seconds = steps["total_ms"] / 1e3
+        summary["steps"] = steps["count"]
+        summary["loop_seconds"] = (max(end for _, end in step_bounds) - min(start for start, _ in step_bounds)) / 1e6
+        summary["stall_seconds"] = stall_seconds
+        # workers overlap io with cpu, so the stall is attributed by the shares of their busy time
+        summary["stall_io_seconds"] = stall_seconds * summary["io_share"]
+        summary["stall_cpu_seconds"] = stall_seconds - summary["stall_io_seconds"]
+    return summary
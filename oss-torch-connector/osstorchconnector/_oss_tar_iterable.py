@@ -1,45 +1,145 @@
-from typing import Iterator, List, Tuple, Any
+from typing import Iterator, Iterable, List, Tuple, Dict, Any, Optional, Sequence
 from ._oss_client import OssClient, DataObject
+from ._oss_connector import new_data_object
 from ._oss_bucket_iterable import parse_oss_uri
+from ._oss_buffer import own_object
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+from array import array
+import itertools
+import bisect
 import logging
+import tarfile
+import tempfile
+import json
+import time
+import os
+import errno
 
 log = logging.getLogger(__name__)
 
+TAR_BLOCK_SIZE = 512
+TAR_MANIFEST_NAME = "manifest.json"
+
 class OssTarIterable:
     def __init__(self, client: OssClient, *,
                  tar_uri: str = None,
                  tar_index_uri: str = None,
                  preload: bool = False,
-                 chunks: List[Tuple[int, int]] = []):
-        log.info("OssTarIterable init, preload: %s", preload)
+                 chunks: List[Tuple[int, int]] = [],
+                 shards: List[Tuple[str, str, int]] = None,
+                 group_samples: bool = False,
+                 sample_starts: List[array] = None):
+        log.info("OssTarIterable init, preload: %s, group_samples: %s", preload, group_samples)
         self._client = client
         self._tar_uri = tar_uri
         self._tar_index_uri = tar_index_uri
         self._preload = preload
         self._chunks = chunks
+        self._shards = shards
+        self._group_samples = group_samples
+        self._member_num = None
+        self._sample_starts = sample_starts
         self._list_stream = None
 
     @classmethod
     def from_tar(cls, tar_uri: str, tar_index_uri: str, client: OssClient, preload: bool = False,
-                 chunks: List[Tuple[int, int]] = []):
+                 chunks: List[Tuple[int, int]] = [], group_samples: bool = False,
+                 sample_starts: List[array] = None):
         if not tar_uri:
             raise ValueError("tar_uri must be non-empty")
         if not tar_uri.startswith("oss://"):
             raise ValueError("only oss:// uri are supported for tar_uri")
         if not tar_index_uri:
-            raise ValueError("tar_index_uri must be non-empty")
+            # tar_uri refers to a shard manifest generated by 'generate_tar_shards'
+            shards = load_tar_manifest(client, tar_uri)
+            return cls(client, preload=preload, chunks=chunks, shards=shards, group_samples=group_samples,
+                       sample_starts=sample_starts)
         if not tar_index_uri.startswith("oss://"):
             raise ValueError("only oss:// uri are supported for tar_index_uri")
         return cls(client, tar_uri=tar_uri, tar_index_uri=tar_index_uri, preload=preload,
-                   chunks=chunks)
+                   chunks=chunks, group_samples=group_samples, sample_starts=sample_starts)
+
+    @property
+    def shards(self) -> List[Tuple[str, str]]:
+        if self._shards is None:
+            return [(self._tar_uri, self._tar_index_uri)]
+        return [(tar_uri, tar_index_uri) for tar_uri, tar_index_uri, _ in self._shards]
+
+    def shard_sizes(self) -> List[int]:
+        if self._shards is None:
+            if self._member_num is None:
+                self._member_num = len(OssTarObjectsIterator(self._client, self._tar_uri, self._tar_index_uri, False))
+            return [self._member_num]
+        return [size for _, _, size in self._shards]
+
+    def sample_starts(self) -> List[array]:
+        # member index of the first member of each sample per shard, see 'tar_sample_starts'
+        if self._sample_starts is None:
+            self._sample_starts = [tar_sample_starts(self.iter_shard(i)) for i in range(len(self.shards))]
+            log.info("OssTarIterable get sample starts, sample num: %d", sum(self.sample_sizes()))
+        return self._sample_starts
+
+    def sample_sizes(self) -> List[int]:
+        return [len(starts) - 1 for starts in self.sample_starts()]
+
+    def iter_shard(self, shard: int) -> Iterator[DataObject]:
+        tar_uri, tar_index_uri = self.shards[shard]
+        return iter(OssTarObjectsIterator(self._client, tar_uri, tar_index_uri, False))
 
     def __iter__(self) -> Iterator[DataObject]:
         # This allows us to iterate multiple times by re-creating the `_list_stream`
+        if self._group_samples:
+            return self._iter_samples()
+        if self._shards is not None:
+            return self._iter_shards()
         self._list_stream = OssTarObjectsIterator(self._client, self._tar_uri, self._tar_index_uri, self._preload,
                                                   chunks=self._chunks)
         return iter(self._list_stream)
 
+    def _iter_shards(self) -> Iterator[DataObject]:
+        if not self._chunks:
+            for tar_uri, tar_index_uri, _ in self._shards:
+                yield from OssTarObjectsIterator(self._client, tar_uri, tar_index_uri, self._preload)
+            return
+        yield from self._iter_pieces(split_tar_chunks(self._chunks, self.shard_sizes()))
+
+    def _iter_samples(self) -> Iterator[Dict[str, Any]]:
+        # chunks are in units of samples, they are mapped to member chunks so that
+        # a sample is never split between requests or workers
+        sample_starts = self.sample_starts()
+        if self._chunks:
+            pieces = split_tar_chunks(self._chunks, self.sample_sizes())
+        else:
+            pieces = ((shard, (0, len(starts) - 1)) for shard, starts in enumerate(sample_starts))
+        member_pieces = ((shard, (sample_starts[shard][start],
+                                  sample_starts[shard][start + length] - sample_starts[shard][start]))
+                         for shard, (start, length) in pieces if length > 0)
+        return group_tar_samples(self._iter_pieces(member_pieces))
+
+    def _iter_pieces(self, pieces: Iterable[Tuple[int, Tuple[int, int]]]) -> Iterator[DataObject]:
+        # consecutive pieces in the same shard are read by one request to keep the chunk order
+        shard_chunks = []
+        current = None
+        for shard, chunk in pieces:
+            if shard != current and shard_chunks:
+                yield from self._iter_shard_chunks(current, shard_chunks)
+                shard_chunks = []
+            current = shard
+            shard_chunks.append(chunk)
+        if shard_chunks:
+            yield from self._iter_shard_chunks(current, shard_chunks)
+
+    def _iter_shard_chunks(self, shard: int, chunks: List[Tuple[int, int]]) -> Iterator[DataObject]:
+        tar_uri, tar_index_uri = self.shards[shard]
+        return iter(OssTarObjectsIterator(self._client, tar_uri, tar_index_uri, self._preload, chunks=chunks))
+
     def __len__(self):
+        if self._group_samples:
+            return sum(self.sample_sizes())
+        if self._shards is not None:
+            return sum(self.shard_sizes())
         if self._list_stream is None:
             self._list_stream = OssTarObjectsIterator(self._client, self._tar_uri, self._tar_index_uri, self._preload,
                                                       chunks=self._chunks)
@@ -67,6 +167,102 @@ class OssTarObjectsIterator:
         return len(self._list_stream)
 
 
+def tar_sample_key(name: str) -> Tuple[str, str]:
+    """ Split a tar member name into its sample key and extension.
+
+        As in WebDataset, the sample key is the member path up to the first dot
+        of its basename, e.g. 'train/0001.seg.png' -> ('train/0001', 'seg.png').
+    """
+    dirname, _, basename = name.rpartition("/")
+    stem, _, ext = basename.partition(".")
+    return (dirname + "/" + stem if dirname else stem), ext
+
+
+def tar_sample_starts(objects: Iterable[DataObject]) -> array:
+    """ Find sample boundaries in a tar index.
+
+        Consecutive members sharing a sample key form one sample. The returned array
+        has one more entry than there are samples, sample i spans members [starts[i], starts[i + 1]).
+    """
+    starts = array('q')
+    last_key = None
+    member_num = 0
+    for obj in objects:
+        key, _ = tar_sample_key(obj.key)
+        if key != last_key:
+            starts.append(member_num)
+            last_key = key
+        member_num += 1
+    starts.append(member_num)
+    return starts
+
+
+def group_tar_samples(objects: Iterable[DataObject]) -> Iterator[Dict[str, Any]]:
+    """ Group consecutive tar members into samples.
+
+        Yields dicts with the sample key as '__key__' and one DataObject per extension,
+        e.g. {'__key__': '0001', 'jpg': DataObject, 'json': DataObject}.
+    """
+    sample = None
+    for obj in objects:
+        key, ext = tar_sample_key(obj.key)
+        if sample is None or sample["__key__"] != key:
+            if sample is not None:
+                yield sample
+            sample = {"__key__": key}
+        # the object holds a prefetch buffer of the stream, keep a copy like 'identity' does
+        sample[ext] = own_object(obj)
+    if sample is not None:
+        yield sample
+
+
+def tar_member_offsets(objects: Iterable[DataObject]) -> array:
+    """ Estimate the byte offsets of tar members from their sizes.
+
+        Each member occupies one header block followed by its data padded to the
+        tar block size. The returned array has one more entry than there are members,
+        member i spans [offsets[i], offsets[i + 1]).
+        Extended headers (e.g. long names) are not accounted for, so the result is
+        only suitable for gap estimation.
+    """
+    offsets = array('q', [0])
+    end = 0
+    for obj in objects:
+        blocks = (obj.size + TAR_BLOCK_SIZE - 1) // TAR_BLOCK_SIZE
+        end += TAR_BLOCK_SIZE * (blocks + 1)
+        offsets.append(end)
+    return offsets
+
+
+def plan_tar_chunks(indices: Iterable[int], max_gap: int = 0,
+                    offsets: Optional[Sequence[int]] = None) -> List[Tuple[int, int]]:
+    """ Plan ranged reads for a batch of tar member indices.
+
+        Indices are sorted and deduplicated, adjacent members are always merged into one chunk.
+        If 'offsets' (see 'tar_member_offsets') is given, members separated by no more than
+        'max_gap' bytes of unrequested members are merged as well, trading over-read bytes
+        for fewer requests.
+
+        Args:
+          indices: Tar member indices in any order, duplicates allowed.
+          max_gap(int): Maximum number of skipped bytes between two members of one chunk.
+          offsets: Member byte offsets, required for 'max_gap' to take effect.
+
+        Returns:
+          List of (start, length) chunks, sorted by start.
+    """
+    chunks = []
+    for i in sorted(set(indices)):
+        if chunks:
+            start, length = chunks[-1]
+            end = start + length
+            if i == end or (offsets is not None and offsets[i] - offsets[end] <= max_gap):
+                chunks[-1] = (start, i - start + 1)
+                continue
+        chunks.append((i, 1))
+    return chunks
+
+
 def generate_tar_archive(endpoint: str, cred_path: str, config_path: str, tar_path: str,
                          index_path: str, source_path: str, index_only: bool = False,
                          cred_provider: Any = None, region: str = ""):
@@ -90,3 +286,228 @@ def generate_tar_archive(endpoint: str, cred_path: str, config_path: str, tar_pa
         raise ValueError("neither cred_path nor cred_provider is specified")
     client = OssClient(endpoint, cred_path, config_path, cred_provider=cred_provider, region=region)
     return client.gen_tar_archive(tar_path, index_path, source_path, index_only)
+
+
+def split_tar_chunks(chunks: Iterable[Tuple[int, int]], shard_sizes: Sequence[int]) -> Iterator[Tuple[int, Tuple[int, int]]]:
+    """ Split (start, length) chunks over concatenated shards into per-shard chunks.
+
+        Yields (shard, (start, length)) with 'start' local to the shard, in the order of 'chunks'.
+    """
+    bounds = list(itertools.accumulate(shard_sizes))
+    for start, length in chunks:
+        end = start + length
+        while start < end:
+            shard = bisect.bisect_right(bounds, start)
+            if shard >= len(bounds):
+                raise IndexError("tar member index %d out of range" % start)
+            shard_start = bounds[shard] - shard_sizes[shard]
+            piece_end = min(end, bounds[shard])
+            yield shard, (start - shard_start, piece_end - start)
+            start = piece_end
+
+
+def _resolve_shard_path(base: str, path: str) -> str:
+    if path.startswith("oss://") or path.startswith("/"):
+        return path
+    return base + path
+
+
+def load_tar_manifest(client: OssClient, manifest_uri: str) -> List[Tuple[str, str, int]]:
+    """ Load a shard manifest generated by 'generate_tar_shards'.
+
+        Returns:
+          List of (tar_uri, tar_index_uri, member_num) of each shard.
+    """
+    bucket, key = parse_oss_uri(manifest_uri)
+    with client.get_object(bucket, key, type=0) as manifest_file:
+        manifest = json.loads(manifest_file.read())
+    base = manifest_uri[:manifest_uri.rfind("/") + 1]
+    shards = []
+    for shard in manifest.get("shards", []):
+        tar_uri = _resolve_shard_path(base, shard["tar"])
+        tar_index_uri = _resolve_shard_path(base, shard["index"])
+        if parse_oss_uri(tar_uri)[0] != parse_oss_uri(tar_index_uri)[0]:
+            raise ValueError("tar and index of shard must be in the same bucket")
+        shards.append((tar_uri, tar_index_uri, shard["members"]))
+    if not shards:
+        raise ValueError("no shard found in manifest %s" % manifest_uri)
+    log.info("load tar manifest %s, shard num: %d", manifest_uri, len(shards))
+    return shards
+
+
+def _list_tar_sources(client: OssClient, source_path: str) -> Iterator[Tuple[str, str, int]]:
+    # yields (member name, source path, size) of the source objects/files as they are listed
+    if source_path.startswith("oss://"):
+        bucket, prefix = parse_oss_uri(source_path)
+        base = prefix[:prefix.rfind("/") + 1]
+        for obj in client.list_objects(bucket, prefix):
+            _, key = parse_oss_uri(obj.key)
+            if key.endswith("/"):
+                continue
+            yield key[len(base):], "oss://%s/%s" % (bucket, key), obj.size
+    else:
+        for root, dirs, files in os.walk(source_path):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, source_path), path, os.path.getsize(path)
+
+
+def _plan_tar_shards(sources: Iterable[Tuple[str, str, int]], shard_size: int) -> Iterator[List[Tuple[str, str, int]]]:
+    # yields the sources of each shard once it is full, so that the listing is not held whole
+    current = []
+    current_size = 0
+    for source in sources:
+        blocks = (source[2] + TAR_BLOCK_SIZE - 1) // TAR_BLOCK_SIZE
+        member_size = TAR_BLOCK_SIZE * (blocks + 1)
+        if current and current_size + member_size > shard_size:
+            yield current
+            current = []
+            current_size = 0
+        current.append(source)
+        current_size += member_size
+    if current:
+        yield current
+
+
+def _open_output(client: OssClient, path: str):
+    if path.startswith("oss://"):
+        bucket, key = parse_oss_uri(path)
+        return client.put_object(bucket, key)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return open(path, "wb")
+
+
+def _read_tar_sources(client: OssClient, sources: List[Tuple[str, str, int]]) -> Iterator[Tuple[str, Any]]:
+    # yields (member name, readable object), OSS objects are prefetched concurrently by the native stream, which
+    # must be iterated on the thread which created it
+    if not sources[0][1].startswith("oss://"):
+        for name, path, _ in sources:
+            with open(path, "rb") as f:
+                yield name, f
+        return
+    names = {path: name for name, path, _ in sources}
+    objects = [new_data_object(path, size, "") for _, path, size in sources]
+    for obj in client.list_objects_from_uris(objects, prefetch=True, include_errors=True):
+        eno = obj.err()
+        if eno != 0:
+            raise RuntimeError("failed to read %s, errno=%d(%s), msg=%s" % (obj.key, eno, os.strerror(eno), obj.error_msg()))
+        bucket, key = parse_oss_uri(obj.key)
+        yield names["oss://%s/%s" % (bucket, key)], obj
+
+
+def _write_tar_shard(client: OssClient, output_path: str, shard: int, sources: List[Tuple[str, str, int]]) -> dict:
+    name = "shard-%06d" % shard
+    tar_path = output_path + name + ".tar"
+    index_path = output_path + name + ".idx"
+    log.info("write tar shard %s, member num: %d", tar_path, len(sources))
+    start_time = time.time()
+    sizes = {member: size for member, _, size in sources}
+    mtime = int(time.time())
+    # (offset, header) of each member, as written
+    headers = []
+    with _open_output(client, tar_path) as out:
+        with tarfile.open(fileobj=out, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+            for member, fileobj in _read_tar_sources(client, sources):
+                info = tarfile.TarInfo(member)
+                info.size = sizes[member]
+                info.mtime = mtime
+                headers.append((tar.offset, info.tobuf(tar.format, tar.encoding, tar.errors)))
+                tar.addfile(info, fileobj)
+        tar_size = tar.offset
+    _write_tar_index(client, index_path, headers, tar_size)
+    log.info("write tar shard %s done, time cost: %.2f s", tar_path, time.time() - start_time)
+    return {
+        "tar": name + ".tar",
+        "index": name + ".idx",
+        "members": len(sources),
+        "size": sum(sizes.values()),
+    }
+
+
+def _write_tar_index(client: OssClient, index_path: str, headers: List[Tuple[int, bytes]], tar_size: int):
+    # the index only locates member headers, so it is generated from a sparse local copy of the tar holding the
+    # headers written at their offsets, instead of reading the written tar again
+    with tempfile.NamedTemporaryFile(suffix=".tar") as skeleton:
+        for offset, header in headers:
+            skeleton.seek(offset)
+            skeleton.write(header)
+        skeleton.truncate(tar_size)
+        skeleton.flush()
+        client.gen_tar_archive(skeleton.name, index_path, "", True)
+
+
+def _write_tar_shard_process(endpoint: str, cred_path: str, config_path: str, cred_provider: Any, region: str,
+                             output_path: str, shard: int, sources: List[Tuple[str, str, int]]) -> dict:
+    # runs in a worker process started with 'spawn': the parent process used its native client to list the
+    # sources, so the worker builds its own client rather than inheriting a forked copy
+    client = OssClient(endpoint, cred_path, config_path, cred_provider=cred_provider, region=region)
+    return _write_tar_shard(client, output_path, shard, sources)
+
+
+def generate_tar_shards(endpoint: str, cred_path: str, config_path: str, source_path: str,
+                        output_path: str, shard_size: int = 1 << 30, num_workers: int = 8,
+                        cred_provider: Any = None, region: str = "") -> str:
+    """ Generate size-bounded tar shards with their indices and a shard manifest.
+
+        Source objects are listed once, split into shards of at most 'shard_size' bytes
+        (in listing order) and the shards are written in parallel by worker processes,
+        as native calls hold the GIL and native streams can not be shared by threads. Shards are
+        planned and submitted as the listing is streamed, at most two per worker ahead of the
+        writes. Workers are started with 'spawn', so 'cred_provider' must be picklable.
+        The index of each shard is generated from the member headers recorded while the shard
+        is written, the shard is not read again. The manifest
+        ('manifest.json' under 'output_path') can be passed as 'tar_uri' to
+        OssIterableDataset.from_tar/OssMapDataset.from_tar with an empty 'tar_index_uri'
+        to load all shards as one dataset.
+
+        Args:
+          endpoint(str): Endpoint of the OSS bucket where the objects are stored.
+          cred_path(str): Credential info of the OSS bucket where the objects are stored.
+          config_path(str): Configuration file path of the OSS connector.
+          source_path(str): Path to the source directory. (OSS URI or local path)
+          output_path(str): Directory of the shards and the manifest. (OSS URI or local path)
+          shard_size(int): Maximum size in bytes of each shard, a larger object takes a shard alone.
+          num_workers(int): Number of processes writing shards concurrently, 1 to write them in this process.
+          cred_provider: OSS credential provider.
+          region(str): OSS region.
+
+        Returns:
+          str: Path of the shard manifest.
+    """
+    if not endpoint:
+        raise ValueError("endpoint must be non-empty")
+    if not cred_path and not cred_provider:
+        raise ValueError("neither cred_path nor cred_provider is specified")
+    if not source_path:
+        raise ValueError("source_path must be non-empty")
+    if not output_path:
+        raise ValueError("output_path must be non-empty")
+    if shard_size <= 0:
+        raise ValueError("shard_size must be positive")
+    if not output_path.endswith("/"):
+        output_path += "/"
+    client = OssClient(endpoint, cred_path, config_path, cred_provider=cred_provider, region=region)
+    start_time = time.time()
+    groups = _plan_tar_shards(_list_tar_sources(client, source_path), shard_size)
+    if num_workers <= 1:
+        shards = [_write_tar_shard(client, output_path, i, group) for i, group in enumerate(groups)]
+    else:
+        shards = []
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = deque()
+            for i, group in enumerate(groups):
+                futures.append(executor.submit(_write_tar_shard_process, endpoint, cred_path, config_path,
+                                               cred_provider, region, output_path, i, group))
+                if len(futures) >= 2 * num_workers:
+                    shards.append(futures.popleft().result())
+            shards.extend(future.result() for future in futures)
+    if not shards:
+        raise FileNotFoundError(errno.ENOENT, "no source object found", source_path)
+    log.info("generate tar shards, object num: %d, shard num: %d",
+             sum(shard["members"] for shard in shards), len(shards))
+    manifest_path = output_path + TAR_MANIFEST_NAME
+    with _open_output(client, manifest_path) as manifest_file:
+        manifest_file.write(json.dumps({"version": 1, "shards": shards}, indent=2).encode("utf-8"))
+    log.info("generate tar shards done, manifest: %s, time cost: %.2f s", manifest_path, time.time() - start_time)
+    return manifest_path
@@ -0,0 +1,180 @@
+from typing import Iterator, Iterable, List, Dict, Callable, Any
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import itertools
+import threading
+import logging
+import time
+import os
+
+from ._oss_buffer import own_object
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_transform.py
+    Transform stages applied to DataObjects (or tar samples) yielded by
+    the dataset streams.
+"""
+
+class AdaptiveBatchSize:
+    """Batch size for 'batch_transform', adapted to the latency of each batch.
+
+    The size is doubled while a batch (waiting for objects plus transform) completes
+    well within 'latency_target' seconds, and halved when it exceeds the target, so that
+    per-call overhead is amortized without holding samples back for too long.
+    """
+
+    def __init__(self, max_size: int = 64, min_size: int = 1, latency_target: float = 0.05, initial_size: int = None):
+        if max_size < 1 or min_size < 1 or min_size > max_size:
+            raise ValueError("invalid batch size range [%d, %d]" % (min_size, max_size))
+        self.max_size = max_size
+        self.min_size = min_size
+        self.latency_target = latency_target
+        self.size = min(max(initial_size or min_size, min_size), max_size)
+
+    def update(self, latency: float):
+        if latency > self.latency_target:
+            self.size = max(self.min_size, self.size // 2)
+        elif latency < self.latency_target / 2:
+            self.size = min(self.max_size, self.size * 2)
+
+
+def copy_object(obj: Any) -> Any:
+    # objects hold prefetch buffers of the stream, batches hold copies like 'identity' does, so that 'identity'
+    # or the as_* helpers applied later do not copy them again
+    # (samples of tar shards hold owned objects already)
+    return own_object(obj)
+
+
+def iter_batches(objects: Iterable[Any], batch_size: AdaptiveBatchSize) -> Iterator[List[Any]]:
+    it = iter(objects)
+    while True:
+        batch = list(itertools.islice(it, batch_size.size))
+        if not batch:
+            return
+        yield batch
+
+
+def adaptive_batch_transform(batch_transform: Callable[[List[Any]], List[Any]],
+                             batch_size: AdaptiveBatchSize) -> Callable[[List[Any]], List[Any]]:
+    # adapts the batch size to the transform latency only, objects are received in the background
+    def transform(batch: List[Any]) -> List[Any]:
+        start_time = time.perf_counter()
+        samples = batch_transform(batch)
+        if len(samples) != len(batch):
+            raise ValueError("batch_transform returned %d samples for %d objects" % (len(samples), len(batch)))
+        batch_size.update(time.perf_counter() - start_time)
+        return samples
+    return transform
+
+
+def iter_batch_transformed(objects: Iterable[Any], batch_transform: Callable[[List[Any]], List[Any]],
+                           batch_size: AdaptiveBatchSize) -> Iterator[Any]:
+    """Applies 'batch_transform' to lists of objects and yields the transformed samples one by one."""
+    it = iter(objects)
+    while True:
+        start_time = time.perf_counter()
+        batch = list(itertools.islice(it, batch_size.size))
+        if not batch:
+            return
+        samples = batch_transform(batch)
+        if len(samples) != len(batch):
+            raise ValueError("batch_transform returned %d samples for %d objects" % (len(samples), len(batch)))
+        batch_size.update(time.perf_counter() - start_time)
+        log.debug("batch transform %d objects, next batch size: %d", len(batch), batch_size.size)
+        yield from samples
+
+
+class TransformPipeline:
+    """Runs transforms on a thread pool, decoupled from I/O.
+
+    Objects are pulled from the dataset stream on the calling thread, up to 'queue_depth'
+    ahead of the 'num_workers' threads running the transform, so that downloading and
+    decoding overlap within one DataLoader worker. Decoders releasing the GIL (PIL, torchvision.io, numpy)
+    scale with the number of threads. Objects are received and samples yielded in the order of the stream:
+    native prefetch streams deliver objects in order, on the thread which opened them.
+    """
+
+    def __init__(self, num_workers: int, queue_depth: int = 0):
+        if num_workers < 1:
+            raise ValueError("num_workers must be positive")
+        self.num_workers = num_workers
+        self.queue_depth = queue_depth if queue_depth > 0 else 2 * num_workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._stats = {"objects": 0, "io_wait_seconds": 0.0, "transform_seconds": 0.0, "max_queue_depth": 0}
+
+    def __getstate__(self):
+        # thread pool and locks do not survive pickling (spawned DataLoader workers)
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_pid"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # threads do not survive forking, create the pool in each process
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.num_workers, thread_name_prefix="oss-transform")
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+        return self._executor
+
+    def _add(self, name: str, value: float):
+        with self._lock:
+            self._stats[name] += value
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns counters of the pipeline: objects transformed, seconds spent waiting for objects
+        (I/O) and in transform (summed over threads), current and maximum queue depth."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._depth
+        stats["num_workers"] = self.num_workers
+        return stats
+
+    def _transform(self, fn: Callable[[Any], Any], unit: Any) -> Any:
+        start_time = time.perf_counter()
+        result = fn(unit)
+        self._add("transform_seconds", time.perf_counter() - start_time)
+        self._add("objects", len(unit) if isinstance(unit, list) else 1)
+        return result
+
+    def imap(self, fn: Callable[[Any], Any], units: Iterable[Any]) -> Iterator[Any]:
+        """Applies 'fn' to each unit on the thread pool, yielding results in input order. Units are pulled
+        on the calling thread while it waits for the next result."""
+        executor = self._get_executor()
+        # units are pulled on the calling thread, native prefetch streams can not be iterated on other threads
+        it = iter(units)
+        pending = deque()
+        done = False
+        try:
+            while True:
+                # keep the pool busy and up to 'queue_depth' units received ahead of it
+                while not done and len(pending) < self.queue_depth + self.num_workers:
+                    start_time = time.perf_counter()
+                    try:
+                        unit = next(it)
+                    except StopIteration:
+                        done = True
+                        break
+                    self._add("io_wait_seconds", time.perf_counter() - start_time)
+                    pending.append(executor.submit(self._transform, fn, unit))
+                    self._depth = max(0, len(pending) - self.num_workers)
+                    with self._lock:
+                        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._depth)
+                if not pending:
+                    return
+                yield pending.popleft().result()
+                self._depth = max(0, len(pending) - self.num_workers)
+        finally:
+            self._depth = 0
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,28 @@
+from functools import partial
+from typing import Callable
+import logging
+import torch.utils.data
+
+log = logging.getLogger(__name__)
+
+"""
+_oss_worker.py
+    DataLoader worker hooks.
+"""
+
+def _warmup_worker(n_connections: int, worker_init_fn: Callable[[int], None], worker_id: int):
+    dataset = torch.utils.data.get_worker_info().dataset
+    if hasattr(dataset, "warmup"):
+        report = dataset.warmup(n_connections)
+        log.info("worker %d warmup done: %s", worker_id, report)
+    if worker_init_fn is not None:
+        worker_init_fn(worker_id)
+
+
+def warmup_worker_init_fn(n_connections: int = 4, worker_init_fn: Callable[[int], None] = None) -> Callable[[int], None]:
+    """Returns a 'worker_init_fn' for DataLoader which builds the OSS client of each worker and pre-establishes
+    'n_connections' connections before the first batch, then calls 'worker_init_fn' if given.
+
+    Useful with 'persistent_workers=False', where workers (and their connections) are recreated every epoch.
+    """
+    return partial(_warmup_worker, n_connections, worker_init_fn)
@@ -1,6 +1,12 @@
 from ._oss_bucket_iterable import parse_oss_uri
-from ._oss_client import OssClient, DataObject
-from typing import Any
+from ._oss_client import DataObject, get_shared_client, release_shared_client, CHECKPOINT_CONFIG, PREFETCH_CONCURRENCY_LEVELS
+from ._oss_adaptive import AdaptiveController
+from ._oss_buffer import _readinto_full
+from ._oss_profiler import Profiler, CATEGORY_CPU, CATEGORY_IO
+from typing import Any, Dict
+import weakref
+import time
+import io
 
 class OssCheckpoint:
     """A checkpoint manager for OSS.
@@ -18,6 +24,7 @@ class OssCheckpoint:
         config_path: str = "",
         cred_provider: Any = None,
         region: str = "",
+        profiler: Profiler = None,
     ):
         """
         Initialize an OSSCheckpoint for reading/writing checkpoints.
@@ -28,6 +35,7 @@ class OssCheckpoint:
             config_path(str): Configuration file path of the OSS connector.
             cred_provider: OSS credential provider.
             region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+            profiler(Profiler): Optional profiler recording opens, ranged reads and deserialization as Chrome trace events.
         """
         if not endpoint:
             raise ValueError("endpoint must be non-empty")
@@ -43,7 +51,12 @@ class OssCheckpoint:
             self._config_path = config_path
         self._cred_provider = cred_provider
         self._region = region
-        self._client = OssClient(self._endpoint, self._cred_path, self._config_path, cred_provider=self._cred_provider, region=self._region)
+        self._client = get_shared_client(self._endpoint, self._cred_path, self._config_path, cred_provider=self._cred_provider, region=self._region)
+        weakref.finalize(self, release_shared_client, self._client)
+        # each read is a window, the prefetch concurrency moves between the levels of native clients
+        self._read_controller = AdaptiveController(initial_limit=0, max_limit=PREFETCH_CONCURRENCY_LEVELS[-1],
+                                                   window=1, sequential=True, levels=PREFETCH_CONCURRENCY_LEVELS)
+        self._profiler = profiler
 
     def reader(self, oss_uri: str):
         """Creates an DataObject from a given oss_uri.
@@ -55,7 +68,10 @@ class OssCheckpoint:
             DataObject: a read-only binary stream of the OSS object's contents, specified by the oss_uri.
         """
         bucket, key = parse_oss_uri(oss_uri)
-        return self._client.get_object(bucket, key, type=1)
+        if self._profiler is None:
+            return self._client.get_object(bucket, key, type=1)
+        with self._profiler.span("open", CATEGORY_IO, {"key": oss_uri}):
+            return self._client.get_object(bucket, key, type=1)
 
     def writer(self, oss_uri: str) -> DataObject:
         """Creates an DataObject from a given oss_uri.
@@ -68,3 +84,47 @@ class OssCheckpoint:
         """
         bucket, key = parse_oss_uri(oss_uri)
         return self._client.put_object(bucket, key)
+
+    def read(self, oss_uri: str) -> bytearray:
+        """Reads a whole object into one buffer.
+
+        The object is read with one prefetching stream, whose prefetch concurrency (checkpointConfig.prefetchConcurrency)
+        adapts from read to read to the observed throughput and errors (AIMD), see 'read_stats'. Streams of 'reader'
+        and other requests use the configured concurrency.
+
+        Args:
+            oss_uri (str): A valid oss_uri. (i.e. oss://<BUCKET>/<KEY>)
+
+        Returns:
+            bytearray: the content of the OSS object.
+        """
+        bucket, key = parse_oss_uri(oss_uri)
+        controller = self._read_controller
+        controller.start(self._client.prefetch_concurrency(CHECKPOINT_CONFIG))
+        start_time = time.perf_counter()
+        try:
+            size = self._client.head_object(bucket, key).size
+            with self._client.open_prefetched(bucket, key, size, controller.limit) as obj:
+                buffer = bytearray(size)
+                _readinto_full(obj, memoryview(buffer), size)
+        except Exception:
+            controller.record(0, time.perf_counter() - start_time, error=True)
+            raise
+        controller.record(size, time.perf_counter() - start_time)
+        if self._profiler is not None:
+            self._profiler.complete("read", CATEGORY_IO, start_time, time.perf_counter(), {"key": oss_uri, "size": size})
+        return buffer
+
+    def load(self, oss_uri: str, **kwargs) -> Any:
+        """Loads a checkpoint read by 'read' with torch.load, 'kwargs' are passed to torch.load."""
+        import torch
+        buffer = self.read(oss_uri)
+        if self._profiler is None:
+            return torch.load(io.BytesIO(buffer), **kwargs)
+        with self._profiler.span("deserialize", CATEGORY_CPU, {"key": oss_uri, "size": len(buffer)}):
+            return torch.load(io.BytesIO(buffer), **kwargs)
+
+    def read_stats(self) -> Dict[str, Any]:
+        """Returns the state of the adaptive read controller: prefetch concurrency ('limit'), throughput and counters."""
+        return self._read_controller.stats()
+
@@ -1,11 +1,14 @@
 import io
 import logging
 import os
+import time
+import weakref
 from contextlib import contextmanager
 from pathlib import Path
 from typing import Generator, Union, Any
-from ._oss_client import OssClient
+from ._oss_client import get_shared_client, release_shared_client
 from ._oss_bucket_iterable import parse_oss_uri
+from ._oss_profiler import Profiler, CATEGORY_BATCH, CATEGORY_IO
 
 
 from torch.distributed.checkpoint.filesystem import (
@@ -78,6 +81,7 @@ class OssFileSystem(FileSystemBase):
         config_path: str = "",
         cred_provider: Any = None,
         region: str = "",
+        profiler: Profiler = None,
     ):
         """
         Initialize an OSS FileSystem for distributed checkpointing.
@@ -88,6 +92,7 @@ class OssFileSystem(FileSystemBase):
             config_path (str): Configuration file path of the OSS connector.
             cred_provider: OSS credential provider.
             region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+            profiler(Profiler): Optional profiler recording the opens and the lifetime of read streams as Chrome trace events.
         """
         if not endpoint:
             raise ValueError("endpoint must be non-empty")
@@ -103,8 +108,10 @@ class OssFileSystem(FileSystemBase):
             self._config_path = config_path
         self._cred_provider = cred_provider
         self._region = region
-        self._client = OssClient(self._endpoint, self._cred_path, self._config_path, cred_provider=self._cred_provider, region=self._region)
+        self._client = get_shared_client(self._endpoint, self._cred_path, self._config_path, cred_provider=self._cred_provider, region=self._region)
+        weakref.finalize(self, release_shared_client, self._client)
         self._path: Union[str, os.PathLike] = ""
+        self._profiler = profiler
 
     @contextmanager
     def create_stream(
@@ -119,8 +126,15 @@ class OssFileSystem(FileSystemBase):
                 yield stream
         elif mode == "rb":
             logger.debug("create_stream readable for %s", path_str)
+            start_time = time.perf_counter()
             with self._client.get_object(bucket, key, type=1) as stream:
-                yield stream
+                if self._profiler is None:
+                    yield stream
+                    return
+                self._profiler.complete("open", CATEGORY_IO, start_time, time.perf_counter(), {"key": path_str})
+                # reads and deserialization by the checkpoint reader happen within the stream
+                with self._profiler.span("stream", CATEGORY_BATCH, {"key": path_str}):
+                    yield stream
         else:
             raise ValueError(
                 f"Invalid mode argument: only rb/wb are supported"
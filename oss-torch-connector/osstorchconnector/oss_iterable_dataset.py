@@ -1,14 +1,21 @@
 from functools import partial
-from typing import Iterator, Any, Union, Iterable, Callable, Tuple
+from typing import Iterator, Any, Union, Iterable, Callable, Tuple, List, Dict
+import itertools
 import io
 import torch.utils.data
+import weakref
 import uuid
 import logging
 import random
+import os
 
-from ._oss_client import OssClient, DataObject
-from ._oss_bucket_iterable import OssBucketIterable, identity
+from ._oss_client import OssClient, DataObject, get_shared_client, release_shared_client
+from ._oss_bucket_iterable import OssBucketIterable, identity, parse_oss_uri
 from ._oss_tar_iterable import OssTarIterable
+from ._oss_batch import BatchBufferPool
+from ._oss_metrics import StatsPublisher, iter_published, merge_stats
+from ._oss_profiler import Profiler
+from ._oss_transform import AdaptiveBatchSize, TransformPipeline, copy_object, iter_batches, iter_batch_transformed, adaptive_batch_transform
 
 log = logging.getLogger(__name__)
 
@@ -17,6 +24,18 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
 
     To create an instance of OssIterableDataset, you need to use
     `from_prefix`, `from_objects`, `from_manifest_file` or `from_tar` methods.
+
+    Options, accepted as keyword arguments by all of these methods:
+      batch_transform: Optional callable which transforms a list of DataObjects into a list of samples, used instead of 'transform'.
+                       The number of objects per call adapts to the latency of each call, up to 'max_batch_transform_size'.
+      max_batch_transform_size(int): Maximum number of objects passed to 'batch_transform' at once.
+      num_transform_workers(int): Number of threads running 'transform' (or 'batch_transform') in each process, overlapping
+                                  decoding with downloading. 0 runs the transform inline.
+      transform_queue_depth(int): Maximum number of objects received ahead of the transform threads, 0 for 2 * num_transform_workers.
+      batch_buffer_pool(BatchBufferPool): Optional pool of batch buffers. If set, objects are read directly into one buffer per 'batch_size'
+                                          objects of the pool and PackedBatches are yielded instead of transformed samples.
+      profiler(Profiler): Optional profiler recording the timings of samples (waits for objects, transforms, batches)
+                          as Chrome trace events, see 'Profiler'.
     """
 
     def __init__(
@@ -31,6 +50,13 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
         shuffle: bool = False,
         shuffle_chunk_size: int = 1000,
         region: str = "",
+        group_samples: bool = False,
+        batch_transform: Callable[[List[DataObject]], List[Any]] = None,
+        max_batch_transform_size: int = 64,
+        num_transform_workers: int = 0,
+        transform_queue_depth: int = 0,
+        batch_buffer_pool: BatchBufferPool = None,
+        profiler: Profiler = None,
     ):
         self._uuid = uuid.uuid4()
         self._endpoint = endpoint
@@ -46,19 +72,43 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
             self._config_path = ""
         else:
             self._config_path = config_path
+        self._region = region
         self._get_dataset_objects = get_dataset_objects
+        self._profiler = profiler
+        if profiler is not None:
+            if transform is not identity:
+                transform = profiler.traced(transform, "transform")
+            if batch_transform is not None:
+                batch_transform = profiler.traced(batch_transform, "batch_transform")
         self._transform = transform
+        self._batch_transform = batch_transform
+        self._batch_size = AdaptiveBatchSize(max_batch_transform_size)
+        if batch_buffer_pool is not None and (batch_buffer_pool.batch_size <= 0 or group_samples):
+            raise ValueError("batch_buffer_pool requires a positive batch_size and can not be used with group_samples")
+        self._batch_buffer_pool = batch_buffer_pool
+        if num_transform_workers > 0:
+            self._pipeline = TransformPipeline(num_transform_workers, transform_queue_depth)
+        else:
+            self._pipeline = None
         self._client = None
+        self._client_pid = None
+        # workers publish the stats of their clients, aggregated by 'get_stats'
+        self._stats_publisher = StatsPublisher.for_dataset(self._uuid)
+        weakref.finalize(self, self._stats_publisher.remove)
         self._from_tar = from_tar
         self._shuffle = shuffle
         self._chunk_size = shuffle_chunk_size
-        if from_tar and shuffle:
+        self._group_samples = group_samples
+        if from_tar and (shuffle or group_samples):
+            # samples are assigned to workers by chunks, so that a sample is never split between workers
             self._bucket_objects = self._get_dataset_objects(self._get_client(0, 1), preload=False)
             self._dataset_size = len(self._bucket_objects)
-            self.shuffle()
+            if shuffle:
+                self.shuffle()
+            else:
+                self._chunks = self._get_chunks()
         else:
             self._bucket_objects = None
-        self._region = region
 
     @classmethod
     def from_objects(
@@ -71,6 +121,7 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
         config_path: str = "",
         transform: Callable[[DataObject], Any] = identity,
         region: str = "",
+        **options,
     ):
         """Returns an instance of OssIterableDataset using the OSS URI(s) provided.
 
@@ -82,6 +133,7 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
           transform: Optional callable which is used to transform an DataObject into the desired type.
           cred_provider: OSS credential provider.
           region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+          options: Options of the dataset, see 'OssIterableDataset'.
 
         Returns:
             OssIterableDataset: An IterableStyle dataset created from OSS objects.
@@ -89,7 +141,8 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
         log.info(f"Building {cls.__name__} from_objects")
         return cls(
             endpoint, cred_path, config_path, partial(OssBucketIterable.from_uris, object_uris, preload=True),
-            transform=transform, cred_provider=cred_provider, region = region
+            transform=transform, cred_provider=cred_provider, region = region,
+            **options,
         )
 
     @classmethod
@@ -103,6 +156,7 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
         config_path: str = "",
         transform: Callable[[DataObject], Any] = identity,
         region: str = "",
+        **options,
     ):
         """Returns an instance of OssIterableDataset using the OSS URI provided.
 
@@ -114,6 +168,7 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
           transform: Optional callable which is used to transform an DataObject into the desired type.
           cred_provider: OSS credential provider.
           region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+          options: Options of the dataset, see 'OssIterableDataset'.
 
         Returns:
             OssIterableDataset: An IterableStyle dataset created from OSS objects.
@@ -121,7 +176,8 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
         log.info(f"Building {cls.__name__} from_prefix")
         return cls(
             endpoint, cred_path, config_path, partial(OssBucketIterable.from_prefix, oss_uri, preload=True),
-            transform=transform, cred_provider=cred_provider, region=region
+            transform=transform, cred_provider=cred_provider, region=region,
+            **options,
         )
 
     @classmethod
@@ -137,6 +193,7 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
         config_path: str = "",
         transform: Callable[[DataObject], Any] = identity,
         region: str = "",
+        **options,
     ):
         """Returns an instance of OssIterableDataset using manifest file provided.
 
@@ -150,6 +207,7 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
           transform: Optional callable which is used to transform an DataObject into the desired type.
           cred_provider: OSS credential provider.
           region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+          options: Options of the dataset, see 'OssIterableDataset'.
 
         Returns:
             OssIterableDataset: An IterableStyle dataset created from OSS objects.
@@ -157,7 +215,8 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
         log.info(f"Building {cls.__name__} from_manifest_file")
         return cls(
             endpoint, cred_path, config_path, partial(OssBucketIterable.from_manifest_file, manifest_file_path, manifest_parser, oss_base_uri, preload=True),
-            transform=transform, cred_provider=cred_provider, region=region
+            transform=transform, cred_provider=cred_provider, region=region,
+            **options,
         )
 
     @classmethod
@@ -174,12 +233,14 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
         shuffle: bool = False,
         shuffle_chunk_size: int = 1000,
         region: str = "",
+        group_samples: bool = False,
+        **options,
     ):
         """Returns an instance of OssIterableDataset using tar file provided.
 
         Args:
-          tar_uri(str): OSS URI of tar archive.
-          tar_index_uri(str): OSS URI of tar index file corresponding to tar archive.
+          tar_uri(str): OSS URI of tar archive, or of a shard manifest generated by 'generate_tar_shards'.
+          tar_index_uri(str): OSS URI of tar index file corresponding to tar archive. Must be empty if 'tar_uri' is a shard manifest.
           shuffle(bool): Whether to shuffle the dataset.
           shuffle_chunk_size(int): Size of chunks to shuffle over.
           endpoint(str): Endpoint of the OSS bucket where the objects are stored.
@@ -187,23 +248,31 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
           config_path(str): Configuration file path of the OSS connector.
           transform: Optional callable which is used to transform an DataObject into the desired type.
           cred_provider: OSS credential provider.
+          group_samples(bool): Whether to group members sharing a sample key (e.g. '0001.jpg' and '0001.json') into one sample,
+                               which is passed to transform as a dict keyed by extension, with the sample key as '__key__'.
+                               Shuffle and worker assignment then operate on samples.
+          options: Options of the dataset, see 'OssIterableDataset'.
 
         Returns:
             OssIterableDataset: An IterableStyle dataset created from tar file.
         """
         log.info(f"Building {cls.__name__} from_tar")
         return cls(
-            endpoint, cred_path, config_path, partial(OssTarIterable.from_tar, tar_uri, tar_index_uri, preload=True),
+            endpoint, cred_path, config_path,
+            partial(OssTarIterable.from_tar, tar_uri, tar_index_uri, preload=True, group_samples=group_samples),
             transform=transform, cred_provider=cred_provider, from_tar=True, shuffle=shuffle, shuffle_chunk_size=shuffle_chunk_size,
-            region=region,
+            region=region, group_samples=group_samples,
+            **options,
         )
 
     def _get_client(self, id, total):
-        if self._client is None:
-            self._client = OssClient(self._endpoint, self._cred_path, self._config_path, self._uuid, id, total, cred_provider=self._cred_provider, region=self._region)
-            log.info("OssIterableDataset new client")
-        self._client._id = id
-        self._client._total = total
+        # the shared client of this process for worker 'id' of 'total', a copy from another process is not used
+        if self._client is None or self._client_pid != os.getpid() or (self._client._id, self._client._total) != (id, total):
+            self._client = get_shared_client(self._endpoint, self._cred_path, self._config_path, self._cred_provider,
+                                             self._region, id, total, str(self._uuid))
+            weakref.finalize(self, release_shared_client, self._client)
+            self._client_pid = os.getpid()
+            log.info("OssIterableDataset get shared client, id %d, total %d", id, total)
         return self._client
 
     def _get_transformed_object(self, object: DataObject) -> Any:
@@ -214,20 +283,32 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
 
         if worker_info is None:     # single-process data loading, return the full iterator
             log.info("OssIterableDataset get iter (single-process)")
-            if self._from_tar and self._shuffle:
+            if self._from_tar and (self._shuffle or self._group_samples):
                 if len(self._chunks) >= 1:
                     chunks = self._chunks
                 else:
                     chunks = []
                 log.info("OssIterableDataset chunk num: %d", len(chunks))
-                worker_iter = self._get_dataset_objects(self._get_client(0, 1), chunks=chunks)
+                if self._group_samples:
+                    worker_iter = self._get_dataset_objects(self._get_client(0, 1), chunks=chunks,
+                                                            sample_starts=self._bucket_objects.sample_starts())
+                else:
+                    worker_iter = self._get_dataset_objects(self._get_client(0, 1), chunks=chunks)
             else:
                 worker_iter = self._get_dataset_objects(self._get_client(0, 1))
         else:                       # in a worker process, split workload
             num_workers = worker_info.num_workers
             worker_id = worker_info.id
             log.info("OssIterableDataset get iter (multi-process), num_workers: %d, worker id: %d", num_workers, worker_id)
-            if self._from_tar and self._shuffle:
+            if self._from_tar and self._group_samples:
+                chunks = [chunk for i, chunk in enumerate(self._chunks) if i % num_workers == worker_id]
+                log.info("OssIterableDataset chunk num: %d", len(chunks))
+                if not chunks:
+                    return iter([])
+                # sample boundaries are computed once in the main process
+                worker_iter = self._get_dataset_objects(self._get_client(worker_id, num_workers), chunks=chunks,
+                                                        sample_starts=self._bucket_objects.sample_starts())
+            elif self._from_tar and self._shuffle:
                 if len(self._chunks) >= num_workers:
                     chunks = [chunk for i, chunk in enumerate(self._chunks) if i % num_workers == worker_id]
                 else:
@@ -237,7 +318,65 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
             else:
                 worker_iter = self._get_dataset_objects(self._get_client(worker_id, num_workers))
 
-        return map(self._get_transformed_object, worker_iter)
+        if self._profiler is not None:
+            worker_iter = self._profiler.iter_waits(worker_iter)
+        if self._batch_buffer_pool is not None:
+            items = self._iter_packed(worker_iter)
+        elif self._pipeline is not None:
+            # objects are held in the queue beyond the next read of the stream, so they are copied
+            if self._batch_transform is not None:
+                batches = iter_batches(map(copy_object, worker_iter), self._batch_size)
+                transform = adaptive_batch_transform(self._batch_transform, self._batch_size)
+                items = itertools.chain.from_iterable(self._pipeline.imap(transform, batches))
+            else:
+                items = self._pipeline.imap(self._get_transformed_object, map(copy_object, worker_iter))
+        elif self._batch_transform is not None:
+            items = iter_batch_transformed(map(copy_object, worker_iter), self._batch_transform, self._batch_size)
+        else:
+            items = map(self._get_transformed_object, worker_iter)
+        if self._profiler is not None:
+            items = self._profiler.iter_yields(items)
+        if worker_info is not None:
+            return iter_published(items, self._stats_publisher, self._client.get_stats)
+        return items
+
+    def _iter_packed(self, objects: Iterable[DataObject]) -> Iterator[Any]:
+        # each object is read into the buffer before the stream moves to the next one
+        it = iter(objects)
+        while True:
+            batch = self._batch_buffer_pool.pack((object, True) for object in itertools.islice(it, self._batch_buffer_pool.batch_size))
+            if len(batch) == 0:
+                return
+            yield batch
+
+    def warmup(self, n_connections: int = 4) -> Dict[str, float]:
+        """Builds the client of this process and pre-establishes 'n_connections' connections, see 'OssClient.warmup'.
+        Objects of prefix datasets are unknown before iteration, only the client is built for them."""
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is None:
+            client = self._get_client(0, 1)
+        else:
+            client = self._get_client(worker_info.id, worker_info.num_workers)
+        if self._bucket_objects is not None:
+            bucket, key = parse_oss_uri(self._bucket_objects.shards[0][0])
+        else:
+            bucket, key = "", ""
+        return client.warmup(n_connections, bucket, key)
+
+    def pipeline_stats(self) -> Dict[str, Any]:
+        """Returns queue depth and stage timings of the transform threads in this process,
+        empty if 'num_transform_workers' is 0."""
+        if self._pipeline is None:
+            return {}
+        return self._pipeline.stats()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns the metrics of the client of this process and of DataLoader workers, see 'OssClient.get_stats'.
+        Workers publish their metrics at most once per second and when their iterator is exhausted."""
+        snapshots = self._stats_publisher.collect(exclude_pid=os.getpid())
+        if self._client is not None:
+            snapshots.append(self._client.get_stats())
+        return merge_stats(snapshots)
 
     def shuffle(self, generator=None):
         if generator is None:
@@ -245,13 +384,18 @@ class OssIterableDataset(torch.utils.data.IterableDataset):
             generator = torch.Generator()
             generator.manual_seed(seed)
             log.debug("OssIterableDataset shuffle seed: %d", seed)
+        chunks = self._get_chunks(jitter=True)
+        random_sampler = torch.utils.data.SubsetRandomSampler(chunks, generator=generator)
+        self._chunks = list(random_sampler)
+        log.info("OssIterableDataset shuffle chunk indices, dataset size: %d, chunk num: %d",
+                 self._dataset_size, len(self._chunks))
+
+    def _get_chunks(self, jitter: bool = False) -> List[Tuple[int, int]]:
         chunks = []
         index = 0
         while index < self._dataset_size:
-            chunk_size = min(max(1, int(random.gauss(self._chunk_size, 10))), self._dataset_size - index)
+            chunk_size = int(random.gauss(self._chunk_size, 10)) if jitter else self._chunk_size
+            chunk_size = min(max(1, chunk_size), self._dataset_size - index)
             chunks.append((index, chunk_size))
             index += chunk_size
-        random_sampler = torch.utils.data.SubsetRandomSampler(chunks, generator=generator)
-        self._chunks = list(random_sampler)
-        log.info("OssIterableDataset shuffle chunk indices, dataset size: %d, chunk num: %d",
-                 self._dataset_size, len(self._chunks))
+        return chunks
@@ -1,16 +1,26 @@
 from functools import partial
-from typing import List, Any, Callable, Iterable, Union, Tuple
+from itertools import accumulate, chain
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Union, Tuple
+import bisect
 import io
 import torch.utils.data
+import weakref
 import uuid
 import logging
 import time
 import os
 import errno
 
-from ._oss_client import OssClient, DataObject
+from ._oss_client import OssClient, DataObject, DATASET_CONFIG, PREFETCH_CONCURRENCY_LEVELS, get_shared_client, release_shared_client
 from ._oss_bucket_iterable import OssBucketIterable, identity, parse_oss_uri
-from ._oss_tar_iterable import OssTarIterable
+from ._oss_tar_iterable import OssTarIterable, plan_tar_chunks, tar_member_offsets, tar_sample_key
+from ._oss_hedge import HedgePolicy
+from ._oss_adaptive import AdaptiveController, record_stream
+from ._oss_batch import BatchBufferPool, PackedBatch
+from ._oss_buffer import own_object
+from ._oss_metrics import StatsPublisher, merge_stats
+from ._oss_profiler import Profiler, CATEGORY_BATCH, CATEGORY_IO
+from ._oss_transform import AdaptiveBatchSize, TransformPipeline, iter_batches, iter_batch_transformed, adaptive_batch_transform
 
 log = logging.getLogger(__name__)
 
@@ -19,6 +29,23 @@ class OssMapDataset(torch.utils.data.Dataset):
 
     To create an instance of OssMapDataset, you need to use
     `from_prefix`, `from_objects`, `from_manifest_file` or `from_tar` methods.
+
+    Options, accepted as keyword arguments by all of these methods:
+      batch_transform: Optional callable which transforms a list of DataObjects into a list of samples, used instead of 'transform'.
+                       The number of objects per call adapts to the latency of each call, up to 'max_batch_transform_size'.
+      max_batch_transform_size(int): Maximum number of objects passed to 'batch_transform' at once.
+      num_transform_workers(int): Number of threads running 'transform' (or 'batch_transform') in each process, overlapping
+                                  decoding with downloading. 0 runs the transform inline.
+      transform_queue_depth(int): Maximum number of objects received ahead of the transform threads, 0 for 2 * num_transform_workers.
+      batch_buffer_pool(BatchBufferPool): Optional pool of batch buffers. If set, '__getitems__' reads the objects of a batch directly into one
+                                          buffer and returns a PackedBatch instead of transformed samples, use 'packed_collate' as 'collate_fn'.
+      hedge_policy(HedgePolicy): Optional policy of hedged requests. Objects of a batch are fetched by worker processes,
+                                 and requested again once slower than the observed fetches, within a budget, see 'hedge_stats'.
+      adaptive_prefetch(bool): Whether the prefetch concurrency of batches (datasetConfig.prefetchConcurrency) adapts to their
+                               throughput in each process, see 'prefetch_stats'. The streams of batches are read by native
+                               clients of the adapted values, see 'OssClient.list_objects_from_uris'.
+      profiler(Profiler): Optional profiler recording the timings of samples (waits for objects, transforms, batches)
+                          as Chrome trace events, see 'Profiler'.
     """
 
     def __init__(
@@ -32,6 +59,16 @@ class OssMapDataset(torch.utils.data.Dataset):
         tar_index_uri: str = None,
         cred_provider: Any = None,
         region: str = "",
+        tar_coalesce_gap: int = 0,
+        group_samples: bool = False,
+        batch_transform: Callable[[List[DataObject]], List[Any]] = None,
+        max_batch_transform_size: int = 64,
+        num_transform_workers: int = 0,
+        transform_queue_depth: int = 0,
+        batch_buffer_pool: BatchBufferPool = None,
+        hedge_policy: HedgePolicy = None,
+        adaptive_prefetch: bool = False,
+        profiler: Profiler = None,
     ):
         self._uuid = uuid.uuid4()
         self._endpoint = endpoint
@@ -49,21 +86,60 @@ class OssMapDataset(torch.utils.data.Dataset):
         else:
             self._config_path = config_path
         self._get_dataset_objects = get_dataset_objects
+        self._profiler = profiler
+        if profiler is not None:
+            if transform is not identity:
+                transform = profiler.traced(transform, "transform")
+            if batch_transform is not None:
+                batch_transform = profiler.traced(batch_transform, "batch_transform")
         self._transform = transform
+        self._batch_transform = batch_transform
+        # objects of a batch are already received, start from the largest calls
+        self._batch_size = AdaptiveBatchSize(max_batch_transform_size, initial_size=max_batch_transform_size)
+        if num_transform_workers > 0:
+            self._pipeline = TransformPipeline(num_transform_workers, transform_queue_depth)
+        else:
+            self._pipeline = None
+        if batch_buffer_pool is not None and (group_samples or batch_transform is not None):
+            raise ValueError("batch_buffer_pool can not be used with group_samples or batch_transform")
+        self._batch_buffer_pool = batch_buffer_pool
+        self._hedge_policy = hedge_policy
+        if adaptive_prefetch and hedge_policy is not None:
+            raise ValueError("adaptive_prefetch can not be used with hedge_policy")
+        self._prefetch_controller = None
+        if adaptive_prefetch:
+            # a window of two batches, the concurrency moves between the levels of native clients
+            self._prefetch_controller = AdaptiveController(initial_limit=0, max_limit=PREFETCH_CONCURRENCY_LEVELS[-1],
+                                                           window=2, sequential=True, levels=PREFETCH_CONCURRENCY_LEVELS)
+        # transform items once received, by batches or on the transform threads
+        self._defer_transform = batch_transform is not None or self._pipeline is not None
         self._region = region
         self._client = None
         self._client_pid = None
+        # workers publish the stats of their clients, aggregated by 'get_stats'
+        self._stats_publisher = StatsPublisher.for_dataset(self._uuid)
+        weakref.finalize(self, self._stats_publisher.remove)
         self._from_tar = False
-        if tar_uri and tar_index_uri:
-            tar_bucket, tar_key = parse_oss_uri(tar_uri)
-            index_bucket, index_key = parse_oss_uri(tar_index_uri)
-            if tar_bucket != index_bucket:
-                raise ValueError("tar_uri and tar_index_uri must be in the same bucket")
+        self._tar_coalesce_gap = tar_coalesce_gap
+        self._tar_offsets = {}
+        self._group_samples = group_samples
+        if tar_uri:
             self._from_tar = True
-            self._tar_bucket = tar_bucket
-            self._tar_key = tar_key
-            self._tar_index_key = index_key
             self._bucket_objects = self._get_dataset_objects(self._get_client())
+            self._tar_shards = []
+            for shard_tar_uri, shard_index_uri in self._bucket_objects.shards:
+                tar_bucket, tar_key = parse_oss_uri(shard_tar_uri)
+                index_bucket, index_key = parse_oss_uri(shard_index_uri)
+                if tar_bucket != index_bucket:
+                    raise ValueError("tar_uri and tar_index_uri must be in the same bucket")
+                self._tar_shards.append((tar_bucket, tar_key, index_key))
+            # dataset indices are samples if grouping, otherwise tar members
+            if group_samples:
+                self._tar_shard_starts = [0] + list(accumulate(self._bucket_objects.sample_sizes()))[:-1]
+            elif len(self._tar_shards) > 1:
+                self._tar_shard_starts = [0] + list(accumulate(self._bucket_objects.shard_sizes()))[:-1]
+            else:
+                self._tar_shard_starts = [0]
         else:
             self._bucket_objects = list(self._get_dataset_objects(self._get_client()))
         log.info("OssMapDataset init done, uuid: %s, time cost: %.2f s", self._uuid, time.time() - init_time)
@@ -87,6 +163,7 @@ class OssMapDataset(torch.utils.data.Dataset):
         config_path: str = "",
         transform: Callable[[DataObject], Any] = identity,
         region: str = "",
+        **options,
     ):
         """Returns an instance of OssMapDataset using the OSS URI(s) provided.
 
@@ -98,6 +175,7 @@ class OssMapDataset(torch.utils.data.Dataset):
           transform: Optional callable which is used to transform an DataObject into the desired type.
           cred_provider: OSS credential provider.
           region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+          options: Options of the dataset, see 'OssMapDataset'.
 
         Returns:
             OssMapDataset: A Map-Style dataset created from OSS objects.
@@ -105,7 +183,8 @@ class OssMapDataset(torch.utils.data.Dataset):
         log.info(f"Building {cls.__name__} from_objects")
         return cls(
             endpoint, cred_path, config_path, partial(OssBucketIterable.from_uris, object_uris, preload=False),
-            transform=transform, cred_provider=cred_provider, region=region
+            transform=transform, cred_provider=cred_provider, region=region,
+            **options,
         )
 
     @classmethod
@@ -119,6 +198,7 @@ class OssMapDataset(torch.utils.data.Dataset):
         config_path: str = "",
         transform: Callable[[DataObject], Any] = identity,
         region: str = "",
+        **options,
     ):
         """Returns an instance of OssMapDataset using the OSS URI provided.
 
@@ -130,6 +210,7 @@ class OssMapDataset(torch.utils.data.Dataset):
           transform: Optional callable which is used to transform an DataObject into the desired type.
           cred_provider: OSS credential provider.
           region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+          options: Options of the dataset, see 'OssMapDataset'.
 
         Returns:
             OssMapDataset: A Map-Style dataset created from OSS objects.
@@ -137,7 +218,8 @@ class OssMapDataset(torch.utils.data.Dataset):
         log.info(f"Building {cls.__name__} from_prefix")
         return cls(
             endpoint, cred_path, config_path, partial(OssBucketIterable.from_prefix, oss_uri, preload=False),
-            transform=transform, cred_provider=cred_provider, region=region
+            transform=transform, cred_provider=cred_provider, region=region,
+            **options,
         )
 
     @classmethod
@@ -153,6 +235,7 @@ class OssMapDataset(torch.utils.data.Dataset):
         config_path: str = "",
         transform: Callable[[DataObject], Any] = identity,
         region: str = "",
+        **options,
     ):
         """Returns an instance of OssMapDataset using manifest file provided.
 
@@ -166,6 +249,7 @@ class OssMapDataset(torch.utils.data.Dataset):
           transform: Optional callable which is used to transform an DataObject into the desired type.
           cred_provider: OSS credential provider.
           region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+          options: Options of the dataset, see 'OssMapDataset'.
 
         Returns:
             OssMapDataset: A Map-Style dataset created from OSS objects.
@@ -173,7 +257,8 @@ class OssMapDataset(torch.utils.data.Dataset):
         log.info(f"Building {cls.__name__} from_manifest_file")
         return cls(
             endpoint, cred_path, config_path, partial(OssBucketIterable.from_manifest_file, manifest_file_path, manifest_parser, oss_base_uri, preload=False),
-            transform=transform, cred_provider=cred_provider, region=region
+            transform=transform, cred_provider=cred_provider, region=region,
+            **options,
         )
 
     @classmethod
@@ -188,54 +273,149 @@ class OssMapDataset(torch.utils.data.Dataset):
         config_path: str = "",
         transform: Callable[[DataObject], Any] = identity,
         region: str = "",
+        tar_coalesce_gap: int = 0,
+        group_samples: bool = False,
+        **options,
     ):
         """Returns an instance of OssMapDataset using tar file provided.
 
         Args:
-          tar_uri(str): OSS URI of tar archive.
-          tar_index_uri(str): OSS URI of tar index file corresponding to tar archive.
+          tar_uri(str): OSS URI of tar archive, or of a shard manifest generated by 'generate_tar_shards'.
+          tar_index_uri(str): OSS URI of tar index file corresponding to tar archive. Must be empty if 'tar_uri' is a shard manifest.
           endpoint(str): Endpoint of the OSS bucket where the objects are stored.
           cred_path(str): Credential info of the OSS bucket where the objects are stored.
           config_path(str): Configuration file path of the OSS connector.
           transform: Optional callable which is used to transform an DataObject into the desired type.
           cred_provider: OSS credential provider.
           region(str): OSS region. Region will be inferred from 'endpoint' if not set, but this may fail when the endpoint lacks region information.
+          tar_coalesce_gap(int): Maximum bytes of unrequested members that may be read in between two members of a batch
+                                 to merge them into one ranged request. 0 (by default) only merges adjacent members.
+          group_samples(bool): Whether to group members sharing a sample key (e.g. '0001.jpg' and '0001.json') into one sample,
+                               which is passed to transform as a dict keyed by extension, with the sample key as '__key__'.
+                               Dataset indices then refer to samples.
+          options: Options of the dataset, see 'OssMapDataset'.
 
         Returns:
             OssMapDataset: An Map-Style dataset created from tar file.
         """
         log.info(f"Building {cls.__name__} from_tar")
         return cls(
-            endpoint, cred_path, config_path, partial(OssTarIterable.from_tar, tar_uri, tar_index_uri, preload=False),
-            transform=transform, cred_provider=cred_provider, tar_uri=tar_uri, tar_index_uri=tar_index_uri, region=region
+            endpoint, cred_path, config_path,
+            partial(OssTarIterable.from_tar, tar_uri, tar_index_uri, preload=False, group_samples=group_samples),
+            transform=transform, cred_provider=cred_provider, tar_uri=tar_uri, tar_index_uri=tar_index_uri, region=region,
+            tar_coalesce_gap=tar_coalesce_gap, group_samples=group_samples,
+            **options,
         )
 
     def _get_client(self):
-        if self._client is None:
-            self._client = OssClient(self._endpoint, self._cred_path, self._config_path, self._uuid,
-                                     cred_provider=self._cred_provider, region=self._region)
-            log.info("OssMapDataset new client")
-        if self._client_pid is None or self._client_pid != os.getpid():
+        # the shared client of this process (of this DataLoader worker), a copy from another process is not used
+        if self._client is None or self._client_pid != os.getpid():
             worker_info = torch.utils.data.get_worker_info()
-            if worker_info is not None:
-                # reset client id
-                self._client._id = worker_info.id
-                self._client._total = worker_info.num_workers
+            id, total = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+            self._client = get_shared_client(self._endpoint, self._cred_path, self._config_path, self._cred_provider,
+                                             self._region, id, total, str(self._uuid))
+            weakref.finalize(self, release_shared_client, self._client)
             self._client_pid = os.getpid()
+            log.info("OssMapDataset get shared client, id %d, total %d", id, total)
         return self._client
 
-    def _get_transformed_object_safe(self, object: DataObject) -> Any:
+    def _prefetch_concurrency(self) -> int:
+        # the prefetch concurrency of the controller for the stream of a batch, 0 for the configured one
+        if self._prefetch_controller is None:
+            return 0
+        if self._prefetch_controller.limit is None:
+            self._prefetch_controller.start(self._get_client().prefetch_concurrency(DATASET_CONFIG))
+        return self._prefetch_controller.limit
+
+    def _adapted(self, objects: Iterator[DataObject]) -> Iterator[DataObject]:
+        if self._prefetch_controller is None:
+            return objects
+        return record_stream(self._prefetch_controller, objects)
+
+    def _check_object(self, object: DataObject) -> bool:
         eno = object.err()
         if eno != 0:
             errstr = "failed to get next object, errno=%d(%s), msg=%s" % (eno, os.strerror(eno), object.error_msg())
             log.error("OssMapDataset get item %s faild: %s", object.key, errstr)
             if eno == errno.ENOENT:
-                return self._transform(None)
+                return False
             else:
                 raise RuntimeError(errstr)
+        return True
+
+    def _get_transformed_object_safe(self, object: DataObject) -> Any:
+        if self._batch_transform is not None:
+            return self._batch_transform([object if self._check_object(object) else None])[0]
+        if not self._check_object(object):
+            return self._transform(None)
         return self._transform(object)
 
+    def _get_item_safe(self, object: DataObject) -> Any:
+        # with deferred transform, copies are kept and transformed once received
+        if not self._defer_transform:
+            return self._get_transformed_object_safe(object)
+        return own_object(object) if self._check_object(object) else None
+
+    def _get_transformed_items(self, items: Iterable[Any]) -> List[Any]:
+        if not self._defer_transform:
+            return list(items)
+        if self._pipeline is None:
+            return list(iter_batch_transformed(items, self._batch_transform, self._batch_size))
+        # items are received by the pipeline feeder, so that transform overlaps with the remaining downloads
+        if self._batch_transform is not None:
+            transform = adaptive_batch_transform(self._batch_transform, self._batch_size)
+            return list(chain.from_iterable(self._pipeline.imap(transform, iter_batches(items, self._batch_size))))
+        return list(self._pipeline.imap(self._transform, items))
+
+    def warmup(self, n_connections: int = 4) -> Dict[str, float]:
+        """Builds the client of this process and pre-establishes 'n_connections' connections, see 'OssClient.warmup'."""
+        if self._from_tar:
+            bucket, key, _ = self._tar_shards[0]
+        elif self._bucket_objects:
+            bucket, key = parse_oss_uri(self._bucket_objects[0].key)
+        else:
+            bucket, key = "", ""
+        return self._get_client().warmup(n_connections, bucket, key)
+
+    def pipeline_stats(self) -> Dict[str, Any]:
+        """Returns queue depth and stage timings of the transform threads in this process,
+        empty if 'num_transform_workers' is 0."""
+        if self._pipeline is None:
+            return {}
+        return self._pipeline.stats()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns the metrics of the clients of this process and of DataLoader workers, see 'OssClient.get_stats'.
+        Workers publish their metrics at most once per second and when they exit."""
+        snapshots = self._stats_publisher.collect(exclude_pid=os.getpid())
+        if self._client is not None:
+            snapshots.append(self._client.get_stats())
+        return merge_stats(snapshots)
+
+    def _publish_stats(self):
+        if self._client is not None and torch.utils.data.get_worker_info() is not None:
+            self._stats_publisher.publish(self._client.get_stats)
+
     def __getitem__(self, i: int) -> Any:
+        try:
+            if self._profiler is None:
+                return self._get_item(i)
+            with self._profiler.span("getitem", CATEGORY_BATCH, {"index": i}):
+                return self._get_item(i)
+        finally:
+            self._publish_stats()
+
+    def __getitems__(self, indices: List[int]) -> Union[List[Any], PackedBatch]:
+        try:
+            if self._profiler is None:
+                return self._get_items(indices)
+            with self._profiler.span("getitems", CATEGORY_BATCH, {"count": len(indices)}):
+                return self._get_items(indices)
+        finally:
+            self._publish_stats()
+
+    def _get_item(self, i: int) -> Any:
+        start_time = time.perf_counter()
         if not self._from_tar:
             object = self._dataset_bucket_objects[i]
             log.debug("OssMapDataset get item [%d], key: %s, size: %d, label: %s", i, object.key, object.size, object.label)
@@ -244,28 +424,139 @@ class OssMapDataset(torch.utils.data.Dataset):
                 new_object = self._get_client().get_object(bucket, key, 0, label=object.label, type=2)           # mem
             else:
                 new_object = self._get_client().get_object(bucket, key, object.size, label=object.label, type=0) # basic
+        elif self._group_samples:
+            return self.__getitems__([i])[0]
         else:
-            new_object = self._get_client().get_object(bucket=self._tar_bucket, key=self._tar_key, size=i,
-                                                       label=self._tar_index_key, type=3)                        # tar
+            shard, member = self._locate_tar_item(i)
+            tar_bucket, tar_key, tar_index_key = self._tar_shards[shard]
+            new_object = self._get_client().get_object(bucket=tar_bucket, key=tar_key, size=member,
+                                                       label=tar_index_key, type=3)                              # tar
+        if self._profiler is not None:
+            self._profiler.complete("open", CATEGORY_IO, start_time, time.perf_counter(), {"key": new_object.key})
+        if self._transform is identity and self._batch_transform is None:
+            # the object is opened for this item only, no need to copy it
+            return new_object if self._check_object(new_object) else None
         return self._get_transformed_object_safe(new_object)
 
-    def __getitems__(self, indices: List[int]) -> List[Any]:
+    def _get_items(self, indices: List[int]) -> Union[List[Any], PackedBatch]:
         log.debug("OssMapDataset get items %s", indices)
         if not self._from_tar:
             objects = [self._dataset_bucket_objects[i] for i in indices]
-            iter = self._get_client().list_objects_from_uris(objects, prefetch=True, include_errors=True)
+            if self._hedge_policy is not None:
+                iter = self._hedge_policy.iter(objects, self._get_client())
+            else:
+                iter = self._adapted(self._get_client().list_objects_from_uris(
+                    objects, prefetch=True, include_errors=True, prefetch_concurrency=self._prefetch_concurrency()))
+            if self._profiler is not None:
+                iter = self._profiler.iter_waits(iter)
+            if self._batch_buffer_pool is not None:
+                return self._batch_buffer_pool.pack((object, self._check_object(object)) for object in iter)
             # should return list, default collate needs batch be subscriptable
-            return [self._get_transformed_object_safe(object) for object in iter]
+            return self._get_transformed_items(self._get_item_safe(object) for object in iter)
         else:
-            if self.is_continuous(indices):
-                log.debug("OssMapDataset get items, start: %d, length: %d", indices[0], len(indices))
-                iter = self._get_client().list_objects_from_tar(self._tar_bucket, self._tar_key, self._tar_index_key,
-                                                                [indices[0]], [len(indices)], prefetch=True, include_errors=True)
-                return [self._get_transformed_object_safe(object) for object in iter]
-            else:
-                iter = self._get_client().list_objects_from_tar(self._tar_bucket, self._tar_key, self._tar_index_key,
-                                                                indices, [], prefetch=True, include_errors=True)
-                return [self._get_transformed_object_safe(object) for object in iter]
+            if not indices:
+                return []
+            unique = []
+
+            def received_items():
+                for i, item in self._iter_tar_items(indices):
+                    unique.append(i)
+                    yield item
+
+            if self._batch_buffer_pool is not None:
+                # objects are read into the buffer in the order of the streams
+                batch = self._batch_buffer_pool.pack(received_items())
+                positions = {i: p for p, i in enumerate(unique)}
+                return batch.select([positions[i] for i in indices])
+            results = dict(zip(unique, self._get_transformed_items(received_items())))
+            # restore the order of the sampler
+            return [results[i] for i in indices]
+
+    def _iter_tar_items(self, indices: List[int]) -> Iterator[Tuple[int, Any]]:
+        # yields each distinct index with its item, as soon as all its members are received
+        shard_items = {}
+        for i in set(indices):
+            shard, item = self._locate_tar_item(i)
+            shard_items.setdefault(shard, []).append(item)
+        for shard, items in shard_items.items():
+            # one stream at a time, the native library hangs with several prefetch streams open
+            tar_bucket, tar_key, tar_index_key = self._tar_shards[shard]
+            member_items = self._get_tar_member_items(shard, items)
+            chunks = self._plan_tar_chunks(shard, list(member_items))
+            log.debug("OssMapDataset get items, shard: %d, chunks: %s", shard, chunks)
+            iter = self._adapted(self._get_client().list_objects_from_tar(
+                tar_bucket, tar_key, tar_index_key, [start for start, _ in chunks], [length for _, length in chunks],
+                prefetch=True, include_errors=True, prefetch_concurrency=self._prefetch_concurrency()))
+            if self._profiler is not None:
+                iter = self._profiler.iter_waits(iter)
+            shard_start = self._tar_shard_starts[shard]
+            members = (i for start, length in chunks for i in range(start, start + length))
+            if not self._group_samples:
+                for i, object in zip(members, iter):
+                    if i not in member_items:
+                        continue
+                    if self._batch_buffer_pool is not None:
+                        yield shard_start + i, (object, self._check_object(object))
+                    else:
+                        yield shard_start + i, self._get_item_safe(object)
+                continue
+            # members of a sample are consecutive, a sample is complete when the next one starts
+            current, sample = None, None
+            for i, object in zip(members, iter):
+                if i not in member_items:
+                    continue
+                if member_items[i] != current:
+                    if current is not None:
+                        yield shard_start + current, self._get_sample(sample)
+                    current, sample = member_items[i], None
+                if self._check_object(object):
+                    key, ext = tar_sample_key(object.key)
+                    if sample is None:
+                        sample = {"__key__": key}
+                    # the object holds a prefetch buffer of the stream, keep a copy like 'identity' does
+                    sample[ext] = own_object(object)
+            if current is not None:
+                yield shard_start + current, self._get_sample(sample)
+
+    def prefetch_stats(self) -> Dict[str, Any]:
+        """Returns the state of the prefetch controller in this process (prefetch concurrency, throughput and counters
+        of the batches), empty if 'adaptive_prefetch' is not set."""
+        if self._prefetch_controller is None:
+            return {}
+        return self._prefetch_controller.stats()
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        """Returns counters of hedged requests in this process, empty if 'hedge_policy' is not set."""
+        if self._hedge_policy is None:
+            return {}
+        return self._hedge_policy.stats()
+
+    def _get_sample(self, sample: Dict[str, Any]) -> Any:
+        # a sample whose members are all missing is None
+        if self._defer_transform:
+            return sample
+        return self._transform(sample)
+
+    def _locate_tar_item(self, i: int) -> Tuple[int, int]:
+        if len(self._tar_shard_starts) == 1:
+            return 0, i
+        shard = bisect.bisect_right(self._tar_shard_starts, i) - 1
+        return shard, i - self._tar_shard_starts[shard]
+
+    def _get_tar_member_items(self, shard: int, items: List[int]) -> Dict[int, int]:
+        # maps tar members to the dataset items (samples if grouping) they belong to
+        if not self._group_samples:
+            return {item: item for item in items}
+        starts = self._bucket_objects.sample_starts()[shard]
+        return {member: item for item in items for member in range(starts[item], starts[item + 1])}
+
+    def _plan_tar_chunks(self, shard: int, members: List[int]) -> List[Tuple[int, int]]:
+        if self._tar_coalesce_gap <= 0:
+            return plan_tar_chunks(members)
+        if shard not in self._tar_offsets:
+            self._tar_offsets[shard] = tar_member_offsets(self._dataset_bucket_objects.iter_shard(shard))
+            log.info("OssMapDataset get tar member offsets, shard: %d, member num: %d", shard, len(self._tar_offsets[shard]) - 1)
+        return plan_tar_chunks(members, self._tar_coalesce_gap, self._tar_offsets[shard])
 
     def __len__(self):
         size = len(self._dataset_bucket_objects)
@@ -1,7 +1,8 @@
-from ._oss_client import OssClient, DataObject
+from ._oss_client import DataObject, get_shared_client, release_shared_client
 from ._oss_bucket_iterable import parse_oss_uri
 from typing import Dict, Optional, Union, Any
 import logging
+import weakref
 import struct
 import json
 import ctypes
@@ -152,7 +153,8 @@ class OssSafetensor:
             self._config_path = config_path
         self._cred_provider = cred_provider
         self._region = region
-        self._client = OssClient(self._endpoint, self._cred_path, self._config_path, cred_provider=self._cred_provider, region=self._region)
+        self._client = get_shared_client(self._endpoint, self._cred_path, self._config_path, cred_provider=self._cred_provider, region=self._region)
+        weakref.finalize(self, release_shared_client, self._client)
 
     def safe_open(self, oss_uri: str, device: Union[str, int] = "cpu") -> oss_safe_open:
         """Creates a safetensor object from a given oss_uri.
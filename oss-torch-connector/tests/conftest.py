@@ -0,0 +1,59 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from mock_oss_server import MockOssServer, write_client_files
+
+"""
+conftest.py
+    Fixtures of tests against the local mock OSS server of the benchmarks,
+    whose bucket host (<bucket>.localhost) must resolve to 127.0.0.1.
+"""
+
+MOCK_BUCKET = "validate"
+MOCK_REGION = "cn-hangzhou"
+
+
+class MockOss:
+    """A running mock OSS server with the client files of the connector."""
+
+    def __init__(self, server: MockOssServer, cred_path: str, config_path: str):
+        self.server = server
+        self.endpoint = server.endpoint
+        self.bucket = MOCK_BUCKET
+        self.kwargs = {"cred_path": cred_path, "config_path": config_path, "region": MOCK_REGION}
+
+    def uri(self, key: str) -> str:
+        return "oss://%s/%s" % (self.bucket, key)
+
+    def put(self, key: str, data: bytes) -> str:
+        # written to the store of the server directly, uploads are not retried by the native library
+        store = self.server.store
+        tmp_path, f = store.new_file(self.bucket)
+        with f:
+            f.write(data)
+        store.commit(self.bucket, key, tmp_path)
+        return self.uri(key)
+
+
+def start_mock_oss(tmp_path_factory, **server_kwargs) -> MockOss:
+    """Starts a mock OSS server with 'server_kwargs' (see 'MockOssServer'), skips the test if its bucket host
+    does not resolve."""
+    server = MockOssServer(str(tmp_path_factory.mktemp("mock-oss")), host_suffix="localhost", **server_kwargs)
+    try:
+        server.check_bucket(MOCK_BUCKET)
+    except RuntimeError as e:
+        server.server_close()
+        pytest.skip(str(e))
+    server.start(process=True)
+    cred_path, config_path = write_client_files(str(tmp_path_factory.mktemp("mock-oss-client")))
+    return MockOss(server, cred_path, config_path)
+
+
+@pytest.fixture(scope="session")
+def mock_oss(tmp_path_factory) -> MockOss:
+    mock = start_mock_oss(tmp_path_factory, latency=0.001)
+    yield mock
+    mock.server.stop()
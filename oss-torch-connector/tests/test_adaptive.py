@@ -0,0 +1,199 @@
+import errno
+import os
+import pickle
+import pytest
+
+from osstorchconnector import OssCheckpoint, OssMapDataset
+from osstorchconnector._oss_adaptive import AdaptiveController, record_stream
+from osstorchconnector._oss_buffer import OwnedObject
+from osstorchconnector._oss_client import MAX_PREFETCH_CLIENTS, PREFETCH_CONCURRENCY_LEVELS
+from osstorchconnector._oss_connector import new_data_object
+
+
+def sequential(**kwargs) -> AdaptiveController:
+    # throughput of sequential windows is measured over their latencies, so it does not depend on wall time
+    return AdaptiveController(sequential=True, window=1, **kwargs)
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        AdaptiveController(min_limit=0)
+    with pytest.raises(ValueError):
+        AdaptiveController(min_limit=8, max_limit=4)
+    with pytest.raises(ValueError):
+        AdaptiveController(min_limit=1, max_limit=4, levels=[8, 16])
+
+
+def test_increase_while_throughput_grows():
+    controller = sequential(initial_limit=4)
+    controller.record(100, 1.0)
+    assert controller.limit == 5
+    controller.record(200, 1.0)
+    assert controller.limit == 6
+    # within tolerance, kept
+    controller.record(202, 1.0)
+    assert controller.limit == 6
+    assert controller.stats()["increases"] == 2
+
+
+def test_undo_increase_when_throughput_drops():
+    controller = sequential(initial_limit=4)
+    controller.record(100, 1.0)
+    assert controller.limit == 5
+    controller.record(50, 1.0)
+    assert controller.limit == 4
+    # only the last increase is undone
+    controller.record(10, 1.0)
+    assert controller.limit == 4
+
+
+def test_decrease_on_error_and_latency():
+    controller = sequential(initial_limit=16, min_limit=2)
+    controller.record(0, 1.0, error=True)
+    assert controller.limit == 8
+    controller = sequential(initial_limit=16, latency_target=0.5)
+    controller.record(1000, 1.0)
+    assert controller.limit == 8
+    controller.record(1000, 0.1)
+    assert controller.limit == 9
+    controller = sequential(initial_limit=3, min_limit=2)
+    controller.record(0, 1.0, error=True)
+    assert controller.limit == 2
+    stats = controller.stats()
+    assert (stats["errors"], stats["decreases"]) == (1, 1)
+
+
+def test_error_ends_window():
+    controller = AdaptiveController(initial_limit=8, sequential=True, window=4)
+    controller.record(100, 1.0)
+    controller.record(100, 1.0)
+    assert controller.limit == 8
+    controller.record(0, 1.0, error=True)
+    assert controller.limit == 4
+
+
+def test_window_of_limit_records():
+    controller = AdaptiveController(initial_limit=3, sequential=True)
+    controller.record(100, 1.0)
+    controller.record(100, 1.0)
+    assert controller.limit == 3
+    controller.record(100, 1.0)
+    assert controller.limit == 4
+    stats = controller.stats()
+    assert (stats["reads"], stats["bytes"], stats["latency_seconds"]) == (3, 300, 1.0)
+
+
+def test_levels():
+    levels = (1, 2, 4, 8, 16)
+    controller = sequential(initial_limit=3, levels=levels, max_limit=16)
+    # the highest level not above the initial limit
+    assert controller.limit == 2
+    controller.record(100, 1.0)
+    assert controller.limit == 4
+    controller.record(200, 1.0)
+    assert controller.limit == 8
+    controller.record(0, 1.0, error=True)
+    assert controller.limit == 4
+    controller = sequential(initial_limit=16, levels=levels, max_limit=16, decrease=0.3)
+    controller.record(0, 1.0, error=True)
+    assert controller.limit == 4
+    controller = sequential(initial_limit=16, levels=levels, max_limit=16)
+    controller.record(100, 1.0)
+    assert controller.limit == 16
+
+
+def test_start_sets_initial_limit():
+    controller = sequential(initial_limit=0, levels=(1, 2, 4, 8), max_limit=8)
+    assert controller.limit is None
+    controller.start(6)
+    assert controller.limit == 4
+    # a limit already set is kept
+    controller.start(1)
+    assert controller.limit == 4
+    controller = sequential(initial_limit=0, min_limit=2)
+    controller.record(100, 1.0)
+    assert controller.limit == 3
+
+
+def test_pickle():
+    controller = sequential(initial_limit=4)
+    controller.record(100, 1.0)
+    copy = pickle.loads(pickle.dumps(controller))
+    copy.record(200, 1.0)
+    assert copy.limit == 6
+    assert controller.limit == 5
+
+
+def owned(key: str, data: bytes = b"", err: int = 0) -> OwnedObject:
+    obj = OwnedObject(key, len(data), err=err, error_msg=os.strerror(err) if err else "")
+    obj.write(data)
+    obj.seek(0)
+    return obj
+
+
+def test_record_stream():
+    controller = AdaptiveController(initial_limit=4, window=10)
+    objects = [owned("a", b"x" * 10), owned("b", err=errno.ENOENT), owned("c", b"x" * 5)]
+    assert list(record_stream(controller, objects)) == objects
+    stats = controller.stats()
+    assert (stats["reads"], stats["errors"], stats["bytes"]) == (1, 0, 15)
+    assert list(record_stream(controller, [owned("d", b"x"), owned("e", err=errno.EIO)]))[0].key == "d"
+    stats = controller.stats()
+    assert (stats["reads"], stats["errors"], stats["bytes"]) == (2, 1, 16)
+
+
+def test_record_abandoned_stream():
+    controller = AdaptiveController(initial_limit=4, window=10)
+    stream = record_stream(controller, iter([owned("a", b"xy"), owned("b", b"z")]))
+    next(stream)
+    stream.close()
+    stats = controller.stats()
+    assert (stats["reads"], stats["errors"], stats["bytes"]) == (1, 0, 2)
+
+
+def test_adaptive_prefetch_of_map_dataset(mock_oss):
+    data = [os.urandom(1000 + i) for i in range(16)]
+    uris = [mock_oss.put("adaptive/%02d.bin" % i, value) for i, value in enumerate(data)]
+    dataset = OssMapDataset.from_objects(uris, mock_oss.endpoint, transform=lambda obj: obj.read(),
+                                         adaptive_prefetch=True, **mock_oss.kwargs)
+    for _ in range(4):
+        assert dataset.__getitems__(list(range(16))) == data
+    stats = dataset.prefetch_stats()
+    assert (stats["reads"], stats["errors"], stats["bytes"]) == (4, 0, 4 * sum(map(len, data)))
+    assert stats["limit"] in PREFETCH_CONCURRENCY_LEVELS
+
+
+def test_adaptive_read_of_checkpoint(mock_oss):
+    data = os.urandom(3 << 20)
+    uri = mock_oss.put("adaptive/checkpoint.bin", data)
+    checkpoint = OssCheckpoint(mock_oss.endpoint, **mock_oss.kwargs)
+    for _ in range(3):
+        assert checkpoint.read(uri) == data
+    stats = checkpoint.read_stats()
+    assert (stats["reads"], stats["errors"], stats["bytes"]) == (3, 0, 3 * len(data))
+    assert stats["limit"] in PREFETCH_CONCURRENCY_LEVELS
+
+
+def test_prefetch_concurrency_per_stream(mock_oss):
+    data = [os.urandom(100 + i) for i in range(8)]
+    uris = [mock_oss.put("adaptive/stream/%d.bin" % i, value) for i, value in enumerate(data)]
+    checkpoint = OssCheckpoint(mock_oss.endpoint, **mock_oss.kwargs)
+    client = checkpoint._client
+
+    def read(concurrency: int):
+        objects = [new_data_object(uri, len(value), "") for uri, value in zip(uris, data)]
+        return client.list_objects_from_uris(objects, prefetch=True, include_errors=True, prefetch_concurrency=concurrency)
+
+    held = read(3)
+    for concurrency in (1, 4, 8, 16, 32):
+        assert [obj.read() for obj in read(concurrency)] == data
+        assert checkpoint.read(uris[0]) == data[0]
+    # other requests keep the native client of the configuration, unused clients of streams are dropped
+    assert list(client._real_clients) == [None]
+    assert len(client._prefetch_clients) <= MAX_PREFETCH_CLIENTS + 1
+    assert ("datasetConfig", 2, None) in client._prefetch_clients
+    received = [obj.read() for obj in held]
+    del held
+    assert received == data
+    assert all(users == 0 for _, users in client._prefetch_clients.values())
+    assert len(client._prefetch_clients) <= MAX_PREFETCH_CLIENTS
@@ -0,0 +1,33 @@
+import pickle
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader
+
+from osstorchconnector import OssMapDataset, OwnedObject, as_numpy, as_tensor
+
+
+def test_identity_samples_are_not_collated(mock_oss):
+    uris = [mock_oss.put("buffer/%d.bin" % i, bytes([i]) * 8) for i in range(2)]
+    dataset = OssMapDataset.from_objects(uris, mock_oss.endpoint, **mock_oss.kwargs)
+    samples = dataset.__getitems__([0, 1])
+    assert all(isinstance(sample, OwnedObject) for sample in samples)
+    assert [sample.read() for sample in samples] == [b"\0" * 8, b"\1" * 8]
+    # objects are not sequences of bytes, collating them fails as it does for DataObjects
+    with pytest.raises(TypeError):
+        next(iter(DataLoader(dataset, batch_size=2)))
+
+
+def test_owned_object_shares_its_data():
+    obj = OwnedObject("key", 4, "label")
+    obj.write(b"abcd")
+    obj.seek(1)
+    array = as_numpy(obj)
+    assert array.tobytes() == b"bcd" and obj.tell() == 4
+    obj.getbuffer()[1] = ord("x")
+    assert array.tobytes() == b"xcd"
+    obj.seek(0)
+    assert as_tensor(obj).numpy().tobytes() == b"axcd"
+    obj.close()
+    copy = pickle.loads(pickle.dumps(obj))
+    assert (copy.key, copy.size, copy.label, copy.getvalue(), copy.err()) == ("key", 4, "label", b"axcd", 0)
+    assert np.frombuffer(copy.getbuffer(), dtype=np.uint8).size == 4
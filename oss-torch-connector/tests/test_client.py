@@ -0,0 +1,28 @@
+from osstorchconnector import OssCheckpoint
+from osstorchconnector._oss_client import _shared_clients, get_shared_client, release_shared_client
+
+ENDPOINT = "http://oss-cn-hangzhou.aliyuncs.com"
+
+
+def test_shared_client_with_cred_provider():
+    provider, other_provider = object(), object()
+    client = get_shared_client(ENDPOINT, cred_provider=provider, worker_id=1, num_workers=2)
+    try:
+        assert get_shared_client(ENDPOINT, cred_provider=provider, worker_id=1, num_workers=2) is client
+        release_shared_client(client)
+        other = get_shared_client(ENDPOINT, cred_provider=other_provider, worker_id=1, num_workers=2)
+        assert other is not client and other._cred_provider is other_provider
+        release_shared_client(other)
+        assert (client._cred_provider, client._id, client._total) == (provider, 1, 2)
+    finally:
+        release_shared_client(client)
+    assert all(entry[0] is not client for entry in _shared_clients.values())
+
+
+def test_components_share_client():
+    provider = object()
+    # native clients are built on first request
+    first = OssCheckpoint(ENDPOINT, cred_provider=provider)
+    second = OssCheckpoint(ENDPOINT, cred_provider=provider)
+    assert first._client is second._client
+    assert OssCheckpoint(ENDPOINT, cred_path="cred")._client is not first._client
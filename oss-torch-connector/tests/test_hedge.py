@@ -0,0 +1,101 @@
+import errno
+import os
+import pickle
+
+from osstorchconnector import HedgePolicy, OssMapDataset
+from osstorchconnector._oss_hedge import FetchedObject, LatencyTracker
+from conftest import start_mock_oss
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(window=4)
+    assert tracker.quantile(0.5) == 0.0
+    for latency in (5.0, 1.0, 2.0, 3.0, 4.0):
+        tracker.add(latency)
+    # the first latency left the window
+    assert len(tracker) == 4
+    assert tracker.quantile(0.0) == 1.0
+    assert tracker.quantile(0.5) == 3.0
+    assert tracker.quantile(1.0) == 4.0
+
+
+def test_delay_after_min_samples():
+    policy = HedgePolicy(quantile=0.5, min_delay=0.01, min_samples=3)
+    policy._tracker.add(0.5)
+    policy._tracker.add(0.5)
+    assert policy._delay() is None
+    policy._tracker.add(0.001)
+    assert policy._delay() == 0.5
+    policy = HedgePolicy(quantile=0.5, min_delay=0.01, min_samples=1)
+    policy._tracker.add(0.001)
+    assert policy._delay() == 0.01
+
+
+def test_hedge_budget():
+    policy = HedgePolicy(budget_ratio=0.5, budget_burst=2)
+    assert policy._take_token() and policy._take_token()
+    assert not policy._take_token()
+    policy._add_request()
+    assert not policy._take_token()
+    policy._add_request()
+    assert policy._take_token()
+    # tokens are capped by the burst
+    for _ in range(10):
+        policy._add_request()
+    assert policy._take_token() and policy._take_token()
+    assert not policy._take_token()
+    stats = policy.stats()
+    assert (stats["requests"], stats["hedged"], stats["budget_exhausted"]) == (12, 5, 3)
+
+
+def test_pickle_without_workers():
+    policy = HedgePolicy(num_workers=2)
+    policy._executors, policy._executors_pid = ("executor", "executor"), os.getpid()
+    copy = pickle.loads(pickle.dumps(policy))
+    assert copy._executors is None and copy.num_workers == 2
+    policy._executors = None
+
+
+def test_fetched_object():
+    obj = FetchedObject("oss://bucket/key", 0, "label", b"data")
+    assert (obj.size, obj.err(), obj.read()) == (4, 0, b"data")
+    copy = obj.copy()
+    assert (copy.key, copy.label, copy.read()) == ("oss://bucket/key", "label", b"data")
+    missing = FetchedObject("oss://bucket/missing", 10, "", err=errno.ENOENT, error_msg="not found")
+    assert (missing.size, missing.err(), missing.error_msg()) == (10, errno.ENOENT, "not found")
+
+
+def test_hedged_batches(tmp_path_factory):
+    # a fifth of the requests are stragglers, hedges are requested after the median fetch
+    mock = start_mock_oss(tmp_path_factory, latency=0.01, slow_rate=0.2, slow_latency=1.0)
+    policy = HedgePolicy(quantile=0.5, min_samples=8, budget_ratio=1, budget_burst=8, max_hedges=8,
+                         num_workers=8, num_hedge_workers=4)
+    try:
+        data = [os.urandom(100 + i) for i in range(16)]
+        uris = [mock.put("hedge/%02d.bin" % i, value) for i, value in enumerate(data)]
+        uris.append(mock.uri("hedge/missing.bin"))
+        dataset = OssMapDataset.from_objects(uris, mock.endpoint, transform=lambda obj: obj if obj is None else obj.read(),
+                                             hedge_policy=policy, **mock.kwargs)
+        for _ in range(4):
+            assert dataset.__getitems__(list(range(len(uris)))) == data + [None]
+        stats = dataset.hedge_stats()
+        assert stats["requests"] == 4 * len(uris)
+        assert stats["errors"] == 0
+        assert stats["hedged"] > 0
+        assert stats["hedge_wins"] > 0
+        assert stats["delay_seconds"] > 0
+    finally:
+        policy.close()
+        mock.server.stop()
+
+
+def test_close_cancels_queued_fetches(mock_oss):
+    uri = mock_oss.put("hedge/close.bin", b"data")
+    dataset = OssMapDataset.from_objects([uri], mock_oss.endpoint, **mock_oss.kwargs)
+    policy = HedgePolicy(num_workers=1, num_hedge_workers=1)
+    executor, _ = policy._get_executors(dataset._get_client())
+    futures = [policy._submit(executor, FetchedObject(uri, 4, "")) for _ in range(20)]
+    policy.close()
+    # at most the running request and those passed to the worker are not cancelled
+    assert sum(future.cancelled() for future in futures) >= 15
+    assert policy._executors is None and not policy._futures
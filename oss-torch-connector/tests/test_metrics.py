@@ -0,0 +1,131 @@
+import os
+import pickle
+import pytest
+
+from osstorchconnector import stats_to_prometheus
+from osstorchconnector._oss_buffer import OwnedObject
+from osstorchconnector._oss_metrics import LATENCY_BUCKETS, Metrics, merge_stats
+
+
+def test_observe_cumulative_buckets():
+    metrics = Metrics()
+    metrics.observe("get", 0.003)
+    metrics.observe("get", 0.2, error=True)
+    metrics.observe("get", 60.0)
+    stats = metrics.snapshot()["ops"]["get"]
+    assert (stats["count"], stats["errors"]) == (3, 1)
+    assert stats["seconds_sum"] == pytest.approx(60.203)
+    expected = [sum(seconds <= bound for seconds in (0.003, 0.2, 60.0)) for bound in LATENCY_BUCKETS]
+    assert stats["buckets"] == expected
+
+
+def test_timed():
+    metrics = Metrics()
+    with metrics.timed("put"):
+        assert metrics.snapshot()["gauges"]["in_flight"] == 1
+    with pytest.raises(KeyError):
+        with metrics.timed("put"):
+            raise KeyError("key")
+    snapshot = metrics.snapshot()
+    assert (snapshot["ops"]["put"]["count"], snapshot["ops"]["put"]["errors"]) == (2, 1)
+    assert snapshot["gauges"]["in_flight"] == 0
+
+
+def test_timed_stream_observed_once():
+    metrics = Metrics()
+    stream = metrics.timed_stream("list", [OwnedObject("a", 3), OwnedObject("b", 4)])
+    assert len(stream) == 2
+    assert [obj.key for obj in stream] == ["a", "b"]
+    snapshot = metrics.snapshot()
+    assert snapshot["ops"]["list"]["count"] == 1
+    counters = snapshot["counters"]
+    assert (counters["objects_received"], counters["bytes_received"]) == (2, 7)
+    assert counters.get("prefetch_hits_estimated", 0) + counters.get("prefetch_misses_estimated", 0) == 2
+    assert snapshot["gauges"]["open_streams"] == 0
+    # an empty stream is observed at its end
+    assert list(metrics.timed_stream("list", [])) == []
+    assert metrics.snapshot()["ops"]["list"]["count"] == 2
+
+
+def test_timed_stream_errors():
+    def failing(first: bool):
+        if not first:
+            yield OwnedObject("a", 1)
+        raise IOError("stream failed")
+
+    metrics = Metrics()
+    for first in (True, False):
+        with pytest.raises(IOError):
+            list(metrics.timed_stream("list", failing(first)))
+    snapshot = metrics.snapshot()
+    # the stream failing after its first object is counted as an error without another observation
+    assert (snapshot["ops"]["list"]["count"], snapshot["ops"]["list"]["errors"]) == (2, 2)
+    assert snapshot["gauges"]["open_streams"] == 0
+
+
+def test_pickled_metrics_are_empty():
+    metrics = Metrics()
+    metrics.inc("bytes_opened", 10)
+    assert pickle.loads(pickle.dumps(metrics)).snapshot() == {"ops": {}, "counters": {}, "gauges": {}}
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_reset_after_fork():
+    metrics = Metrics()
+    metrics.inc("bytes_opened", 10)
+    # held by another thread of the parent at fork
+    metrics._lock.acquire()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            metrics.inc("bytes_opened", 1)
+            os._exit(0 if metrics.snapshot()["counters"] == {"bytes_opened": 1} else 1)
+        finally:
+            os._exit(2)
+    metrics._lock.release()
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    assert metrics.snapshot()["counters"] == {"bytes_opened": 10}
+
+
+def snapshot(count: int, errors: int, seconds: float, counters: dict, gauges: dict) -> dict:
+    buckets = [count if seconds <= bound else 0 for bound in LATENCY_BUCKETS]
+    return {"ops": {"get": {"count": count, "errors": errors, "seconds_sum": count * seconds, "buckets": buckets}},
+            "counters": counters, "gauges": gauges}
+
+
+def test_merge_stats():
+    merged = merge_stats([
+        snapshot(2, 1, 0.002, {"bytes_received": 10}, {"in_flight": 1}),
+        snapshot(3, 0, 0.2, {"bytes_received": 5, "objects_received": 2}, {"in_flight": 2, "open_streams": 1}),
+        {"ops": {}, "counters": {}, "gauges": {}},
+    ])
+    get = merged["ops"]["get"]
+    assert (get["count"], get["errors"]) == (5, 1)
+    assert get["seconds_sum"] == pytest.approx(0.604)
+    assert get["buckets"] == [2 + (3 if 0.2 <= bound else 0) if 0.002 <= bound else 0 for bound in LATENCY_BUCKETS]
+    assert merged["counters"] == {"bytes_received": 15, "objects_received": 2}
+    assert merged["gauges"] == {"in_flight": 3, "open_streams": 1}
+    assert merge_stats([]) == {"ops": {}, "counters": {}, "gauges": {}}
+
+
+def test_stats_to_prometheus():
+    text = stats_to_prometheus(snapshot(2, 1, 0.002, {"bytes_received": 10}, {"in_flight": 1}),
+                               prefix="oss", labels={"worker": 'a"b'})
+    lines = text.splitlines()
+    assert "# TYPE oss_op_latency_seconds histogram" in lines
+    assert 'oss_op_latency_seconds_bucket{le="0.001",op="get",worker="a\\"b"} 0' in lines
+    assert 'oss_op_latency_seconds_bucket{le="0.005",op="get",worker="a\\"b"} 2' in lines
+    assert 'oss_op_latency_seconds_bucket{le="+Inf",op="get",worker="a\\"b"} 2' in lines
+    assert 'oss_op_latency_seconds_sum{op="get",worker="a\\"b"} 0.004000' in lines
+    assert 'oss_op_latency_seconds_count{op="get",worker="a\\"b"} 2' in lines
+    assert 'oss_op_errors_total{op="get",worker="a\\"b"} 1' in lines
+    assert lines[lines.index("# TYPE oss_bytes_received_total counter") + 1] == 'oss_bytes_received_total{worker="a\\"b"} 10'
+    assert lines[lines.index("# TYPE oss_in_flight gauge") + 1] == 'oss_in_flight{worker="a\\"b"} 1'
+    assert text.endswith("\n")
+
+
+def test_stats_to_prometheus_without_labels():
+    assert stats_to_prometheus({"counters": {"bytes_received": 1}}) == \
+        "# TYPE oss_connector_bytes_received_total counter\noss_connector_bytes_received_total 1\n"
+    assert stats_to_prometheus({}) == "\n"
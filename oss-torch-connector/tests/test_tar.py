@@ -0,0 +1,98 @@
+from collections import namedtuple
+import pytest
+
+from osstorchconnector._oss_tar_iterable import (TAR_BLOCK_SIZE, group_tar_samples, plan_tar_chunks, split_tar_chunks,
+                                                  tar_member_offsets, tar_sample_key, tar_sample_starts)
+from osstorchconnector._oss_buffer import OwnedObject
+
+# a tar member as listed from a tar index
+Member = namedtuple("Member", ["key", "size"])
+
+
+def received(key: str, data: bytes) -> OwnedObject:
+    # a tar member as received from a stream, already owned
+    obj = OwnedObject(key, len(data))
+    obj.write(data)
+    obj.seek(0)
+    return obj
+
+
+def test_plan_tar_chunks_merges_adjacent_members():
+    assert plan_tar_chunks([]) == []
+    assert plan_tar_chunks([3]) == [(3, 1)]
+    assert plan_tar_chunks([0, 1, 2, 5, 6, 9]) == [(0, 3), (5, 2), (9, 1)]
+
+
+def test_plan_tar_chunks_sorts_and_deduplicates():
+    assert plan_tar_chunks([6, 2, 5, 2, 1, 6]) == [(1, 2), (5, 2)]
+
+
+def test_plan_tar_chunks_ignores_gap_without_offsets():
+    assert plan_tar_chunks([0, 2], max_gap=1 << 30) == [(0, 1), (2, 1)]
+
+
+def test_plan_tar_chunks_merges_members_within_gap():
+    # members of one block of data each, 2 blocks per member with the header
+    offsets = tar_member_offsets(Member("%d.bin" % i, TAR_BLOCK_SIZE) for i in range(10))
+    member_bytes = 2 * TAR_BLOCK_SIZE
+    assert plan_tar_chunks([0, 2], max_gap=member_bytes, offsets=offsets) == [(0, 3)]
+    assert plan_tar_chunks([0, 3], max_gap=member_bytes, offsets=offsets) == [(0, 1), (3, 1)]
+    assert plan_tar_chunks([0, 3, 5, 9], max_gap=2 * member_bytes, offsets=offsets) == [(0, 6), (9, 1)]
+    assert plan_tar_chunks([0, 2], max_gap=0, offsets=offsets) == [(0, 1), (2, 1)]
+
+
+def test_tar_member_offsets():
+    sizes = [0, 1, TAR_BLOCK_SIZE, TAR_BLOCK_SIZE + 1]
+    offsets = tar_member_offsets(Member("%d.bin" % i, size) for i, size in enumerate(sizes))
+    # a header block, then the data padded to whole blocks
+    assert list(offsets) == [blocks * TAR_BLOCK_SIZE for blocks in (0, 1, 3, 5, 8)]
+
+
+def test_split_tar_chunks_within_shards():
+    assert list(split_tar_chunks([(0, 2), (12, 3)], [10, 5])) == [(0, (0, 2)), (1, (2, 3))]
+
+
+def test_split_tar_chunks_across_shards():
+    # members 8..11 span the end of shard 0 and the start of shard 1, 14..21 three shards
+    assert list(split_tar_chunks([(8, 4)], [10, 5])) == [(0, (8, 2)), (1, (0, 2))]
+    assert list(split_tar_chunks([(14, 8)], [10, 5, 3, 10])) == [(1, (4, 1)), (2, (0, 3)), (3, (0, 4))]
+
+
+def test_split_tar_chunks_skips_empty_shards():
+    assert list(split_tar_chunks([(0, 4)], [2, 0, 2])) == [(0, (0, 2)), (2, (0, 2))]
+
+
+def test_split_tar_chunks_out_of_range():
+    with pytest.raises(IndexError):
+        list(split_tar_chunks([(14, 2)], [10, 5]))
+
+
+def test_tar_sample_key():
+    assert tar_sample_key("0001.jpg") == ("0001", "jpg")
+    assert tar_sample_key("train/0001.seg.png") == ("train/0001", "seg.png")
+    assert tar_sample_key("a.b/0001") == ("a.b/0001", "")
+
+
+def test_tar_sample_starts():
+    names = ["0001.jpg", "0001.json", "0002.jpg", "0003.jpg", "0003.json", "0003.txt"]
+    assert list(tar_sample_starts(Member(name, 1) for name in names)) == [0, 2, 3, 6]
+    assert list(tar_sample_starts([])) == [0]
+
+
+def test_group_tar_samples():
+    members = [received("0001.jpg", b"a"), received("0001.json", b"b"), received("0002.jpg", b"c"),
+               received("dir/0002.jpg", b"d")]
+    samples = list(group_tar_samples(members))
+    assert [sorted(sample) for sample in samples] == [["__key__", "jpg", "json"], ["__key__", "jpg"], ["__key__", "jpg"]]
+    assert [sample["__key__"] for sample in samples] == ["0001", "0002", "dir/0002"]
+    assert samples[0]["jpg"].read() == b"a"
+    assert samples[0]["json"].read() == b"b"
+    assert samples[2]["jpg"].read() == b"d"
+
+
+def test_group_tar_samples_of_non_consecutive_members():
+    # only consecutive members are grouped, as in WebDataset
+    samples = list(group_tar_samples([received("0001.jpg", b""), received("0002.jpg", b""), received("0001.json", b"")]))
+    assert [(sample["__key__"], sorted(sample)) for sample in samples] == [
+        ("0001", ["__key__", "jpg"]), ("0002", ["__key__", "jpg"]), ("0001", ["__key__", "json"])]
+    assert list(group_tar_samples([])) == []
@@ -0,0 +1,47 @@
+import time
+import pytest
+
+from osstorchconnector._oss_transform import AdaptiveBatchSize, TransformPipeline, iter_batch_transformed
+
+
+def test_pipeline_keeps_order():
+    pipeline = TransformPipeline(num_workers=4, queue_depth=2)
+
+    def transform(i: int) -> int:
+        # a slow call does not reorder the results after it
+        time.sleep(0.05 if i % 5 == 0 else 0.0)
+        return i * 2
+
+    assert list(pipeline.imap(transform, range(20))) == [i * 2 for i in range(20)]
+    stats = pipeline.stats()
+    assert (stats["objects"], stats["queue_depth"]) == (20, 0)
+    assert 0 < stats["max_queue_depth"] <= 2
+
+
+def test_pipeline_error():
+    pipeline = TransformPipeline(num_workers=2)
+
+    def failing(i: int) -> int:
+        if i == 3:
+            raise ValueError("bad object")
+        return i
+
+    results = pipeline.imap(failing, range(10))
+    assert [next(results) for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def test_iter_batch_transformed():
+    batch_size = AdaptiveBatchSize(max_size=8, initial_size=2)
+    calls = []
+
+    def batch_transform(objects):
+        calls.append(len(objects))
+        return [obj + 1 for obj in objects]
+
+    assert list(iter_batch_transformed(range(10), batch_transform, batch_size)) == list(range(1, 11))
+    # fast batches double the size
+    assert calls[:3] == [2, 4, 4]
+    with pytest.raises(ValueError):
+        list(iter_batch_transformed(range(3), lambda objects: objects[:1], batch_size))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark range coalescing of OssMapDataset tar batches
+
+This script samples shuffled batches from a tar archive and reads them through
+the per-index path (one ranged request per member) and through the coalesced
+path with each of the given gaps, reporting request count and throughput.
+
+Usage:
+    python benchmark_tar_coalescing.py --endpoint <endpoint> --cred-path <cred_path> --config-path <config_path> \
+                                       --tar-path <tar_uri> --index-path <index_uri> \
+                                       --batch-size 256 --batches 20 --gaps 0 65536 1048576
+"""
+
+from osstorchconnector import OssClient
+from osstorchconnector._oss_bucket_iterable import parse_oss_uri
+from osstorchconnector._oss_tar_iterable import plan_tar_chunks, tar_member_offsets
+import argparse
+import json
+import random
+import time
+
+parser = argparse.ArgumentParser(description='Benchmark range coalescing of tar batches')
+parser.add_argument('-ep', '--endpoint', type=str, help='Endpoint of the OSS bucket where the objects are stored.')
+parser.add_argument('--cred-path', type=str, help='Credential info of the OSS bucket where the objects are stored.')
+parser.add_argument('--config-path', type=str, default='', help='Configuration file path of the OSS connector.')
+parser.add_argument('--tar-path', type=str, help='OSS URI of the tar archive.')
+parser.add_argument('--index-path', type=str, help='OSS URI of the tar index.')
+parser.add_argument('--batch-size', type=int, default=256, help='Number of members per batch.')
+parser.add_argument('--batches', type=int, default=20, help='Number of batches to read for each mode.')
+parser.add_argument('--gaps', type=int, nargs='+', default=[0, 64 * 1024, 1024 * 1024],
+                    help='Coalescing gaps (bytes) to benchmark.')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the batch sampler.')
+
+
+def read_batch(client, bucket, tar_key, index_key, indices, starts, sizes):
+    # only bytes of requested members are counted, over-read members are dropped
+    if sizes:
+        members = (i for start, size in zip(starts, sizes) for i in range(start, start + size))
+    else:
+        members = iter(starts)
+    wanted = set(indices)
+    nbytes = 0
+    for i, obj in zip(members, client.list_objects_from_tar(bucket, tar_key, index_key, starts, sizes,
+                                                            prefetch=True, include_errors=True)):
+        if i in wanted:
+            nbytes += len(obj.read())
+    return nbytes
+
+
+def run(client, bucket, tar_key, index_key, batches, plan):
+    requests = 0
+    nbytes = 0
+    start_time = time.time()
+    for indices in batches:
+        starts, sizes = plan(indices)
+        requests += len(starts)
+        nbytes += read_batch(client, bucket, tar_key, index_key, indices, starts, sizes)
+    elapsed = time.time() - start_time
+    return {
+        "requests": requests,
+        "requests_per_batch": requests / len(batches),
+        "bytes": nbytes,
+        "seconds": elapsed,
+        "throughput_mb_s": nbytes / elapsed / 1024 / 1024 if elapsed > 0 else 0,
+    }
+
+
+def main():
+    args = parser.parse_args()
+    bucket, tar_key = parse_oss_uri(args.tar_path)
+    _, index_key = parse_oss_uri(args.index_path)
+    client = OssClient(args.endpoint, args.cred_path, args.config_path)
+
+    members = list(client.list_objects_from_tar(bucket, tar_key, index_key))
+    offsets = tar_member_offsets(members)
+    rng = random.Random(args.seed)
+    batches = [rng.sample(range(len(members)), min(args.batch_size, len(members))) for _ in range(args.batches)]
+
+    results = {"members": len(members), "batch_size": args.batch_size, "batches": args.batches}
+    results["per_index"] = run(client, bucket, tar_key, index_key, batches, lambda indices: (indices, []))
+    for gap in args.gaps:
+        def plan(indices, gap=gap):
+            chunks = plan_tar_chunks(indices, gap, offsets)
+            return [start for start, _ in chunks], [length for _, length in chunks]
+        results["coalesced_gap_%d" % gap] = run(client, bucket, tar_key, index_key, batches, plan)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,13 @@ Usage:
     2. Generate tar index from existing tar archive:
     python generate_tar_archive.py --endpoint <endpoint> --cred-path <cred_path> --config-path <config_path> \
                                    --tar-path <tar_path> --index-path <index_path> --index-only
+    3. Generate size-bounded tar shards, their indices and a shard manifest from source in parallel:
+    python generate_tar_archive.py --endpoint <endpoint> --cred-path <cred_path> --config-path <config_path> \
+                                   --output-path <output_path> --source-path <source_path> \
+                                   --shard-size <shard_size> --num-workers <num_workers>
 """
 
-from osstorchconnector import generate_tar_archive
+from osstorchconnector import generate_tar_archive, generate_tar_shards
 import argparse
 
 parser = argparse.ArgumentParser(description='Generate tar archive and its index')
@@ -28,10 +32,18 @@ parser.add_argument('--index-path', type=str, help='Path to the tar index. (OSS
 parser.add_argument('--source-path', type=str, help='Path to the source directory. (OSS URI or local path)')
 parser.add_argument('--index-only', action='store_true', help='''If True, generate tar index from tar archive specified by 'tar_path',
                     otherwise (by default) generate tar archive and its index from source directory specified by 'source_path'.''')
+parser.add_argument('--output-path', type=str, help='Directory of tar shards and the shard manifest. (OSS URI or local path)')
+parser.add_argument('--shard-size', type=int, default=1 << 30, help='Maximum size in bytes of each tar shard.')
+parser.add_argument('--num-workers', type=int, default=8, help='Number of tar shards generated concurrently.')
 
 
 def main():
     args = parser.parse_args()
+    if args.output_path:
+        manifest_path = generate_tar_shards(args.endpoint, args.cred_path, args.config_path, args.source_path,
+                                            args.output_path, args.shard_size, args.num_workers)
+        print(manifest_path)
+        return
     generate_tar_archive(args.endpoint, args.cred_path, args.config_path, args.tar_path, args.index_path, args.source_path, args.index_only)
 
 
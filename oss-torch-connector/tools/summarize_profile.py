@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+Summarize traces recorded by osstorchconnector.Profiler
+
+This script reads the per-process trace files of a trace directory and reports,
+per event, the count, total and quantiles of durations, then attributes data
+loading time to I/O (waits for OSS objects, opens, ranged reads) versus CPU
+(transforms, deserialization). If the training loop was wrapped with
+'Profiler.iter_steps', the time it waited for batches is attributed as well.
+The trace files can also be opened directly in chrome://tracing or Perfetto.
+
+Usage:
+    python summarize_profile.py <trace_dir> [--json]
+"""
+
+from osstorchconnector import summarize_traces
+import argparse
+import json
+
+parser = argparse.ArgumentParser(description='Summarize traces recorded by osstorchconnector.Profiler')
+parser.add_argument('trace_dir', type=str, help='Directory of the trace files.')
+parser.add_argument('--json', action='store_true', help='Print the summary as JSON.')
+
+
+def main():
+    args = parser.parse_args()
+    summary = summarize_traces(args.trace_dir)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print("processes: %d" % summary["processes"])
+    print("%-16s %-6s %10s %12s %10s %10s" % ("event", "cat", "count", "total_ms", "p50_ms", "p99_ms"))
+    for name, event in summary["events"].items():
+        print("%-16s %-6s %10d %12.1f %10.3f %10.3f" % (name, event["category"], event["count"], event["total_ms"],
+                                                        event["p50_ms"], event["p99_ms"]))
+    print("io: %.2f s, cpu: %.2f s, io share: %.1f%%" % (summary["io_seconds"], summary["cpu_seconds"], summary["io_share"] * 100))
+    if "steps" in summary:
+        loop = summary["loop_seconds"]
+        print("steps: %d, loop: %.2f s, waiting for data: %.2f s (%.1f%%), of which io: %.2f s, cpu: %.2f s" % (
+            summary["steps"], loop, summary["stall_seconds"], summary["stall_seconds"] / loop * 100 if loop > 0 else 0,
+            summary["stall_io_seconds"], summary["stall_cpu_seconds"]))
+
+
+if __name__ == "__main__":
+    main()